@@ -0,0 +1,74 @@
+"""Compare the `.plomp` binary format against JSON: file size, write and read
+throughput, and the time to read a single item from the middle of a trace.
+
+    PLOMP_TYPECHECK=0 python benchmarks/bench_binary.py --items 1000000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import plomp
+
+
+def _time(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    buffer = plomp.PlompBuffer(timestamp_fn=plomp.monotonic_ns_clock())
+    payload = {"value": 1.0, "text": "accessed weather data from API"}
+    for i in range(args.items):
+        if i % 2:
+            plomp.record_event(payload, tags={"tool": "weather_api"}, buffer=buffer)
+        else:
+            plomp.record_prompt(
+                f"What's the weather like on day {i}?",
+                tags={"model": "a"},
+                buffer=buffer,
+            ).complete("Sunny, with a chance of rain later in the afternoon.")
+
+    middle = args.items // 2
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "trace.json")
+        binary_path = os.path.join(directory, "trace.plomp")
+        rows = []
+        for name, write, read, path in [
+            ("json", plomp.write_json, plomp.read_json, json_path),
+            ("binary", plomp.write_binary, plomp.read_binary, binary_path),
+        ]:
+            write_time, _ = _time(lambda: write(buffer, path))
+            read_time, _ = _time(lambda: read(plomp.PlompBuffer(), path))
+            rows.append((name, os.path.getsize(path), write_time, read_time))
+
+        def json_item():
+            with open(json_path) as f:
+                return json.load(f)["buffer_items"][middle]
+
+        def binary_item():
+            with plomp.PlompBinaryReader(binary_path) as reader:
+                return reader[middle]
+
+        json_item_time, _ = _time(json_item)
+        binary_item_time, _ = _time(binary_item)
+
+    for name, size, write_time, read_time in rows:
+        print(
+            f"{name:7} {size / 2**20:8.1f} MiB  "
+            f"write {args.items / write_time:9.0f} items/s  "
+            f"read {args.items / read_time:9.0f} items/s"
+        )
+    print(f"item {middle}: json {json_item_time * 1e3:.1f} ms, ", end="")
+    print(f"binary {binary_item_time * 1e3:.1f} ms (including opening the file)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compare `where` with a `plomp.col` expression against a per-item callable.
+
+Expressions are evaluated over the buffer's columns, with NumPy when it is
+installed and with pure-Python loops otherwise.
+
+    PLOMP_TYPECHECK=0 python benchmarks/bench_expressions.py --items 1000000
+"""
+
+import argparse
+import time
+
+import plomp
+from plomp import _expressions, col
+
+
+def _time(buffer: plomp.PlompBuffer, fn) -> tuple[float, int]:
+    # Time the evaluation itself, not a query cache hit.
+    buffer._query_cache.clear()
+    start = time.perf_counter()
+    matches = len(fn())
+    return time.perf_counter() - start, matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    buffer = plomp.PlompBuffer(
+        key="bench_expressions", timestamp_fn=plomp.monotonic_ns_clock()
+    )
+    for i in range(args.items):
+        plomp.record_prompt(
+            f"prompt {i}", tags={"model": f"model-{i % 5}"}, buffer=buffer
+        ).complete("response")
+
+    expression = (col.tag("model") == "model-3") & (col.latency < 1.0)
+    results = {
+        "callable": _time(
+            buffer,
+            lambda: buffer.where(
+                truth_fn=lambda item: (
+                    item.tags["model"] == "model-3" and expression(item)
+                )
+            ),
+        ),
+    }
+    if _expressions.np is not None:
+        results["numpy"] = _time(buffer, lambda: buffer.where(expression))
+    _expressions.np = None
+    results["pure python"] = _time(buffer, lambda: buffer.where(expression))
+
+    for name, (elapsed, matches) in results.items():
+        print(f"{name:12} {elapsed * 1e3:10.1f} ms  ({matches} matches)")
+
+
+if __name__ == "__main__":
+    main()
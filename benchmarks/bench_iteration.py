@@ -0,0 +1,58 @@
+"""Measure the per-item cost of iterating a `PlompBuffer`.
+
+Compares the current zero-copy iteration against the previous behaviour, which
+deep-copied every item as it was yielded.
+
+    python benchmarks/bench_iteration.py --items 100000
+"""
+
+import argparse
+import time
+from copy import deepcopy
+
+import plomp
+
+
+def _populate(buffer: plomp.PlompBuffer, n_items: int):
+    for i in range(n_items):
+        if i % 2:
+            plomp.record_event(
+                {"plomp_display_text": f"event {i}", "value": i},
+                tags={"domain": "weather", "location": "London"},
+                buffer=buffer,
+            )
+        else:
+            handle = plomp.record_prompt(
+                f"prompt number {i}", tags={"model": "gpt4"}, buffer=buffer
+            )
+            handle.complete(f"response number {i}")
+
+
+def _time_per_item(iterable_fn, n_items: int) -> float:
+    start = time.perf_counter()
+    for _ in iterable_fn():
+        pass
+    return (time.perf_counter() - start) / n_items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=100_000)
+    args = parser.parse_args()
+
+    buffer = plomp.PlompBuffer(key="bench_iteration")
+    _populate(buffer, args.items)
+
+    deepcopy_cost = _time_per_item(
+        lambda: (deepcopy(item) for item in buffer), args.items
+    )
+    zero_copy_cost = _time_per_item(lambda: iter(buffer), args.items)
+
+    print(f"items:                  {args.items}")
+    print(f"before (deepcopy/item): {deepcopy_cost * 1e9:10.1f} ns")
+    print(f"after  (view/item):     {zero_copy_cost * 1e9:10.1f} ns")
+    print(f"speedup:                {deepcopy_cost / zero_copy_cost:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compare `slowest` and `latency_histogram` against sorting item latencies.
+
+Latencies are read from the buffer's latency column, with NumPy when it is
+installed and with pure-Python loops otherwise.
+
+    PLOMP_TYPECHECK=0 python benchmarks/bench_latency.py --items 1000000
+"""
+
+import argparse
+import random
+import time
+
+import plomp
+from plomp import _latency
+
+
+def _time(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def _sorted_slowest(buffer: plomp.PlompBuffer, k: int) -> list[int]:
+    latencies = []
+    for index, item in zip(buffer.indices, buffer):
+        completion = item.call_trace.completion
+        if completion is not None:
+            latency = completion.completion_timestamp - item.timestamp
+            latencies.append((latency.total_seconds(), index))
+    latencies.sort(reverse=True)
+    return sorted(index for _, index in latencies[:k])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    now = [0]
+    buffer = plomp.PlompBuffer(key="bench_latency", timestamp_fn=lambda: now[0])
+    rng = random.Random(0)
+    for i in range(args.items):
+        handle = plomp.record_prompt(f"prompt {i}", buffer=buffer)
+        now[0] += int(rng.expovariate(1.0) * 1e9)
+        handle.complete("response")
+        now[0] += 1_000_000
+
+    edges = [0.1, 0.5, 1.0, 2.0, 5.0]
+    results = {"sort items": _time(lambda: _sorted_slowest(buffer, args.k))}
+    if _latency.np is not None:
+        results["numpy slowest"] = _time(
+            lambda: buffer.slowest(args.k).matched_indices.tolist()
+        )
+        results["numpy histogram"] = _time(lambda: buffer.latency_histogram(edges))
+    _latency.np = None
+    buffer._query_cache.clear()
+    results["python slowest"] = _time(
+        lambda: buffer.slowest(args.k).matched_indices.tolist()
+    )
+    results["python histogram"] = _time(lambda: buffer.latency_histogram(edges))
+
+    for name, (elapsed, result) in results.items():
+        print(f"{name:16} {elapsed * 1e3:10.1f} ms  {result}")
+
+
+if __name__ == "__main__":
+    main()
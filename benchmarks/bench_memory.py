@@ -0,0 +1,96 @@
+"""Compare the memory used per item by the columnar store against a plain list of
+`PlompBufferItem` objects (the previous storage layout).
+
+Prompt, response and payload objects are created up front and shared by both
+layouts, so the numbers reflect per-item overhead only.
+
+    python benchmarks/bench_memory.py --items 1000000
+"""
+
+import argparse
+import datetime as dt
+import gc
+import tracemalloc
+
+import plomp
+from plomp._buffer_items import freeze_mapping
+
+
+def _measure(build_fn) -> tuple[int, object]:
+    gc.collect()
+    tracemalloc.start()
+    result = build_fn()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    start = dt.datetime(2025, 1, 1)
+    prompts = [f"prompt {i % 1000}" for i in range(1000)]
+    tags = freeze_mapping({"domain": "weather", "model": "gpt4"})
+    payload = freeze_mapping({"value": 1.0})
+
+    def timestamps():
+        i = 0
+        while True:
+            yield start + dt.timedelta(milliseconds=i)
+            i += 1
+
+    def build_rows():
+        rows = []
+        for i, timestamp in zip(range(args.items), timestamps()):
+            if i % 2:
+                rows.append(
+                    plomp.PlompBufferItem(
+                        timestamp,
+                        tags,
+                        plomp.PlompBufferItemType.EVENT,
+                        plomp.PlompEvent(payload=payload),
+                    )
+                )
+            else:
+                rows.append(
+                    plomp.PlompBufferItem(
+                        timestamp,
+                        tags,
+                        plomp.PlompBufferItemType.PROMPT,
+                        plomp.PlompCallTrace(
+                            prompts[i % 1000],
+                            completion=plomp.PlompCallCompletion(
+                                completion_timestamp=timestamp + dt.timedelta(1),
+                                response=prompts[0],
+                            ),
+                        ),
+                    )
+                )
+        return rows
+
+    def build_buffer():
+        timestamp_iter = timestamps()
+        buffer = plomp.PlompBuffer(timestamp_fn=lambda: next(timestamp_iter))
+        for i in range(args.items):
+            if i % 2:
+                buffer._record_event(payload, tags)
+            else:
+                handle = buffer._record_prompt_start(prompts[i % 1000], tags)
+                handle.complete(prompts[0])
+        return buffer
+
+    rows_bytes, rows = _measure(build_rows)
+    del rows
+    columnar_bytes, buffer = _measure(build_buffer)
+
+    print(f"items:            {args.items}")
+    print(f"list of items:    {rows_bytes / args.items:8.1f} bytes/item")
+    print(f"columnar buffer:  {columnar_bytes / args.items:8.1f} bytes/item")
+    print(f"reduction:        {rows_bytes / columnar_bytes:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
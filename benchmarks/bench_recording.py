@@ -0,0 +1,100 @@
+"""Measure recording throughput with and without runtime type checking, one
+record at a time and in batches through `record_many`.
+
+Each mode runs in a fresh interpreter because `PLOMP_TYPECHECK` is read when
+plomp is imported.
+
+    python benchmarks/bench_recording.py --records 100000
+"""
+
+import argparse
+import datetime as dt
+import os
+import subprocess
+import sys
+import time
+
+
+def _run_workload(n_records: int) -> float:
+    import plomp
+
+    buffer = plomp.PlompBuffer(key="bench_recording")
+    tags = {"domain": "weather", "model": "gpt4"}
+    payload = {"value": 1.0}
+
+    start = time.perf_counter()
+    for i in range(n_records // 2):
+        plomp.record_prompt("What is the weather?", tags=tags, buffer=buffer).complete(
+            "Sunny"
+        )
+        plomp.record_event(payload, tags=tags, buffer=buffer)
+    elapsed = time.perf_counter() - start
+    return n_records / elapsed
+
+
+def _run_batched_workload(n_records: int, batch_size: int) -> float:
+    import plomp
+
+    # Same records as `_run_workload`: completed prompts and events, in halves.
+    buffer = plomp.PlompBuffer(key="bench_recording_batched")
+    tags = {"domain": "weather", "model": "gpt4"}
+    payload = {"value": 1.0}
+
+    start = time.perf_counter()
+    for _ in range(n_records // batch_size):
+        now = dt.datetime.now()
+        call = plomp.PlompCallTrace(
+            "What is the weather?",
+            completion=plomp.PlompCallCompletion(
+                completion_timestamp=now, response="Sunny"
+            ),
+        )
+        buffer.record_many(
+            [call, payload] * (batch_size // 2), tags=tags, timestamp=now
+        )
+    elapsed = time.perf_counter() - start
+    return n_records / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--worker", choices=("single", "batched"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.worker == "single":
+        print(_run_workload(args.records))
+        return
+    if args.worker == "batched":
+        print(_run_batched_workload(args.records, args.batch_size))
+        return
+
+    print(f"records: {args.records}")
+    for worker in ("single", "batched"):
+        for mode in ("1", "0"):
+            env = dict(os.environ, PLOMP_TYPECHECK=mode)
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--worker",
+                    worker,
+                    "--records",
+                    str(args.records),
+                    "--batch-size",
+                    str(args.batch_size),
+                ],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            label = f"{worker}, {'typechecked' if mode == '1' else 'fast path'}"
+            print(f"{label:24s} {float(output):12,.0f} records/s")
+
+
+if __name__ == "__main__":
+    main()
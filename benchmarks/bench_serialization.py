@@ -0,0 +1,110 @@
+"""Measure peak RSS and throughput of `write_json` and `write_html`, against
+serialising `buffer.to_dict()` in one go (the previous implementation), and of
+`read_json` against `json.load`ing the whole file before appending its items.
+
+Each operation runs in a fresh process, and the reported peak is how far the
+process's peak RSS rose above its RSS just before the operation. For readers
+that includes the loaded buffer itself.
+
+    PLOMP_TYPECHECK=0 python benchmarks/bench_serialization.py --items 1000000
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import plomp
+from plomp._progress import _append_item_dict
+
+OPERATIONS = ("write_json", "write_html", "to_dict", "read_json", "json.load")
+
+
+def _rss_kib() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def _build_buffer(items: int) -> plomp.PlompBuffer:
+    buffer = plomp.PlompBuffer(timestamp_fn=plomp.monotonic_ns_clock())
+    payload = {"value": 1.0, "text": "accessed weather data from API"}
+    for i in range(items):
+        if i % 2:
+            plomp.record_event(payload, tags={"tool": "weather_api"}, buffer=buffer)
+        else:
+            plomp.record_prompt(
+                f"What's the weather like on day {i}?",
+                tags={"model": "a"},
+                buffer=buffer,
+            ).complete("Sunny, with a chance of rain later in the afternoon.")
+    return buffer
+
+
+def _run(operation: str, items: int):
+    buffer = _build_buffer(items)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace")
+        if operation in ("read_json", "json.load"):
+            plomp.write_json(buffer, path)
+            del buffer
+            gc.collect()
+
+        baseline = _rss_kib()
+        start = time.perf_counter()
+        if operation == "to_dict":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(buffer.to_dict()))
+        elif operation == "read_json":
+            plomp.read_json(plomp.PlompBuffer(), path)
+        elif operation == "json.load":
+            loaded = plomp.PlompBuffer()
+            with open(path, encoding="utf-8") as f:
+                for item in json.load(f)["buffer_items"]:
+                    _append_item_dict(loaded, item)
+        else:
+            getattr(plomp, operation)(buffer, path)
+        elapsed = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        size = os.path.getsize(path)
+    print(json.dumps({"elapsed": elapsed, "peak_kib": peak - baseline, "size": size}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--operation", choices=OPERATIONS)
+    args = parser.parse_args()
+
+    if args.operation:
+        _run(args.operation, args.items)
+        return
+
+    for operation in OPERATIONS:
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--items",
+                str(args.items),
+                "--operation",
+                operation,
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output)
+        print(
+            f"{operation:10} {result['peak_kib'] / 1024:8.1f} MiB peak  "
+            f"{args.items / result['elapsed']:10.0f} items/s  "
+            f"{result['size'] / result['elapsed'] / 2**20:6.1f} MiB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Measure `PlompBufferQuery.union` / `intersection` on large buffers.
+
+Compares the packed, merge-based index sets against the previous behaviour,
+which converted both sides to Python sets and re-sorted the result.
+
+    python benchmarks/bench_set_operations.py --items 1000000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import plomp
+
+
+def _measure(buffer: plomp.PlompBuffer, fn) -> tuple[float, float]:
+    """Return `(seconds, peak MB allocated)` for one call of `fn`, with the
+    buffer's query cache cleared so each call really computes its result."""
+    buffer._query_cache.clear()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+
+    buffer._query_cache.clear()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    buffer = plomp.PlompBuffer(key="bench_set_operations")
+    for i in range(args.items):
+        plomp.record_event({"i": i}, tags={"mod2": i % 2, "mod3": i % 3}, buffer=buffer)
+
+    evens = buffer.filter(tags_filter={"mod2": 0})
+    threes = buffer.filter(tags_filter={"mod3": 0})
+    evens_list = evens.matched_indices.tolist()
+    threes_list = threes.matched_indices.tolist()
+
+    for op in ("union", "intersection"):
+        before = _measure(
+            buffer, lambda: sorted(getattr(set(evens_list), op)(set(threes_list)))
+        )
+        after = _measure(buffer, lambda: getattr(evens, op)(threes).matched_indices)
+        print(f"{op}:")
+        print(f"  before (sets):   {before[0] * 1e3:8.1f} ms {before[1]:8.1f} MB peak")
+        print(f"  after  (arrays): {after[0] * 1e3:8.1f} ms {after[1]:8.1f} MB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,31 @@
+import inspect
 import io
 import textwrap
 from functools import cache, partial, wraps
-from typing import Callable
+from typing import Callable, Iterable
 
-from typeguard import typechecked
+from plomp._typecheck import typechecked
 
 from plomp._core import (
     PlompBuffer,
+    PlompItemEvictedError,
+    monotonic_ns_clock,
 )
+from plomp._aggregate import PlompGroupBy, agg
+from plomp._binary import PlompBinaryReader, read_binary, write_binary
 from plomp._buffer_items import (
+    PlompBufferItem,
     PlompCallCompletion,
     PlompCallHandle,
     PlompCallTrace,
     PlompBufferItemType,
+    PlompEvent,
 )
+from plomp._expressions import PlompExpression, col
 from plomp._query import PlompBufferQuery
-from plomp._types import TagsType
-from plomp._progress import write_html, write_json, read_json
+from plomp._sketch import PlompQuantileSketch
+from plomp._types import TagsType, TimestampType
+from plomp._progress import PlompLogSink, read_json, read_log, write_html, write_json
 
 
 class PlompMisconfiguration(Exception):
@@ -29,8 +38,16 @@ def _shared_plomp_buffer(key: str | None) -> PlompBuffer:
 
 
 @typechecked
-def buffer(*, key: str | None = None) -> PlompBuffer:
-    return _shared_plomp_buffer(key)
+def buffer(
+    *,
+    key: str | None = None,
+    max_items: int | None = None,
+    max_bytes: int | None = None,
+) -> PlompBuffer:
+    shared_buffer = _shared_plomp_buffer(key)
+    if max_items is not None or max_bytes is not None:
+        shared_buffer.set_limits(max_items=max_items, max_bytes=max_bytes)
+    return shared_buffer
 
 
 @typechecked
@@ -43,7 +60,7 @@ def record_prompt(
     if buffer is None:
         buffer = _shared_plomp_buffer(None)
 
-    return buffer.record_prompt_start(prompt=prompt, tags=tags or dict())
+    return buffer._record_prompt_start(prompt, tags or dict())
 
 
 @typechecked
@@ -56,7 +73,25 @@ def record_event(
     if buffer is None:
         buffer = _shared_plomp_buffer(None)
 
-    return buffer.record_event(payload=payload, tags=tags or dict())
+    return buffer._record_event(payload, tags or dict())
+
+
+@typechecked
+def record_many(
+    records: Iterable[
+        dict
+        | PlompEvent
+        | PlompCallTrace
+        | tuple[TimestampType, dict | PlompEvent | PlompCallTrace]
+    ],
+    tags: TagsType | None = None,
+    *,
+    buffer: PlompBuffer | None = None,
+) -> range:
+    if buffer is None:
+        buffer = _shared_plomp_buffer(None)
+
+    return buffer.record_many(records, tags=tags)
 
 
 @typechecked
@@ -73,8 +108,7 @@ def _trace_decorator(
     capture_tags: Callable[[Callable, tuple, dict], TagsType],
     buffer: PlompBuffer | None = None,
 ):
-    @wraps(fn)
-    def inner(*args, plomp_extra_tags: TagsType | None = None, **kwargs):
+    def start_trace(args, plomp_extra_tags, kwargs) -> PlompCallHandle:
         plomp_extra_tags = plomp_extra_tags or {}
         assert isinstance(plomp_extra_tags, dict), (
             "Invalid argument passed for `plomp_extra_tags`"
@@ -87,7 +121,25 @@ def _trace_decorator(
             plomp_extra_tags=plomp_extra_tags or {},
             **kwargs,  # type: ignore
         )
-        handle = record_prompt(prompt, tags=tags, buffer=buffer)
+        return record_prompt(prompt, tags=tags, buffer=buffer)
+
+    if inspect.iscoroutinefunction(fn):
+        # The prompt is recorded when the call starts and completed once the
+        # awaited result is available, so latency reflects the whole await.
+        @wraps(fn)
+        async def async_inner(
+            *args, plomp_extra_tags: TagsType | None = None, **kwargs
+        ):
+            handle = start_trace(args, plomp_extra_tags, kwargs)
+            result = await fn(*args, **kwargs)
+            handle.complete(str(result))
+            return result
+
+        return async_inner
+
+    @wraps(fn)
+    def inner(*args, plomp_extra_tags: TagsType | None = None, **kwargs):
+        handle = start_trace(args, plomp_extra_tags, kwargs)
         result = fn(*args, **kwargs)
         handle.complete(str(result))
         return result
@@ -239,18 +291,33 @@ def wrap_prompt_fn(
 
 
 __all__ = [
+    "agg",
     "buffer",
+    "col",
+    "monotonic_ns_clock",
+    "PlompBinaryReader",
     "PlompBuffer",
+    "PlompBufferItem",
     "PlompCallCompletion",
     "PlompCallHandle",
     "PlompBufferItemType",
     "PlompCallTrace",
+    "PlompEvent",
+    "PlompExpression",
+    "PlompGroupBy",
+    "PlompItemEvictedError",
+    "PlompLogSink",
+    "PlompQuantileSketch",
     "record_event",
+    "record_many",
     "record_prompt",
     "render",
+    "read_binary",
     "read_json",
+    "read_log",
     "serve_buffer",
     "wrap_prompt_fn",
+    "write_binary",
     "write_html",
     "write_json",
 ]
@@ -0,0 +1,237 @@
+from bisect import bisect_right
+from typing import TYPE_CHECKING, Any, Callable, Sequence
+
+from plomp._expressions import PlompExpression
+from plomp._sketch import PlompQuantileSketch
+from plomp._storage import EVENT_CODE, NOT_COMPLETED, PlompItemStore
+from plomp._tags import hashable_tag_value
+
+if TYPE_CHECKING:
+    from plomp._query import PlompBufferQuery
+
+
+class PlompAggregation:
+    """One aggregate computed per group by `PlompGroupBy.agg`. Build them from
+    `plomp.agg`."""
+
+    def accumulator(self, store: PlompItemStore) -> Callable[[], "_Accumulator"]:
+        """A factory for the per-group state, bound to the buffer's columns."""
+        raise NotImplementedError
+
+
+class _Accumulator:
+    __slots__ = ()
+
+    def add(self, position: int):
+        raise NotImplementedError
+
+    def result(self) -> Any:
+        raise NotImplementedError
+
+
+class _Count(PlompAggregation):
+    def __init__(self, expression: PlompExpression | None):
+        self.expression = expression
+
+    def accumulator(self, store):
+        matches = None if self.expression is None else self.expression.compile(store)
+
+        class Count(_Accumulator):
+            __slots__ = ("count",)
+
+            def __init__(self):
+                self.count = 0
+
+            if matches is None:
+
+                def add(self, position):
+                    self.count += 1
+
+            else:
+
+                def add(self, position):
+                    if matches(position):
+                        self.count += 1
+
+            def result(self):
+                return self.count
+
+        return Count
+
+
+class _LatencySketch(PlompAggregation):
+    def __init__(self, quantiles: Sequence[float] | None, relative_accuracy: float):
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+
+    def accumulator(self, store):
+        latencies = store.latencies
+        quantiles, relative_accuracy = self.quantiles, self.relative_accuracy
+
+        class Latency(_Accumulator):
+            __slots__ = ("sketch",)
+
+            def __init__(self):
+                self.sketch = PlompQuantileSketch(relative_accuracy)
+
+            def add(self, position):
+                latency_ns = latencies[position]
+                if latency_ns != NOT_COMPLETED:
+                    self.sketch.add(latency_ns / 1e9)
+
+            def result(self):
+                if quantiles is None:
+                    return self.sketch
+                return {q: self.sketch.quantile(q) for q in quantiles}
+
+        return Latency
+
+
+class _LatencyHistogram(PlompAggregation):
+    def __init__(self, edges: Sequence[float]):
+        self.edges_ns = [round(edge * 1e9) for edge in edges]
+
+    def accumulator(self, store):
+        latencies, edges_ns = store.latencies, self.edges_ns
+
+        class LatencyHistogram(_Accumulator):
+            __slots__ = ("counts",)
+
+            def __init__(self):
+                self.counts = [0] * (len(edges_ns) + 1)
+
+            def add(self, position):
+                latency_ns = latencies[position]
+                if latency_ns != NOT_COMPLETED:
+                    self.counts[bisect_right(edges_ns, latency_ns)] += 1
+
+            def result(self):
+                return self.counts
+
+        return LatencyHistogram
+
+
+class _PayloadSum(PlompAggregation):
+    def __init__(self, field: str):
+        self.field = field
+
+    def accumulator(self, store):
+        type_codes, data, field = store.type_codes, store.data, self.field
+
+        class PayloadSum(_Accumulator):
+            __slots__ = ("total",)
+
+            def __init__(self):
+                self.total = 0
+
+            def add(self, position):
+                if type_codes[position] == EVENT_CODE:
+                    value = data[position].get(field)
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        self.total += value
+
+            def result(self):
+                return self.total
+
+        return PayloadSum
+
+
+class _Aggregations:
+    """Entry point for building aggregations, exported as `plomp.agg`."""
+
+    __slots__ = ()
+
+    def count(self, expression: PlompExpression | None = None) -> PlompAggregation:
+        """The number of items, or of those satisfying a `plomp.col` expression
+        (e.g. to compute error rates)."""
+        return _Count(expression)
+
+    def latency_quantiles(
+        self, quantiles: Sequence[float], *, relative_accuracy: float = 0.01
+    ) -> PlompAggregation:
+        """A `{quantile: seconds}` dict of completed prompt latencies, each within
+        `relative_accuracy` of the exact value (None for groups without any)."""
+        for q in quantiles:
+            if not 0 <= q <= 1:
+                raise ValueError("Quantiles must be between 0 and 1")
+        return _LatencySketch(list(quantiles), relative_accuracy)
+
+    def latency_sketch(self, *, relative_accuracy: float = 0.01) -> PlompAggregation:
+        """The `PlompQuantileSketch` of completed prompt latencies in seconds,
+        which can be merged with sketches from other buffers."""
+        return _LatencySketch(None, relative_accuracy)
+
+    def latency_histogram(self, edges: Sequence[float]) -> PlompAggregation:
+        """Counts of completed prompt latencies between `edges` in seconds, like
+        `PlompBufferQuery.latency_histogram`."""
+        if list(edges) != sorted(edges):
+            raise ValueError("Histogram edges must be sorted")
+        return _LatencyHistogram(edges)
+
+    def sum(self, payload_field: str) -> PlompAggregation:
+        """The sum of a numeric field of event payloads; other values are ignored."""
+        return _PayloadSum(payload_field)
+
+    def __repr__(self):
+        return "agg"
+
+
+agg = _Aggregations()
+
+
+class PlompGroupBy:
+    """Items of a query grouped by the values of some tags. See `agg`."""
+
+    def __init__(self, query: "PlompBufferQuery", tag_keys: Sequence[str]):
+        self.query = query
+        self.tag_keys = tuple(tag_keys)
+
+    def agg(self, **aggregations: PlompAggregation) -> dict[tuple, dict[str, Any]]:
+        """Compute every named aggregation for each group in a single pass.
+
+        Returns a dict from each group's tag values (a tuple with one value per
+        tag key, None where the tag is missing) to `{name: aggregate}`. Dict and
+        list tag values, which can't be dict keys, appear as `(dict, frozenset
+        of items)` and `(list, tuple of values)` respectively.
+        """
+        buffer = self.query.buffer
+        store = buffer._store
+        indices = self.query.matched_indices
+        names = list(aggregations)
+        factories = [aggregations[name].accumulator(store) for name in names]
+
+        if indices:
+            buffer._position(indices[0])
+            buffer._position(indices[-1])
+        base_index = buffer._base_index
+        tag_set_ids = store.tag_set_ids
+        tag_dictionary = store.tag_dictionary
+
+        # Group keys and accumulators are resolved once per interned tag set,
+        # leaving one integer lookup per item.
+        groups: dict[tuple, list[_Accumulator]] = {}
+        by_tag_set: dict[int, list[Callable[[int], None]]] = {}
+        for index in indices:
+            position = index - base_index
+            tag_set_id = tag_set_ids[position]
+            adders = by_tag_set.get(tag_set_id)
+            if adders is None:
+                tags = tag_dictionary.decode(tag_set_id)
+                group = tuple(
+                    hashable_tag_value(tags.get(key)) for key in self.tag_keys
+                )
+                if group not in groups:
+                    groups[group] = [factory() for factory in factories]
+                adders = by_tag_set[tag_set_id] = [
+                    accumulator.add for accumulator in groups[group]
+                ]
+            for add in adders:
+                add(position)
+
+        return {
+            group: {
+                name: accumulator.result()
+                for name, accumulator in zip(names, accumulators)
+            }
+            for group, accumulators in groups.items()
+        }
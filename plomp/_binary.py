@@ -0,0 +1,521 @@
+import datetime as dt
+import json
+import os
+import struct
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Sequence
+from zoneinfo import ZoneInfo
+
+from plomp._buffer_items import (
+    PlompBufferItem,
+    PlompCallCompletion,
+    PlompCallTrace,
+    PlompEvent,
+    freeze_mapping,
+)
+from plomp._core import PlompBuffer
+from plomp._query import PlompBufferQuery
+from plomp._storage import (
+    EVENT_CODE,
+    ITEM_TYPES,
+    NOT_COMPLETED,
+    PROMPT_CODE,
+    QUERY_CODE,
+    PlompItemStore,
+    Row,
+    ns_to_datetime,
+)
+from plomp._typecheck import typechecked
+from plomp._types import TagsType, TagType
+
+
+# A `.plomp` file is little-endian and laid out as
+#
+#   header   MAGIC, u16 version
+#   blocks   up to `block_size` length-prefixed item records each
+#   footer   metadata, string table, tag sets, time zones, block summaries and
+#            the offset of every item record
+#   trailer  u64 footer offset, u64 item count, MAGIC
+#
+# Records hold the item's columns as stored in the buffer, with tags as ids into
+# the footer's table of tag sets, so any item can be read with one seek.
+
+MAGIC = b"PLOMP\0"
+VERSION = 1
+
+_HEADER = struct.Struct("<6sH")
+_TRAILER = struct.Struct("<QQ6s")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+# Type code, timestamp, zone, completion timestamp, completion zone, tag set id.
+_RECORD = struct.Struct("<BqHqHI")
+# Offset, item count, min and max timestamp, prompt, event and query counts.
+_BLOCK = struct.Struct("<QIqqIII")
+_NO_STRING = 0xFFFFFFFF
+
+_TAG_STR, _TAG_BOOL, _TAG_INT, _TAG_FLOAT, _TAG_JSON = range(5)
+_ZONE_NAIVE, _ZONE_OFFSET, _ZONE_NAMED = range(3)
+
+
+@dataclass(slots=True, frozen=True)
+class PlompBinaryBlock:
+    """A summary of one block of items in a `.plomp` file, so tools can skip
+    blocks which can't match a query without reading them."""
+
+    offset: int
+    first_item: int
+    # The index of the block's first item in the buffer it was written from.
+    first_index: int
+    count: int
+    min_timestamp_ns: int
+    max_timestamp_ns: int
+    type_counts: dict[str, int]
+    tag_set_ids: frozenset[int]
+
+
+def _pack_str(value: str | None) -> bytes:
+    if value is None:
+        return _U32.pack(_NO_STRING)
+    encoded = value.encode("utf-8")
+    return _U32.pack(len(encoded)) + encoded
+
+
+class _Reader:
+    """Sequential decoding of a bytes buffer."""
+
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: bytes, pos: int = 0):
+        self.data = data
+        self.pos = pos
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def u32(self) -> int:
+        return self.unpack(_U32)[0]
+
+    def string(self) -> str | None:
+        length = self.u32()
+        if length == _NO_STRING:
+            return None
+        value = self.data[self.pos : self.pos + length].decode("utf-8")
+        self.pos += length
+        return value
+
+    def array(self, typecode: str, count: int) -> array:
+        values = array(typecode)
+        values.frombytes(self.data[self.pos : self.pos + count * values.itemsize])
+        self.pos += count * values.itemsize
+        return values
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+
+    def id(self, value: str) -> int:
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.ids)
+        return string_id
+
+    def pack(self) -> bytes:
+        return _U32.pack(len(self.ids)) + b"".join(map(_pack_str, self.ids))
+
+
+def _pack_tag_value(strings: _StringTable, value: TagType) -> bytes:
+    if isinstance(value, str):
+        return bytes([_TAG_STR]) + _U32.pack(strings.id(value))
+    if isinstance(value, bool):
+        return bytes([_TAG_BOOL, value])
+    if isinstance(value, int) and -(2**63) <= value < 2**63:
+        return bytes([_TAG_INT]) + _I64.pack(value)
+    if isinstance(value, float):
+        return bytes([_TAG_FLOAT]) + _F64.pack(value)
+    return bytes([_TAG_JSON]) + _pack_str(json.dumps(value))
+
+
+def _unpack_tag_value(reader: _Reader, strings: list[str]) -> TagType:
+    kind = reader.data[reader.pos]
+    reader.pos += 1
+    if kind == _TAG_STR:
+        return strings[reader.u32()]
+    if kind == _TAG_BOOL:
+        reader.pos += 1
+        return bool(reader.data[reader.pos - 1])
+    if kind == _TAG_INT:
+        return reader.unpack(_I64)[0]
+    if kind == _TAG_FLOAT:
+        return reader.unpack(_F64)[0]
+    return json.loads(reader.string())
+
+
+def _pack_zone(strings: _StringTable, tzinfo: dt.tzinfo | None) -> bytes:
+    if tzinfo is None:
+        return bytes([_ZONE_NAIVE])
+    if isinstance(tzinfo, dt.timezone):
+        offset = tzinfo.utcoffset(None)
+        return bytes([_ZONE_OFFSET]) + _I64.pack(offset // dt.timedelta(microseconds=1))
+    if isinstance(tzinfo, ZoneInfo):
+        return bytes([_ZONE_NAMED]) + _U32.pack(strings.id(tzinfo.key))
+    raise ValueError(f"Time zone {tzinfo!r} can't be written to a .plomp file")
+
+
+def _unpack_zone(reader: _Reader, strings: list[str]) -> dt.tzinfo | None:
+    kind = reader.data[reader.pos]
+    reader.pos += 1
+    if kind == _ZONE_NAIVE:
+        return None
+    if kind == _ZONE_OFFSET:
+        offset_us = reader.unpack(_I64)[0]
+        return dt.timezone(dt.timedelta(microseconds=offset_us))
+    return ZoneInfo(strings[reader.u32()])
+
+
+def _pack_record(store: PlompItemStore, position: int, tag_set_id: int) -> bytes:
+    type_code = store.type_codes[position]
+    data = store.data[position]
+    record = _RECORD.pack(
+        type_code,
+        store.timestamps[position],
+        store.timestamp_zones[position],
+        store.completion_timestamps[position],
+        store.completion_zones[position],
+        tag_set_id,
+    )
+    if type_code == PROMPT_CODE:
+        record += _pack_str(data) + _pack_str(store.responses[position])
+    elif type_code == EVENT_CODE:
+        record += _pack_str(json.dumps(data))
+    else:
+        matched_indices = array("q", data.matched_indices)
+        record += (
+            _pack_str(data.op_name)
+            + _U32.pack(len(matched_indices))
+            + matched_indices.tobytes()
+        )
+    return _U32.pack(len(record)) + record
+
+
+@typechecked
+def write_binary(buffer: PlompBuffer, output_uri: str, *, block_size: int = 4096):
+    """Write `buffer` to a `.plomp` file, which `read_binary` loads back exactly
+    and `PlompBinaryReader` reads items from at random.
+
+    Items are written in blocks of `block_size`, each summarised in the footer
+    by its time range, item types and tag sets. Items can be recorded while the
+    file is written; those evicted before their block is reached are left out.
+    """
+    if block_size < 1:
+        raise ValueError("block_size must be positive")
+
+    store = buffer._store
+    tag_dictionary = store.tag_dictionary
+    with buffer._lock:
+        index, stop = buffer.indices.start, buffer.indices.stop
+    offsets = array("Q")
+    blocks, block_first_indices = bytearray(), []
+    # Tag sets are numbered in the order the file uses them. Ids freed by
+    # evictions may be reused for other tags, so the buffer's ids are only
+    # reused within a generation of the dictionary.
+    file_tag_set_ids: dict[tuple[int, int], int] = {}
+    tag_sets: list[TagsType] = []
+    with open(output_uri, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION))
+        while True:
+            # Each block is packed under the buffer's lock and written outside it.
+            block_offset = f.tell()
+            records = bytearray()
+            type_counts = [0] * len(ITEM_TYPES)
+            block_tag_set_ids = set()
+            min_ns = max_ns = None
+            with buffer._lock:
+                index = max(index, buffer.indices.start)
+                block_stop = min(index + block_size, stop)
+                if index >= block_stop:
+                    tzinfos = list(store._tzinfos)
+                    break
+                base_index = buffer._base_index
+                generation = tag_dictionary.generation
+                for position in range(index - base_index, block_stop - base_index):
+                    tag_set_key = (generation, store.tag_set_ids[position])
+                    tag_set_id = file_tag_set_ids.get(tag_set_key)
+                    if tag_set_id is None:
+                        tag_set_id = file_tag_set_ids[tag_set_key] = len(tag_sets)
+                        tag_sets.append(tag_dictionary.decode(tag_set_key[1]))
+                    offsets.append(block_offset + len(records))
+                    records += _pack_record(store, position, tag_set_id)
+                    timestamp_ns = store.timestamps[position]
+                    min_ns = (
+                        timestamp_ns if min_ns is None else min(min_ns, timestamp_ns)
+                    )
+                    max_ns = (
+                        timestamp_ns if max_ns is None else max(max_ns, timestamp_ns)
+                    )
+                    type_counts[store.type_codes[position]] += 1
+                    block_tag_set_ids.add(tag_set_id)
+            f.write(records)
+            blocks += _BLOCK.pack(
+                block_offset,
+                sum(type_counts),
+                min_ns,
+                max_ns,
+                type_counts[PROMPT_CODE],
+                type_counts[EVENT_CODE],
+                type_counts[QUERY_CODE],
+            )
+            blocks += _U32.pack(len(block_tag_set_ids))
+            blocks += array("I", sorted(block_tag_set_ids)).tobytes()
+            block_first_indices.append(index)
+            index = block_stop
+
+        strings = _StringTable()
+        packed_tag_sets = bytearray(_U32.pack(len(tag_sets)))
+        for tags in tag_sets:
+            packed_tag_sets += _U32.pack(len(tags))
+            for key, value in tags.items():
+                packed_tag_sets += _U32.pack(strings.id(key))
+                packed_tag_sets += _pack_tag_value(strings, value)
+        zones = bytearray(_U32.pack(len(tzinfos)))
+        for tzinfo in tzinfos:
+            zones += _pack_zone(strings, tzinfo)
+
+        footer_offset = f.tell()
+        metadata = {
+            "key": buffer.key,
+            "first_index": block_first_indices[0] if block_first_indices else stop,
+            # Items evicted while writing leave gaps between blocks.
+            "block_first_indices": block_first_indices,
+        }
+        f.write(_pack_str(json.dumps(metadata)))
+        f.write(strings.pack())
+        f.write(packed_tag_sets)
+        f.write(zones)
+        f.write(_U32.pack(len(block_first_indices)))
+        f.write(blocks)
+        f.write(offsets.tobytes())
+        f.write(_TRAILER.pack(footer_offset, len(offsets), MAGIC))
+
+
+class PlompBinaryReader:
+    """Random access to the items of a `.plomp` file written by `write_binary`.
+
+    Only the footer is read up front; `reader[n]` then reads item `n` with a
+    single seek. Query items are bound to `buffer`, a new empty buffer by
+    default, and their indices are rebased to where the file's items are
+    appended to it by `read_binary`. Indices of items evicted before the file
+    was written are dropped, as they aren't in the file.
+    """
+
+    def __init__(self, fpath: str, *, buffer: PlompBuffer | None = None):
+        if not os.path.exists(fpath):
+            raise ValueError(f"File {fpath} does not exist")
+        self._f: BinaryIO = open(fpath, "rb")
+        try:
+            self._read_footer()
+        except Exception:
+            self._f.close()
+            raise
+        self.buffer = buffer if buffer is not None else PlompBuffer(key=self.key)
+        # Item `n` of the file will be at `_target_index + n` once read.
+        self._target_index = self.buffer.indices.stop
+
+    def _read_footer(self):
+        f = self._f
+        magic, version = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not a .plomp file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported .plomp file version {version}")
+        f.seek(-_TRAILER.size, os.SEEK_END)
+        footer_offset, count, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError("Truncated .plomp file")
+        f.seek(footer_offset)
+        self._footer_offset = footer_offset
+        reader = _Reader(f.read())
+
+        metadata = json.loads(reader.string())
+        self.key: str | None = metadata["key"]
+        self.first_index: int = metadata["first_index"]
+        strings = [reader.string() for _ in range(reader.u32())]
+        self._tag_sets: list[TagsType] = []
+        for _ in range(reader.u32()):
+            tags = {}
+            for _ in range(reader.u32()):
+                key = strings[reader.u32()]
+                tags[key] = _unpack_tag_value(reader, strings)
+            self._tag_sets.append(freeze_mapping(tags))
+        self._tzinfos = [_unpack_zone(reader, strings) for _ in range(reader.u32())]
+
+        self.blocks: list[PlompBinaryBlock] = []
+        block_first_indices = metadata.get("block_first_indices")
+        first_item = 0
+        for n in range(reader.u32()):
+            offset, block_count, min_ns, max_ns, *type_counts = reader.unpack(_BLOCK)
+            tag_set_ids = reader.array("I", reader.u32())
+            self.blocks.append(
+                PlompBinaryBlock(
+                    offset=offset,
+                    first_item=first_item,
+                    first_index=self.first_index + first_item
+                    if block_first_indices is None
+                    else block_first_indices[n],
+                    count=block_count,
+                    min_timestamp_ns=min_ns,
+                    max_timestamp_ns=max_ns,
+                    type_counts={
+                        ITEM_TYPES[type_code].value: type_count
+                        for type_code, type_count in zip(
+                            (PROMPT_CODE, EVENT_CODE, QUERY_CODE), type_counts
+                        )
+                    },
+                    tag_set_ids=frozenset(tag_set_ids),
+                )
+            )
+            first_item += block_count
+        self._offsets = reader.array("Q", count)
+        # Whether the items' indices were contiguous, i.e. nothing was evicted
+        # while the file was written.
+        self._contiguous = all(
+            block.first_index == self.first_index + block.first_item
+            for block in self.blocks
+        )
+
+    def _rebase(self, indices: Sequence[int]) -> list[int]:
+        """Map indices of the buffer the file was written from to the indices
+        its items get in `self.buffer`, dropping any not in the file."""
+        if self._contiguous:
+            offset = self._target_index - self.first_index
+            stop = self.first_index + len(self)
+            return [
+                index + offset for index in indices if self.first_index <= index < stop
+            ]
+        starts = [block.first_index for block in self.blocks]
+        rebased = []
+        for index in indices:
+            block = self.blocks[bisect_right(starts, index) - 1]
+            if block.first_index <= index < block.first_index + block.count:
+                rebased.append(
+                    self._target_index + block.first_item + index - block.first_index
+                )
+        return rebased
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _record(self, n: int) -> _Reader:
+        self._f.seek(self._offsets[n])
+        (length,) = _U32.unpack(self._f.read(_U32.size))
+        return _Reader(self._f.read(length))
+
+    def _timestamp(self, ns: int, zone: int) -> dt.datetime | int:
+        tzinfo = self._tzinfos[zone]
+        # UTC timestamps are kept as integers so nanoseconds survive.
+        if tzinfo == dt.timezone.utc:
+            return ns
+        return ns_to_datetime(ns, tzinfo)
+
+    def _row(self, reader: _Reader, buffer: PlompBuffer) -> Row:
+        (
+            type_code,
+            timestamp_ns,
+            zone,
+            completion_ns,
+            completion_zone,
+            tag_set_id,
+        ) = reader.unpack(_RECORD)
+        completion = None
+        if type_code == PROMPT_CODE:
+            data = reader.string()
+            response = reader.string()
+            if completion_ns != NOT_COMPLETED:
+                completion = (self._timestamp(completion_ns, completion_zone), response)
+        elif type_code == EVENT_CODE:
+            data = freeze_mapping(json.loads(reader.string()))
+        else:
+            op_name = reader.string()
+            matched_indices = reader.array("q", reader.u32())
+            data = PlompBufferQuery(
+                buffer, matched_indices=self._rebase(matched_indices), op_name=op_name
+            )
+        return (
+            self._timestamp(timestamp_ns, zone),
+            self._tag_sets[tag_set_id],
+            type_code,
+            data,
+            completion,
+        )
+
+    def _rows(self, start: int, stop: int) -> Iterator[Row]:
+        """Decode items `start:stop` into rows for `PlompBuffer._append_many`,
+        reading their records in one go."""
+        if start >= stop:
+            return
+        end = self._offsets[stop] if stop < len(self) else self._footer_offset
+        self._f.seek(self._offsets[start])
+        data = self._f.read(end - self._offsets[start])
+        reader = _Reader(data)
+        for _ in range(start, stop):
+            length = reader.u32()
+            record = _Reader(data, reader.pos)
+            reader.pos += length
+            yield self._row(record, self.buffer)
+
+    def __getitem__(self, n: int) -> PlompBufferItem:
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError("item index out of range")
+        timestamp, tags, type_code, data, completion = self._row(
+            self._record(n), self.buffer
+        )
+        if isinstance(timestamp, int):
+            timestamp = ns_to_datetime(timestamp, dt.timezone.utc)
+        if type_code == PROMPT_CODE:
+            if completion is not None:
+                completion_timestamp, response = completion
+                if isinstance(completion_timestamp, int):
+                    completion_timestamp = ns_to_datetime(
+                        completion_timestamp, dt.timezone.utc
+                    )
+                completion = PlompCallCompletion(
+                    completion_timestamp=completion_timestamp, response=response
+                )
+            data = PlompCallTrace(data, completion=completion)
+        elif type_code == EVENT_CODE:
+            data = PlompEvent(payload=data)
+        return PlompBufferItem(timestamp, tags, ITEM_TYPES[type_code], data)
+
+    def __iter__(self) -> Iterator[PlompBufferItem]:
+        for n in range(len(self)):
+            yield self[n]
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self) -> "PlompBinaryReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@typechecked
+def read_binary(buffer: PlompBuffer, fpath: str) -> None:
+    """Append every item in a `.plomp` file to `buffer`, a block at a time.
+
+    Items keep their timestamps (to the nanosecond), time zones and tags, and
+    recorded queries are rebased onto the items' indices in `buffer`.
+    """
+    with PlompBinaryReader(fpath, buffer=buffer) as reader:
+        for block in reader.blocks:
+            buffer._append_many(
+                list(reader._rows(block.first_item, block.first_item + block.count))
+            )
@@ -1,9 +1,10 @@
 import datetime as dt
 import io
-from dataclasses import dataclass
+from copy import deepcopy
+from dataclasses import dataclass, field, replace
 from enum import Enum
 from typing import Union, TYPE_CHECKING
-from typeguard import typechecked
+from plomp._typecheck import typechecked
 from plomp._types import TagsType
 
 if TYPE_CHECKING:
@@ -24,29 +25,91 @@ class PlompCallCompletion:
         }
 
 
+class ReadOnlyDict(dict):
+    """A `dict` which rejects mutation, used for tags and payloads held by a buffer."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"{self.__class__.__name__} does not support mutation")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self.__class__(deepcopy(dict(self), memo))
+
+
+class ReadOnlyList(list):
+    """A `list` which rejects mutation, used for lists nested in tags and payloads."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"{self.__class__.__name__} does not support mutation")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self.__class__(deepcopy(list(self), memo))
+
+
+def _freeze(value):
+    if isinstance(value, (ReadOnlyDict, ReadOnlyList)):
+        return value
+    if isinstance(value, dict):
+        return ReadOnlyDict({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return ReadOnlyList(_freeze(item) for item in value)
+    return value
+
+
+def freeze_mapping(mapping: dict) -> ReadOnlyDict:
+    """Return a read-only version of `mapping`, copying it only if it is mutable.
+
+    Nested dicts and lists are frozen too, so nothing reachable from a stored
+    item can be changed.
+    """
+    if isinstance(mapping, ReadOnlyDict):
+        return mapping
+    if any(isinstance(value, (dict, list)) for value in mapping.values()):
+        return _freeze(mapping)
+    return ReadOnlyDict(mapping)
+
+
 @typechecked
-@dataclass(slots=True, kw_only=True)
+@dataclass(slots=True, frozen=True)
 class PlompCallTrace:
     prompt: str
-    completion: PlompCallCompletion | None = None
-
-    def __init__(
-        self,
-        prompt: str,
-        *,
-        completion: PlompCallCompletion | None = None,
-    ):
-        self.prompt = prompt
-        self.completion = completion
+    completion: PlompCallCompletion | None = field(default=None, kw_only=True)
 
     @typechecked
-    def complete(self, completion_timestamp: dt.datetime, response: str):
+    def complete(
+        self, completion_timestamp: dt.datetime, response: str
+    ) -> "PlompCallTrace":
+        """Return a copy of this trace with the completion attached."""
         if self.completion is not None:
             raise ValueError("Call has already been completed")
 
-        self.completion = PlompCallCompletion(
-            completion_timestamp=completion_timestamp,
-            response=response,
+        return replace(
+            self,
+            completion=PlompCallCompletion(
+                completion_timestamp=completion_timestamp,
+                response=response,
+            ),
         )
 
     @typechecked
@@ -60,7 +123,6 @@ class PlompCallTrace:
         }
 
 
-@typechecked
 class PlompCallHandle:
     def __init__(self, buffer: "PlompBuffer", index: int):
         self.buffer = buffer
@@ -68,11 +130,11 @@ class PlompCallHandle:
 
     @typechecked
     def complete(self, response: str):
-        self.buffer.record_prompt_completion(self.index, response)
+        self.buffer._record_prompt_completion(self.index, response)
 
 
 @typechecked
-@dataclass(slots=True, kw_only=True)
+@dataclass(slots=True, frozen=True, kw_only=True)
 class PlompEvent:
     payload: dict
 
@@ -81,7 +143,7 @@ class PlompEvent:
         io.write(indent * " " + repr(self))
 
     def to_dict(self) -> dict:
-        return {"payload": self.payload}
+        return {"payload": dict(self.payload)}
 
 
 class PlompBufferItemType(Enum):
@@ -90,8 +152,14 @@ class PlompBufferItemType(Enum):
     QUERY = "query"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PlompBufferItem:
+    """A read-only record stored in a `PlompBuffer`.
+
+    Items are immutable (their `tags` and event payloads are `ReadOnlyDict`s) so
+    the buffer can hand them out directly without copying.
+    """
+
     timestamp: dt.datetime
     tags: TagsType
     type_: PlompBufferItemType
@@ -135,7 +203,7 @@ class PlompBufferItem:
     def to_dict(self) -> dict:
         return {
             "timestamp": self.timestamp.isoformat(),
-            "tags": self.tags,
+            "tags": dict(self.tags),
             "type": self.type_.value,
             "data": self._data.to_dict(),
         }
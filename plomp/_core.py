@@ -1,81 +1,664 @@
 import datetime as dt
-from copy import deepcopy
-from typing import Callable, Iterator, Literal, Union
+import heapq
+import threading
+import time
+from array import array
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    Iterator,
+    Literal,
+    Sequence,
+    Union,
+)
 from plomp._query import PlompBufferQuery
-from typeguard import typechecked
-from plomp._types import TagsType, TagsFilter
+from plomp._typecheck import typechecked
+from plomp._types import TagsType, TagsFilter, TimestampType
 from plomp._buffer_items import (
     PlompBufferItem,
     PlompCallHandle,
-    PlompBufferItemType,
-    PlompEvent,
     PlompCallTrace,
+    PlompEvent,
+    freeze_mapping,
 )
+from plomp._expressions import PlompExpression
+from plomp._index_sets import PlompIndexSet
+from plomp._latency import latency_histogram, slowest_positions
+from plomp._query_cache import PlompQueryCache
+from plomp._search import (
+    PlompSearchIndex,
+    SearchField,
+    payload_text,
+    text_words,
+    tokenize,
+)
+from plomp._tags import PlompTagIndex
+from plomp._time_index import PlompTimeIndex
+from plomp._storage import (
+    EVENT_CODE,
+    NOT_COMPLETED,
+    PROMPT_CODE,
+    QUERY_CODE,
+    PlompItemStore,
+    Row,
+    item_row,
+)
+
+if TYPE_CHECKING:
+    from plomp._aggregate import PlompGroupBy
+    from plomp._live import PlompLiveQuery
+    from plomp._progress import PlompLogSink
+
+
+# Posting lists of the tag and search indexes trimmed per evicted item.
+_PRUNE_BUDGET = 16
+
+
+class PlompItemEvictedError(IndexError):
+    """Raised when accessing an item which a bounded buffer has already evicted."""
+
+
+def monotonic_ns_clock() -> Callable[[], int]:
+    """A `timestamp_fn` reading the monotonic clock as integer nanoseconds.
+
+    Readings are anchored to the wall clock when this is called, so they are
+    still epoch-based, but never go backwards if the system clock is adjusted.
+    """
+    anchor_ns = time.time_ns() - time.monotonic_ns()
+
+    def timestamp_fn() -> int:
+        return time.monotonic_ns() + anchor_ns
+
+    return timestamp_fn
 
 
 class PlompBuffer:
     def __init__(
         self,
         *,
-        buffer_items: list[PlompBufferItem] | None = None,
-        timestamp_fn: Callable[[], dt.datetime] = dt.datetime.now,
+        buffer_items: Iterable[PlompBufferItem] | None = None,
+        timestamp_fn: Callable[[], TimestampType] = dt.datetime.now,
         key: str | None = None,
+        max_items: int | None = None,
+        max_bytes: int | None = None,
+        query_cache_bytes: int = 16 * 2**20,
     ):
+        """Create a buffer, optionally seeded from existing `buffer_items`.
+
+        `buffer_items` may be any iterable of items, such as another buffer or a
+        query over one. Prompts, responses, tags and payloads are immutable and
+        shared with their source rather than copied.
+
+        `timestamp_fn` may return datetimes, or integer nanoseconds since the
+        epoch (e.g. `time.time_ns` or `monotonic_ns_clock()`) which avoid building
+        a datetime per record. Integer timestamps are read back as UTC datetimes.
+        Timestamps are stored as 64-bit nanoseconds, so they must fall between
+        1677-09-21 and 2262-04-11; recording one outside that range raises
+        ValueError and records nothing.
+
+        `max_items` and `max_bytes` bound the buffer, see `set_limits`.
+
+        Query results are cached, up to roughly `query_cache_bytes` of results;
+        pass 0 to disable the cache. Queries using `where` callables are only
+        cached if they are marked `pure=True`.
+        """
         self.timestamp_fn = timestamp_fn
         self.key = key
-        self._buffer_items = [
-            deepcopy(buffer_item) for buffer_item in (buffer_items or [])
-        ]
+        # Guards the store, the tag, time and search indexes, eviction and
+        # queueing entries for the sink, so every record takes it. Records are
+        # timestamped and their text tokenised before taking it, sink entries
+        # are written after releasing it, and index postings of evicted items
+        # are trimmed a few at a time, so it is held briefly per record.
+        self._lock = threading.Lock()
+        self._store = PlompItemStore()
+        self._tag_index = PlompTagIndex(self._store.tag_dictionary)
+        self._time_index = PlompTimeIndex()
+        # The indices of prompts awaiting completion, in order.
+        self._in_flight: dict[int, None] = {}
+        # Prompts evicted while awaiting completion, and after the current sink
+        # recorded them, so their completions can still be logged.
+        self._evicted_in_flight: set[int] = set()
+        # Every item gets a monotonic index when recorded. Evicted items are
+        # released from the front of `_store` and compacted away lazily:
+        # position 0 holds index `_base_index` and the first `_head` positions
+        # are already evicted.
+        self._base_index = 0
+        self._head = 0
+        self._max_items: int | None = None
+        self._max_bytes: int | None = None
+        self._retained_bytes = 0
+        self._sink: "PlompLogSink | None" = None
+        self._live_queries: tuple["PlompLiveQuery", ...] = ()
+        # Bumped whenever existing items change (completions and evictions),
+        # which invalidates cached query results. Appends don't bump it.
+        self._version = 0
+        self._query_cache = PlompQueryCache(self, query_cache_bytes)
+        # Built on the first search, then maintained as items are recorded.
+        self._search_index: PlompSearchIndex | None = None
+        self.set_limits(max_items=max_items, max_bytes=max_bytes)
+        if buffer_items is not None:
+            self._append_many([item_row(buffer_item) for buffer_item in buffer_items])
 
     @typechecked
-    def record_prompt_start(self, *, prompt: str, tags: TagsType) -> PlompCallHandle:
-        insert_index = len(self._buffer_items)
-        self._buffer_items.append(
-            PlompBufferItem(
-                self.timestamp_fn(),
-                tags,
-                PlompBufferItemType.PROMPT,
-                PlompCallTrace(prompt),
+    def set_limits(
+        self, *, max_items: int | None = None, max_bytes: int | None = None
+    ) -> None:
+        """Bound the buffer to the most recent `max_items` items and/or roughly
+        `max_bytes` bytes of prompts, responses, payloads and tags.
+
+        The oldest items are evicted once a limit is exceeded. Items keep their
+        original index, so handles and query results referring to an evicted
+        item raise `PlompItemEvictedError` rather than resolving to another item.
+        """
+        if max_items is not None and max_items < 1:
+            raise ValueError("max_items must be at least 1")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+
+        with self._lock:
+            self._max_items = max_items
+            self._max_bytes = max_bytes
+            if max_bytes is not None:
+                self._retained_bytes = sum(
+                    self._store.approximate_size(position)
+                    for position in range(self._head, len(self._store))
+                )
+            self._evict_locked()
+
+    def attach_sink(self, sink: "PlompLogSink | None") -> None:
+        """Stream every record and completion to `sink` as it happens.
+
+        Items already in the buffer are written to the sink first. Combined with
+        `set_limits` this keeps the full trace on disk while only the most recent
+        items stay in memory; completions of prompts evicted while the sink is
+        attached are still logged. Pass None to detach the current sink.
+        """
+        with self._lock:
+            self._sink = sink
+            # The new sink hasn't recorded any evicted prompt.
+            self._evicted_in_flight.clear()
+            if sink is not None:
+                for index in self.indices:
+                    sink.write_item(
+                        index, self._store.item_dict(index - self._base_index)
+                    )
+        if sink is not None:
+            sink._flush_if_full()
+
+    def _add_live_query(self, live_query: "PlompLiveQuery"):
+        with self._lock:
+            self._live_queries += (live_query,)
+
+    def _remove_live_query(self, live_query: "PlompLiveQuery"):
+        with self._lock:
+            self._live_queries = tuple(
+                query for query in self._live_queries if query is not live_query
             )
-        )
-        return PlompCallHandle(self, insert_index)
 
-    @typechecked
-    def record_prompt_completion(self, call_index: int, response: str):
-        if self._buffer_items[call_index].type_ != PlompBufferItemType.PROMPT:
+    @property
+    def indices(self) -> range:
+        """The indices of the items currently retained by the buffer."""
+        return range(self._base_index + self._head, self._base_index + len(self._store))
+
+    def timestamp_ns(self, index: int) -> int:
+        """The timestamp of the item at `index` in nanoseconds since the epoch.
+
+        Naive datetimes are measured on their own wall clock.
+        """
+        return self._store.timestamps[self._position(index)]
+
+    def completion_timestamp_ns(self, index: int) -> int | None:
+        """Like `timestamp_ns` for the completion of the prompt at `index`, or
+        None if it has not completed."""
+        position = self._position(index)
+        if self._store.type_codes[position] != PROMPT_CODE:
             raise ValueError("Item at index is not a prompt request")
+        completion_ns = self._store.completion_timestamps[position]
+        return None if completion_ns == NOT_COMPLETED else completion_ns
 
-        self._buffer_items[call_index].call_trace.complete(
-            self.timestamp_fn(), response
+    def _evict_locked(self):
+        retained = len(self._store) - self._head
+        evicted = 0
+        while retained > 1 and (
+            (self._max_items is not None and retained > self._max_items)
+            or (self._max_bytes is not None and self._retained_bytes > self._max_bytes)
+        ):
+            if self._max_bytes is not None:
+                self._retained_bytes -= self._store.approximate_size(self._head)
+            self._store.release(self._head)
+            index = self._base_index + self._head
+            if index in self._in_flight:
+                del self._in_flight[index]
+                if self._sink is not None:
+                    self._evicted_in_flight.add(index)
+            self._head += 1
+            retained -= 1
+            evicted += 1
+            self._version += 1
+
+        # Compact once at least half the store is evicted, which keeps both
+        # eviction and index lookups amortised O(1).
+        if self._head and self._head >= retained:
+            freed_tag_set_ids = self._store.compact(self._head)
+            self._base_index += self._head
+            self._head = 0
+            self._tag_index.prune(self._base_index, freed_tag_set_ids)
+            self._time_index.prune(self._base_index)
+            if self._search_index is not None:
+                self._search_index.prune(self._base_index)
+        # Posting lists are trimmed a few per evicted item rather than all at
+        # once on compaction, keeping the time the lock is held per record flat.
+        if evicted:
+            self._tag_index.prune_some(_PRUNE_BUDGET * evicted)
+            if self._search_index is not None:
+                self._search_index.prune_some(_PRUNE_BUDGET * evicted)
+
+    def _position(self, index: int) -> int:
+        """Map an item index (or a negative offset from the end) to a store position."""
+        indices = self.indices
+        if index < 0:
+            index += indices.stop
+            if index < indices.start:
+                raise IndexError("buffer index out of range")
+        elif index < indices.start:
+            raise PlompItemEvictedError(
+                f"Item {index} has been evicted from the buffer "
+                f"(oldest retained item is {indices.start})"
+            )
+        if index >= indices.stop:
+            raise IndexError("buffer index out of range")
+        return index - self._base_index
+
+    def _filter_indices(
+        self,
+        indices: Sequence[int],
+        how: Literal["any"] | Literal["all"] | Literal["none"],
+        tags_filter: TagsFilter,
+    ) -> Sequence[int]:
+        """Select the (sorted) `indices` whose tags satisfy `tags_filter`, using
+        the inverted tag index."""
+        if not indices:
+            return []
+        if indices[0] < 0:
+            raise IndexError("buffer index out of range")
+        self._position(indices[0])
+        self._position(indices[-1])
+
+        return self._tag_index.select(indices, how, tags_filter)
+
+    def _time_range_indices(
+        self, indices: Sequence[int], start_ns: int | None, end_ns: int | None
+    ) -> Sequence[int]:
+        """Select the (sorted) `indices` of items timestamped in
+        `[start_ns, end_ns)`, using the time index."""
+        if not indices:
+            return []
+        return PlompIndexSet.from_sorted(
+            self._time_index.select(start_ns, end_ns)
+        ).intersection(indices)
+
+    def _expression_indices(
+        self, indices: Sequence[int], expression: PlompExpression
+    ) -> Sequence[int]:
+        """Select the (sorted) `indices` whose items satisfy `expression`, by
+        evaluating it over the columns."""
+        if not indices:
+            return []
+        positions, base_index = self._positions(indices)
+        return expression.select(self._store, positions, base_index)
+
+    def _positions(self, indices: Sequence[int]) -> tuple[Sequence[int], int]:
+        """Map non-empty sorted `indices` to store positions, returning them with
+        the base index they are relative to."""
+        if indices[0] < 0:
+            raise IndexError("buffer index out of range")
+        self._position(indices[0])
+        self._position(indices[-1])
+
+        base_index = self._base_index
+        if isinstance(indices, PlompIndexSet) and indices.is_range:
+            if len(indices) == indices[-1] - indices[0] + 1:
+                indices = range(indices[0], indices[-1] + 1)
+        if isinstance(indices, range):
+            positions = range(indices.start - base_index, indices.stop - base_index)
+        else:
+            positions = [index - base_index for index in indices]
+        return positions, base_index
+
+    def _slowest_indices(self, indices: Sequence[int], k: int) -> Sequence[int]:
+        """Select the (sorted) `indices` of the `k` slowest completed prompts."""
+        if not indices:
+            return []
+        positions, base_index = self._positions(indices)
+        return array(
+            "q",
+            (
+                position + base_index
+                for position in slowest_positions(self._store, positions, k)
+            ),
         )
 
+    def _longest_in_flight_indices(
+        self, indices: Sequence[int], k: int
+    ) -> Sequence[int]:
+        """Select the (sorted) `indices` of the `k` earliest started prompts which
+        have not completed, from the in-flight prompts rather than a scan."""
+        with self._lock:
+            in_flight = PlompIndexSet.from_sorted(array("q", self._in_flight))
+            timestamps, base_index = self._store.timestamps, self._base_index
+            longest = heapq.nsmallest(
+                k,
+                in_flight.intersection(indices),
+                key=lambda index: timestamps[index - base_index],
+            )
+        return array("q", sorted(longest))
+
+    def _latency_histogram(
+        self, indices: Sequence[int], edges: Sequence[float]
+    ) -> list[int]:
+        if list(edges) != sorted(edges):
+            raise ValueError("Histogram edges must be sorted")
+        edges_ns = [round(edge * 1e9) for edge in edges]
+        if not indices:
+            return [0] * (len(edges) + 1)
+        positions, _ = self._positions(indices)
+        return latency_histogram(self._store, positions, edges_ns)
+
+    @staticmethod
+    def _text_words(
+        type_code: int, data, response: str | None = None
+    ) -> list[tuple[SearchField, set[str]]]:
+        """The words the search index holds for an item, per field."""
+        if type_code == PROMPT_CODE:
+            words = [("prompt", tokenize(data))]
+            if response is not None:
+                words.append(("response", tokenize(response)))
+            return words
+        if type_code == EVENT_CODE:
+            return [("payload", text_words(payload_text(data)))]
+        return []
+
+    def _index_text_locked(self, index: int, words: list[tuple[SearchField, set[str]]]):
+        for field, field_words in words:
+            self._search_index.add_words(index, field, field_words)
+
+    def _search_indices(
+        self, indices: Sequence[int], text: str, fields: Sequence[SearchField]
+    ) -> Sequence[int]:
+        """Select the (sorted) `indices` of items mentioning every word of `text`
+        in `fields`, using the search index."""
+        with self._lock:
+            if self._search_index is None:
+                self._search_index = PlompSearchIndex()
+                for index in self.indices:
+                    position = index - self._base_index
+                    self._index_text_locked(
+                        index,
+                        self._text_words(
+                            self._store.type_codes[position],
+                            self._store.data[position],
+                            self._store.responses[position],
+                        ),
+                    )
+            matching = self._search_index.select(text, fields)
+        return PlompIndexSet.from_sorted(matching).intersection(indices)
+
+    @typechecked
+    def record_prompt_start(self, *, prompt: str, tags: TagsType) -> PlompCallHandle:
+        return self._record_prompt_start(prompt, tags)
+
+    @typechecked
+    def record_prompt_completion(self, call_index: int, response: str):
+        self._record_prompt_completion(call_index, response)
+
     @typechecked
     def record_event(self, *, payload: dict, tags: TagsType):
-        event_time = self.timestamp_fn()
-        self._buffer_items.append(
-            PlompBufferItem(
-                event_time, tags, PlompBufferItemType.EVENT, PlompEvent(payload=payload)
-            )
-        )
+        self._record_event(payload, tags)
+
+    @typechecked
+    def extend(self, buffer_items: Iterable[PlompBufferItem]) -> range:
+        """Append `buffer_items`, e.g. from another buffer or a query over one, in
+        a single step. Items keep their timestamps and completions. Returns the
+        indices of the new items."""
+        rows = []
+        for buffer_item in buffer_items:
+            if not isinstance(buffer_item, PlompBufferItem):
+                raise TypeError(
+                    f"Expected PlompBufferItem, got {type(buffer_item).__name__}"
+                )
+            rows.append(item_row(buffer_item))
+        return self._append_many(rows)
+
+    @typechecked
+    def record_many(
+        self,
+        records: Iterable[
+            dict
+            | PlompEvent
+            | PlompCallTrace
+            | tuple[TimestampType, dict | PlompEvent | PlompCallTrace]
+        ],
+        *,
+        tags: TagsType | None = None,
+        timestamp: TimestampType | None = None,
+    ) -> range:
+        """Record a batch of events (payload dicts or `PlompEvent`s) and prompts
+        (`PlompCallTrace`s, which may already be completed) in a single step.
+
+        Every record shares `tags` and `timestamp`, which defaults to a single
+        reading of the buffer's `timestamp_fn`, unless it is passed as a
+        `(timestamp, record)` pair, e.g. to record when a completed prompt
+        started. Completions before their prompt's timestamp raise ValueError.
+        Returns the indices of the new items; pending prompts can be completed
+        with `record_prompt_completion`.
+        """
+        tags = freeze_mapping(tags or {})
+        if timestamp is None:
+            timestamp = self.timestamp_fn()
+        rows = []
+        for record in records:
+            record_timestamp = timestamp
+            if isinstance(record, tuple):
+                record_timestamp, record = record
+            if isinstance(record, dict):
+                rows.append(
+                    (record_timestamp, tags, EVENT_CODE, freeze_mapping(record), None)
+                )
+            elif isinstance(record, PlompEvent):
+                payload = freeze_mapping(record.payload)
+                rows.append((record_timestamp, tags, EVENT_CODE, payload, None))
+            elif isinstance(record, PlompCallTrace):
+                completion = record.completion
+                if completion is not None:
+                    completion = (completion.completion_timestamp, completion.response)
+                rows.append(
+                    (record_timestamp, tags, PROMPT_CODE, record.prompt, completion)
+                )
+            else:
+                raise TypeError(
+                    "Expected a payload dict, PlompEvent or PlompCallTrace, got "
+                    f"{type(record).__name__}"
+                )
+        return self._append_many(rows)
+
+    # The `_record_*` methods below are the unchecked hot path. Callers are
+    # expected to have validated their arguments at the public API boundary.
+
+    def _append(
+        self, timestamp: TimestampType, tags: TagsType, type_code: int, data
+    ) -> int:
+        # Text is tokenised before taking the lock, unless the search index is
+        # only built meanwhile.
+        words = None
+        if self._search_index is not None:
+            words = self._text_words(type_code, data)
+        with self._lock:
+            sink = self._sink
+            position = self._store.append(timestamp, tags, type_code, data)
+            insert_index = self._base_index + position
+            if type_code == PROMPT_CODE:
+                self._in_flight[insert_index] = None
+            self._tag_index.add(insert_index, self._store.tag_set_ids[position])
+            self._time_index.add(insert_index, self._store.timestamps[position])
+            if self._search_index is not None:
+                if words is None:
+                    words = self._text_words(type_code, data)
+                self._index_text_locked(insert_index, words)
+            if sink is not None:
+                sink.record(
+                    insert_index,
+                    timestamp,
+                    self._store.tag_dictionary.decode(
+                        self._store.tag_set_ids[position]
+                    ),
+                    type_code,
+                    data,
+                )
+            if self._max_bytes is not None:
+                self._retained_bytes += self._store.approximate_size(position)
+            if self._max_items is not None or self._max_bytes is not None:
+                self._evict_locked()
+        # Sink writes, and live queries which run user predicates and callbacks,
+        # happen outside of the lock.
+        if sink is not None:
+            sink._flush_if_full()
+        for live_query in self._live_queries:
+            live_query._catch_up()
+        return insert_index
+
+    def _append_many(
+        self,
+        rows: Sequence[Row],
+    ) -> range:
+        """Append rows in one step, updating the indexes in bulk, and return
+        their indices."""
+        store = self._store
+        rows_words = None
+        if self._search_index is not None:
+            rows_words = [
+                self._text_words(type_code, data, completion and completion[1])
+                for _, _, type_code, data, completion in rows
+            ]
+        with self._lock:
+            sink = self._sink
+            positions = store.append_many(rows)
+            start, stop = positions.start, positions.stop
+            indices = range(self._base_index + start, self._base_index + stop)
+            if not rows:
+                return indices
+
+            self._tag_index.add_many(indices, store.tag_set_ids[start:stop])
+            self._time_index.add_many(indices, store.timestamps[start:stop])
+            for n, (index, position) in enumerate(zip(indices, positions)):
+                timestamp, _, type_code, data, completion = rows[n]
+                if type_code == PROMPT_CODE and completion is None:
+                    self._in_flight[index] = None
+                if self._search_index is not None:
+                    if rows_words is None:
+                        words = self._text_words(
+                            type_code, data, completion and completion[1]
+                        )
+                    else:
+                        words = rows_words[n]
+                    self._index_text_locked(index, words)
+                if sink is not None:
+                    sink.record(
+                        index,
+                        timestamp,
+                        store.tag_dictionary.decode(store.tag_set_ids[position]),
+                        type_code,
+                        data,
+                    )
+                    if completion is not None:
+                        sink.complete(index, *completion)
+                if self._max_bytes is not None:
+                    self._retained_bytes += store.approximate_size(position)
+            if any(row[4] is not None for row in rows):
+                # Completed prompts are briefly visible as pending while appended.
+                self._version += 1
+            if self._max_items is not None or self._max_bytes is not None:
+                self._evict_locked()
+        if sink is not None:
+            sink._flush_if_full()
+        for live_query in self._live_queries:
+            live_query._catch_up()
+        return indices
+
+    def _record_prompt_start(self, prompt: str, tags: TagsType) -> PlompCallHandle:
+        insert_index = self._append(self.timestamp_fn(), tags, PROMPT_CODE, prompt)
+        return PlompCallHandle(self, insert_index)
+
+    def _record_prompt_completion(self, call_index: int, response: str):
+        self._complete(call_index, self.timestamp_fn(), response)
+
+    def _complete(
+        self, call_index: int, completion_timestamp: TimestampType, response: str
+    ):
+        response_words = None
+        if self._search_index is not None:
+            response_words = tokenize(response)
+        with self._lock:
+            sink = self._sink
+            try:
+                position = self._position(call_index)
+            except PlompItemEvictedError:
+                if call_index not in self._evicted_in_flight:
+                    raise
+                # The prompt only lives on in the log now.
+                self._evicted_in_flight.remove(call_index)
+                sink.complete(call_index, completion_timestamp, response)
+            else:
+                self._store.complete(position, completion_timestamp, response)
+                self._in_flight.pop(call_index, None)
+                self._version += 1
+                if self._search_index is not None:
+                    if response_words is None:
+                        response_words = tokenize(response)
+                    self._search_index.add_words(call_index, "response", response_words)
+                if sink is not None:
+                    sink.complete(call_index, completion_timestamp, response)
+                if self._max_bytes is not None:
+                    self._retained_bytes += len(response)
+                    self._evict_locked()
+        if sink is not None:
+            sink._flush_if_full()
+
+    def _record_event(self, payload: dict, tags: TagsType):
+        self._append(self.timestamp_fn(), tags, EVENT_CODE, freeze_mapping(payload))
 
     @typechecked
     def record_query(self, *, plomp_query: PlompBufferQuery, tags: TagsType):
-        record_time = self.timestamp_fn()
-        self._buffer_items.append(
-            PlompBufferItem(record_time, tags, PlompBufferItemType.QUERY, plomp_query)
-        )
+        # Lazy queries are run before taking the lock, so they record their
+        # results as of now, and stay serialisable once their items are evicted.
+        plomp_query = plomp_query._resolved()
+        self._append(self.timestamp_fn(), tags, QUERY_CODE, plomp_query)
 
     def __iter__(self) -> Iterator[PlompBufferItem]:
-        for buffer_item in self._buffer_items:
-            yield deepcopy(buffer_item)
+        # Items are materialised from the columns one at a time as they are read,
+        # under the lock so a concurrent eviction can't move them in between.
+        index = self.indices.start
+        while True:
+            with self._lock:
+                indices = self.indices
+                if index >= indices.stop:
+                    return
+                # Skip past anything evicted while we were iterating.
+                index = max(index, indices.start)
+                item = self._store.item(index - self._base_index)
+            yield item
+            index += 1
 
     @typechecked
     def where(
         self,
+        expression: PlompExpression | None = None,
+        /,
         *,
-        truth_fn: Callable[[PlompBufferItem], bool],
+        truth_fn: Callable[[PlompBufferItem], bool] | None = None,
+        pure: bool = False,
     ) -> PlompBufferQuery:
-        return PlompBufferQuery(self).where(truth_fn=truth_fn)
+        return PlompBufferQuery(self).where(expression, truth_fn=truth_fn, pure=pure)
 
     @typechecked
     def filter(
@@ -86,6 +669,38 @@ class PlompBuffer:
     ) -> PlompBufferQuery:
         return PlompBufferQuery(self).filter(how=how, tags_filter=tags_filter)
 
+    @typechecked
+    def between(
+        self, start: TimestampType | None, end: TimestampType | None
+    ) -> PlompBufferQuery:
+        return PlompBufferQuery(self).between(start, end)
+
+    @typechecked
+    def since(self, start: TimestampType) -> PlompBufferQuery:
+        return PlompBufferQuery(self).since(start)
+
+    @typechecked
+    def search(
+        self, text: str, *, fields: Sequence[SearchField] | None = None
+    ) -> PlompBufferQuery:
+        return PlompBufferQuery(self).search(text, fields=fields)
+
+    @typechecked
+    def slowest(self, k: int = 1) -> PlompBufferQuery:
+        return PlompBufferQuery(self).slowest(k)
+
+    @typechecked
+    def longest_in_flight(self, k: int = 1) -> PlompBufferQuery:
+        return PlompBufferQuery(self).longest_in_flight(k)
+
+    @typechecked
+    def latency_histogram(self, edges: Sequence[float]) -> list[int]:
+        return PlompBufferQuery(self).latency_histogram(edges)
+
+    @typechecked
+    def group_by(self, *tag_keys: str) -> "PlompGroupBy":
+        return PlompBufferQuery(self).group_by(*tag_keys)
+
     @typechecked
     def first(self, size: int = 1) -> "PlompBufferQuery":
         return PlompBufferQuery(self).first(size)
@@ -117,15 +732,17 @@ class PlompBuffer:
         return PlompBufferQuery(self).intersection(plomp_buffer_query)
 
     def __getitem__(self, index: int) -> PlompBufferItem:
-        return self._buffer_items[index]
+        with self._lock:
+            return self._store.item(self._position(index))
 
     def __len__(self) -> int:
-        return len(self._buffer_items)
+        return len(self._store) - self._head
 
     def to_dict(self) -> dict:
         return {
             "key": self.key,
             "buffer_items": [
-                buffer_item.to_dict() for buffer_item in self._buffer_items
+                self._store.item_dict(index - self._base_index)
+                for index in self.indices
             ],
         }
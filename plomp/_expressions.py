@@ -0,0 +1,339 @@
+import operator
+from array import array
+from typing import TYPE_CHECKING, Any, Callable, Sequence
+
+from plomp._buffer_items import PlompBufferItem, PlompBufferItemType
+from plomp._storage import ITEM_TYPE_CODES, NOT_COMPLETED, PlompItemStore
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised when NumPy is not installed
+    np = None
+
+if TYPE_CHECKING:
+    import numpy
+
+
+_COMPARISONS: dict[str, Callable[[Any, Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class PlompExpression:
+    """A predicate over buffer items which can be evaluated over whole columns.
+
+    Build expressions from `col`, e.g. `(col.type == "prompt") & (col.latency >
+    2.0)`, and pass them to `where`. Expressions are evaluated in bulk over the
+    buffer's columns (with NumPy if it is installed) rather than per item, and
+    are also plain callables on `PlompBufferItem`s.
+    """
+
+    __slots__ = ()
+
+    def __and__(self, other: "PlompExpression") -> "PlompExpression":
+        return _And(self, other)
+
+    def __or__(self, other: "PlompExpression") -> "PlompExpression":
+        return _Or(self, other)
+
+    def __invert__(self) -> "PlompExpression":
+        return _Not(self)
+
+    def __bool__(self):
+        raise TypeError(
+            "Combine expressions with &, | and ~ rather than and, or and not"
+        )
+
+    def __call__(self, item: PlompBufferItem) -> bool:
+        raise NotImplementedError
+
+    def compile(self, store: PlompItemStore) -> Callable[[int], bool]:
+        """A function testing the item at a store position."""
+        raise NotImplementedError
+
+    def mask(self, store: PlompItemStore, start: int, stop: int) -> "numpy.ndarray":
+        """A boolean mask over store positions `start:stop`."""
+        raise NotImplementedError
+
+    def select(
+        self, store: PlompItemStore, positions: Sequence[int], base_index: int
+    ) -> Sequence[int]:
+        """The item indices (`base_index` + position) of the sorted `positions`
+        which satisfy the expression."""
+        if not positions:
+            return array("q")
+
+        if np is None:
+            matches = self.compile(store)
+            return array(
+                "q",
+                (position + base_index for position in positions if matches(position)),
+            )
+
+        start, stop = positions[0], positions[-1] + 1
+        mask = self.mask(store, start, stop)
+        if len(positions) == stop - start:
+            selected = np.flatnonzero(mask) + (start + base_index)
+        else:
+            offsets = np.frombuffer(array("q", positions), dtype=np.int64) - start
+            selected = offsets[mask[offsets]] + (start + base_index)
+        result = array("q")
+        result.frombytes(selected.astype(np.int64).tobytes())
+        return result
+
+
+def _column(store: PlompItemStore, name: str, start: int, stop: int):
+    # Copy the slice first: a NumPy view would pin the array's buffer, and
+    # appends from other threads would then fail to resize it.
+    column = getattr(store, name)
+    return np.frombuffer(column[start:stop], dtype=_NUMPY_TYPES[column.typecode])
+
+
+_NUMPY_TYPES = {"B": "uint8", "H": "uint16", "I": "uint32", "q": "int64"}
+
+
+class _Comparison(PlompExpression):
+    __slots__ = ("op", "value")
+
+    def __init__(self, op: str, value):
+        self.op = op
+        self.value = value
+
+
+class _TagComparison(_Comparison):
+    __slots__ = ("key",)
+
+    def __init__(self, key: str, op: str, value):
+        if op not in ("==", "!=", "in"):
+            raise TypeError(f"Tags can only be compared with ==, != and isin, not {op}")
+        super().__init__(op, value)
+        self.key = key
+
+    def _values(self) -> list:
+        return list(self.value) if self.op == "in" else [self.value]
+
+    def __call__(self, item: PlompBufferItem) -> bool:
+        found = self.key in item.tags and any(
+            item.tags[self.key] == value for value in self._values()
+        )
+        return not found if self.op == "!=" else found
+
+    def _matching_tag_sets(self, store: PlompItemStore) -> set[int]:
+        matching = store.tag_dictionary.matching_tag_sets(
+            "any", {self.key: self._values()}
+        )
+        if self.op == "!=":
+            return set(store.tag_dictionary.ids()) - matching
+        return matching
+
+    def compile(self, store):
+        tag_set_ids, matching = store.tag_set_ids, self._matching_tag_sets(store)
+        return lambda position: tag_set_ids[position] in matching
+
+    def mask(self, store, start, stop):
+        return np.isin(
+            _column(store, "tag_set_ids", start, stop),
+            np.fromiter(self._matching_tag_sets(store), dtype=np.uint32),
+        )
+
+    def __repr__(self):
+        if self.op == "in":
+            return f"col.tag({self.key!r}).isin({list(self.value)!r})"
+        return f"col.tag({self.key!r}) {self.op} {self.value!r}"
+
+
+class _TypeComparison(_Comparison):
+    __slots__ = ()
+
+    def __init__(self, op: str, value):
+        if op not in ("==", "!=", "in"):
+            raise TypeError(
+                f"Types can only be compared with ==, != and isin, not {op}"
+            )
+        values = list(value) if op == "in" else [value]
+        super().__init__(op, [PlompBufferItemType(v) for v in values])
+
+    def _codes(self) -> set[int]:
+        codes = {ITEM_TYPE_CODES[item_type] for item_type in self.value}
+        if self.op == "!=":
+            return set(ITEM_TYPE_CODES.values()) - codes
+        return codes
+
+    def __call__(self, item: PlompBufferItem) -> bool:
+        return ITEM_TYPE_CODES[item.type_] in self._codes()
+
+    def compile(self, store):
+        type_codes, codes = store.type_codes, self._codes()
+        return lambda position: type_codes[position] in codes
+
+    def mask(self, store, start, stop):
+        return np.isin(
+            _column(store, "type_codes", start, stop),
+            np.array(sorted(self._codes()), dtype=np.uint8),
+        )
+
+    def __repr__(self):
+        values = [item_type.value for item_type in self.value]
+        if self.op == "in":
+            return f"col.type.isin({values!r})"
+        return f"col.type {self.op} {values[0]!r}"
+
+
+class _LatencyComparison(_Comparison):
+    """Compares prompt latency in seconds. Prompts which have not completed (and
+    other items) have no latency and fail every comparison."""
+
+    __slots__ = ()
+
+    def __init__(self, op: str, value):
+        if op == "in":
+            raise TypeError("Latency can't be compared with isin")
+        super().__init__(op, value)
+
+    def __call__(self, item: PlompBufferItem) -> bool:
+        if item.type_ != PlompBufferItemType.PROMPT:
+            return False
+        completion = item.call_trace.completion
+        if completion is None:
+            return False
+        latency = (completion.completion_timestamp - item.timestamp).total_seconds()
+        return _COMPARISONS[self.op](latency, self.value)
+
+    def compile(self, store):
+        latencies = store.latencies
+        compare, threshold_ns = _COMPARISONS[self.op], self.value * 1e9
+
+        def matches(position: int) -> bool:
+            latency_ns = latencies[position]
+            return latency_ns != NOT_COMPLETED and compare(latency_ns, threshold_ns)
+
+        return matches
+
+    def mask(self, store, start, stop):
+        latencies = _column(store, "latencies", start, stop)
+        return (latencies != NOT_COMPLETED) & _COMPARISONS[self.op](
+            latencies, self.value * 1e9
+        )
+
+    def __repr__(self):
+        return f"col.latency {self.op} {self.value!r}"
+
+
+class _And(PlompExpression):
+    __slots__ = ("left", "right")
+
+    def __init__(self, left: PlompExpression, right: PlompExpression):
+        self.left, self.right = left, right
+
+    def __call__(self, item):
+        return self.left(item) and self.right(item)
+
+    def compile(self, store):
+        left, right = self.left.compile(store), self.right.compile(store)
+        return lambda position: left(position) and right(position)
+
+    def mask(self, store, start, stop):
+        return self.left.mask(store, start, stop) & self.right.mask(store, start, stop)
+
+    def __repr__(self):
+        return f"({self.left!r}) & ({self.right!r})"
+
+
+class _Or(_And):
+    __slots__ = ()
+
+    def __call__(self, item):
+        return self.left(item) or self.right(item)
+
+    def compile(self, store):
+        left, right = self.left.compile(store), self.right.compile(store)
+        return lambda position: left(position) or right(position)
+
+    def mask(self, store, start, stop):
+        return self.left.mask(store, start, stop) | self.right.mask(store, start, stop)
+
+    def __repr__(self):
+        return f"({self.left!r}) | ({self.right!r})"
+
+
+class _Not(PlompExpression):
+    __slots__ = ("operand",)
+
+    def __init__(self, operand: PlompExpression):
+        self.operand = operand
+
+    def __call__(self, item):
+        return not self.operand(item)
+
+    def compile(self, store):
+        operand = self.operand.compile(store)
+        return lambda position: not operand(position)
+
+    def mask(self, store, start, stop):
+        return ~self.operand.mask(store, start, stop)
+
+    def __repr__(self):
+        return f"~({self.operand!r})"
+
+
+class _ColumnRef:
+    """One column of the buffer, compared with a value to build an expression."""
+
+    __slots__ = ("_make",)
+
+    def __init__(self, make: Callable[[str, Any], PlompExpression]):
+        self._make = make
+
+    def __eq__(self, value) -> PlompExpression:  # type: ignore[override]
+        return self._make("==", value)
+
+    def __ne__(self, value) -> PlompExpression:  # type: ignore[override]
+        return self._make("!=", value)
+
+    def __lt__(self, value) -> PlompExpression:
+        return self._make("<", value)
+
+    def __le__(self, value) -> PlompExpression:
+        return self._make("<=", value)
+
+    def __gt__(self, value) -> PlompExpression:
+        return self._make(">", value)
+
+    def __ge__(self, value) -> PlompExpression:
+        return self._make(">=", value)
+
+    def isin(self, values: Sequence) -> PlompExpression:
+        return self._make("in", list(values))
+
+    __hash__ = None
+
+
+class _Columns:
+    """Entry point for building expressions, exported as `plomp.col`."""
+
+    __slots__ = ()
+
+    def tag(self, key: str) -> _ColumnRef:
+        """The value of the tag `key`."""
+        return _ColumnRef(lambda op, value: _TagComparison(key, op, value))
+
+    @property
+    def type(self) -> _ColumnRef:
+        """The item type, as a `PlompBufferItemType` or its string value."""
+        return _ColumnRef(_TypeComparison)
+
+    @property
+    def latency(self) -> _ColumnRef:
+        """The latency of completed prompts in seconds."""
+        return _ColumnRef(_LatencyComparison)
+
+    def __repr__(self):
+        return "col"
+
+
+col = _Columns()
@@ -0,0 +1,316 @@
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from itertools import chain
+from typing import Iterable, Iterator, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised when NumPy is not installed
+    np = None
+
+
+# The helpers below take any sorted, de-duplicated sequences of indices and
+# return packed `array('q')`s. With NumPy installed, large inputs are merged by
+# NumPy's sorts and searches rather than by Python loops over each index.
+
+# Below this many indices in total, the cost of converting to and from NumPy
+# arrays outweighs the faster merge.
+_NUMPY_MIN_INDICES = 1024
+
+
+def union_sorted(sequences: Iterable[Sequence[int]]) -> array:
+    """The sorted, de-duplicated union of several sorted index sequences."""
+    sequences = list(sequences)
+    if len(sequences) == 1:
+        return array("q", sequences[0])
+    if _use_numpy(sequences):
+        return _from_numpy(_unique_sorted(_concatenate(sequences)))
+    if len(sequences) == 2:
+        return merge_union(*sequences)
+    result = array("q")
+    for index in merge(*sequences):
+        if not result or result[-1] != index:
+            result.append(index)
+    return result
+
+
+def merge_union(a: Sequence[int], b: Sequence[int]) -> array:
+    """The sorted union of two sorted index sequences, by a linear merge."""
+    if _use_numpy((a, b)):
+        return _from_numpy(_unique_sorted(_concatenate((a, b))))
+    result = array("q")
+    append = result.append
+    iter_a, iter_b = iter(a), iter(b)
+    x, y = next(iter_a, None), next(iter_b, None)
+    while x is not None and y is not None:
+        if x < y:
+            append(x)
+            x = next(iter_a, None)
+        elif y < x:
+            append(y)
+            y = next(iter_b, None)
+        else:
+            append(x)
+            x, y = next(iter_a, None), next(iter_b, None)
+    if x is not None:
+        append(x)
+        result.extend(iter_a)
+    if y is not None:
+        append(y)
+        result.extend(iter_b)
+    return result
+
+
+def union_disjoint_sorted(sequences: Iterable[Sequence[int]]) -> array:
+    """Like `union_sorted` for sequences known not to share any index."""
+    sequences = list(sequences)
+    if _use_numpy(sequences):
+        merged = _concatenate(sequences)
+        merged.sort()
+        return _from_numpy(merged)
+    return array("q", sorted(chain.from_iterable(sequences)))
+
+
+def intersect_sorted(a: Sequence[int], b: Sequence[int]) -> array:
+    """The sorted intersection of two sorted index sequences."""
+    if len(a) > len(b):
+        a, b = b, a
+    if _use_numpy((a, b)):
+        x, y = _to_numpy(a), _to_numpy(b)
+        if len(a) * 16 < len(b):
+            positions = np.searchsorted(y, x)
+            found = positions < len(y)
+            found[found] = y[positions[found]] == x[found]
+            return _from_numpy(x[found])
+        return _from_numpy(x[np.isin(x, y, assume_unique=True)])
+    result = array("q")
+    append = result.append
+    if len(a) * 16 < len(b):
+        # Galloping through the longer sequence costs O(len(a) * log(len(b))),
+        # which beats a linear merge whenever `a` is much shorter.
+        low = 0
+        for index in a:
+            low = bisect_left(b, index, low)
+            if low == len(b):
+                break
+            if b[low] == index:
+                append(index)
+        return result
+
+    iter_a, iter_b = iter(a), iter(b)
+    x, y = next(iter_a, None), next(iter_b, None)
+    while x is not None and y is not None:
+        if x < y:
+            x = next(iter_a, None)
+        elif y < x:
+            y = next(iter_b, None)
+        else:
+            append(x)
+            x, y = next(iter_a, None), next(iter_b, None)
+    return result
+
+
+def difference_sorted(a: Sequence[int], b: Sequence[int]) -> array:
+    """The indices of sorted `a` which are not in sorted `b`."""
+    if _use_numpy((a, b)):
+        x, y = _to_numpy(a), _to_numpy(b)
+        return _from_numpy(x[np.isin(x, y, assume_unique=True, invert=True)])
+    result = array("q")
+    append = result.append
+    iter_a, iter_b = iter(a), iter(b)
+    x, y = next(iter_a, None), next(iter_b, None)
+    while x is not None and y is not None:
+        if x < y:
+            append(x)
+            x = next(iter_a, None)
+        elif y < x:
+            y = next(iter_b, None)
+        else:
+            x, y = next(iter_a, None), next(iter_b, None)
+    if x is not None:
+        append(x)
+        result.extend(iter_a)
+    return result
+
+
+def is_contiguous(indices: Sequence[int]) -> bool:
+    """Whether sorted, de-duplicated `indices` form a single run."""
+    return not indices or indices[-1] - indices[0] + 1 == len(indices)
+
+
+def clip_sorted(indices: Sequence[int], start: int, stop: int) -> Sequence[int]:
+    """The part of sorted `indices` within `range(start, stop)`."""
+    return indices[bisect_left(indices, start) : bisect_left(indices, stop)]
+
+
+def _use_numpy(sequences: Sequence[Sequence[int]]) -> bool:
+    return np is not None and sum(map(len, sequences)) >= _NUMPY_MIN_INDICES
+
+
+def _to_numpy(indices: Sequence[int]) -> "np.ndarray":
+    if isinstance(indices, range):
+        return np.arange(indices.start, indices.stop, indices.step, dtype=np.int64)
+    if isinstance(indices, array) and indices.typecode == "q":
+        # Copy first: a NumPy view would pin the array's buffer, and posting
+        # lists are appended to by other threads.
+        return np.frombuffer(indices[:], dtype=np.int64)
+    return np.fromiter(indices, dtype=np.int64, count=len(indices))
+
+
+def _concatenate(sequences: Iterable[Sequence[int]]) -> "np.ndarray":
+    return np.concatenate([_to_numpy(indices) for indices in sequences])
+
+
+def _unique_sorted(indices: "np.ndarray") -> "np.ndarray":
+    # Sorting the concatenation and dropping repeats is much faster than
+    # `np.union1d`, which also handles unsorted input.
+    indices.sort()
+    keep = np.empty(len(indices), dtype=bool)
+    keep[:1] = True
+    np.not_equal(indices[1:], indices[:-1], out=keep[1:])
+    return indices[keep]
+
+
+def _from_numpy(indices: "np.ndarray") -> array:
+    result = array("q")
+    result.frombytes(indices.astype(np.int64, copy=False).tobytes())
+    return result
+
+
+class PlompIndexSet(Sequence[int]):
+    """An immutable, sorted set of item indices.
+
+    Contiguous selections (a whole buffer, `first`, `last`, `window`) are held as
+    a `range`, so creating and slicing them is O(1) whatever their size. Any
+    other selection is packed into an `array('q')`, taking 8 bytes per index
+    rather than a boxed int per index (plus hash table slots) for lists and
+    sets. Set operations merge the sorted indices (with NumPy for large sets, if
+    it is installed), and the set compares equal to any sequence holding the
+    same indices.
+    """
+
+    __slots__ = ("_indices",)
+
+    def __init__(self, indices: Iterable[int] = ()):
+        """Build a set from any iterable of indices, sorting it if needed."""
+        if isinstance(indices, PlompIndexSet):
+            indices = indices._indices
+        elif not (isinstance(indices, range) and indices.step > 0):
+            # Packed arrays are only used as they are if already sorted; use
+            # `from_sorted` to skip the check.
+            if not _is_packed(indices):
+                indices = array("q", indices)
+            if any(indices[i] >= indices[i + 1] for i in range(len(indices) - 1)):
+                indices = array("q", sorted(set(indices)))
+        self._indices = indices
+
+    @classmethod
+    def from_sorted(cls, indices: Iterable[int]) -> "PlompIndexSet":
+        """Wrap indices which are already sorted and de-duplicated."""
+        if isinstance(indices, cls):
+            return indices
+        index_set = cls.__new__(cls)
+        index_set._indices = indices if _is_packed(indices) else array("q", indices)
+        return index_set
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return PlompIndexSet.from_sorted(self._indices[i])
+        return self._indices[i]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._indices)
+
+    def __reversed__(self) -> Iterator[int]:
+        return reversed(self._indices)
+
+    def __contains__(self, index) -> bool:
+        if isinstance(self._indices, range):
+            return index in self._indices
+        position = bisect_left(self._indices, index)
+        return position < len(self._indices) and self._indices[position] == index
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PlompIndexSet):
+            other = other._indices
+        elif not isinstance(other, (list, tuple, range, array)):
+            return NotImplemented
+
+        indices = self._indices
+        if len(indices) != len(other):
+            return False
+        if type(indices) is type(other):
+            return indices == other
+        return list(indices) == list(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        if isinstance(self._indices, range):
+            return f"{self.__class__.__name__}({self._indices!r})"
+        return f"{self.__class__.__name__}({self._indices.tolist()!r})"
+
+    def tolist(self) -> list[int]:
+        if isinstance(self._indices, range):
+            return list(self._indices)
+        return self._indices.tolist()
+
+    @property
+    def is_range(self) -> bool:
+        """Whether the indices are held as a range rather than materialised."""
+        return isinstance(self._indices, range)
+
+    def union(self, other: Sequence[int]) -> "PlompIndexSet":
+        a, b = self._indices, _unwrap(other)
+        if not b:
+            return self
+        if not a:
+            return PlompIndexSet.from_sorted(b)
+        if _is_run(a) and _is_run(b) and a.start <= b.stop and b.start <= a.stop:
+            # Overlapping or adjacent runs.
+            return PlompIndexSet.from_sorted(
+                range(min(a.start, b.start), max(a.stop, b.stop))
+            )
+        # Disjoint runs, e.g. two windows of a buffer, are simply concatenated.
+        if a[-1] < b[0]:
+            return PlompIndexSet.from_sorted(array("q", a) + array("q", b))
+        if b[-1] < a[0]:
+            return PlompIndexSet.from_sorted(array("q", b) + array("q", a))
+        return PlompIndexSet.from_sorted(merge_union(a, b))
+
+    def intersection(self, other: Sequence[int]) -> "PlompIndexSet":
+        a, b = self._indices, _unwrap(other)
+        if _is_run(a) and _is_run(b):
+            start = max(a.start, b.start)
+            return PlompIndexSet.from_sorted(
+                range(start, max(start, min(a.stop, b.stop)))
+            )
+        if _is_run(a):
+            return PlompIndexSet.from_sorted(clip_sorted(b, a.start, a.stop))
+        if _is_run(b):
+            return PlompIndexSet.from_sorted(clip_sorted(a, b.start, b.stop))
+        return PlompIndexSet.from_sorted(intersect_sorted(a, b))
+
+    def difference(self, other: Sequence[int]) -> "PlompIndexSet":
+        return PlompIndexSet.from_sorted(
+            difference_sorted(self._indices, _unwrap(other))
+        )
+
+
+def _is_packed(indices) -> bool:
+    """Whether `indices` can back a `PlompIndexSet` without being copied."""
+    if isinstance(indices, range):
+        return indices.step > 0
+    return isinstance(indices, array) and indices.typecode == "q"
+
+
+def _is_run(indices) -> bool:
+    return isinstance(indices, range) and indices.step == 1
+
+
+def _unwrap(indices: Sequence[int]) -> Sequence[int]:
+    return indices._indices if isinstance(indices, PlompIndexSet) else indices
@@ -0,0 +1,70 @@
+import heapq
+from array import array
+from bisect import bisect_right
+from typing import Sequence
+
+from plomp._expressions import _column, np
+from plomp._storage import NOT_COMPLETED, PlompItemStore
+
+
+# Latency analysis over the store's latency column. Functions take sorted store
+# positions, and only completed prompts have a latency.
+
+
+def _latencies(store: PlompItemStore, positions: Sequence[int]):
+    start, stop = positions[0], positions[-1] + 1
+    latencies = _column(store, "latencies", start, stop)
+    if len(positions) == stop - start:
+        return np.arange(start, stop), latencies
+    offsets = np.frombuffer(array("q", positions), dtype=np.int64)
+    return offsets, latencies[offsets - start]
+
+
+def latency_histogram(
+    store: PlompItemStore, positions: Sequence[int], edges_ns: Sequence[int]
+) -> list[int]:
+    """Counts of latencies below `edges_ns[0]`, in each `[edges_ns[i],
+    edges_ns[i + 1])` and from `edges_ns[-1]` up."""
+    counts = [0] * (len(edges_ns) + 1)
+    if not positions:
+        return counts
+
+    if np is None:
+        latencies = store.latencies
+        for position in positions:
+            latency_ns = latencies[position]
+            if latency_ns != NOT_COMPLETED:
+                counts[bisect_right(edges_ns, latency_ns)] += 1
+        return counts
+
+    _, latencies = _latencies(store, positions)
+    buckets = np.searchsorted(
+        np.array(edges_ns, dtype=np.int64),
+        latencies[latencies != NOT_COMPLETED],
+        side="right",
+    )
+    return np.bincount(buckets, minlength=len(counts)).tolist()
+
+
+def slowest_positions(
+    store: PlompItemStore, positions: Sequence[int], k: int
+) -> list[int]:
+    """The sorted positions of the (at most) `k` slowest completed prompts,
+    found by partial selection rather than sorting."""
+    if not positions or k <= 0:
+        return []
+
+    if np is None:
+        latencies = store.latencies
+        slowest = heapq.nlargest(k, positions, key=latencies.__getitem__)
+        # Incomplete items sort below every latency, so they only make it in if
+        # there are fewer than `k` completed prompts.
+        return sorted(p for p in slowest if latencies[p] != NOT_COMPLETED)
+
+    offsets, latencies = _latencies(store, positions)
+    completed = latencies != NOT_COMPLETED
+    offsets, latencies = offsets[completed], latencies[completed]
+    if len(offsets) > k:
+        selected = np.argpartition(latencies, len(latencies) - k)[-k:]
+        offsets = np.sort(offsets[selected])
+    return offsets.tolist()
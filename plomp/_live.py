@@ -0,0 +1,207 @@
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Callable
+
+from plomp._index_sets import PlompIndexSet
+from plomp._search import item_words, tokenize
+from plomp._plan import (
+    ExpressionFilter,
+    PlanNode,
+    Source,
+    TagFilter,
+    TextSearch,
+    TimeRange,
+    Where,
+    optimize,
+    rebase,
+)
+
+if TYPE_CHECKING:
+    from plomp._core import PlompBuffer
+    from plomp._query import PlompBufferQuery
+
+logger = logging.getLogger(__name__)
+
+
+class PlompLiveQuery:
+    """A query which the buffer keeps up to date as items are appended.
+
+    Each appended item is run through the query's predicates once, so keeping
+    the results current costs time proportional to the new items only.
+    Predicates see an item as it was when it was appended; e.g. a prompt is
+    not re-evaluated when it later completes.
+
+    New matches are delivered to `callback` as a `PlompBufferQuery` on the
+    recording thread, and can also be pulled with `new_matches`.
+
+    Exceptions from predicates and `callback` are logged rather than raised
+    into the code recording the item; an item whose predicate raises is
+    treated as not matching.
+    """
+
+    def __init__(
+        self,
+        query: "PlompBufferQuery",
+        callback: Callable[["PlompBufferQuery"], None] | None = None,
+    ):
+        self.buffer: "PlompBuffer" = query.buffer
+        self.op_name = f"live[]({query.op_name})"
+        self._callback = callback
+        # Re-entrant so callbacks may read the live query.
+        self._lock = threading.RLock()
+        # Matching tag sets, per tag filter and tag set id, valid while the tag
+        # dictionary's generation is `_tag_generation` (i.e. no id was reused).
+        self._tag_matches: dict[tuple[int, int], bool] = {}
+        self._tag_generation = self.buffer._store.tag_dictionary.generation
+
+        with self._lock:
+            # Register first, so nothing appended from here on is missed: any
+            # catch-up waits for the initial results below.
+            self.buffer._add_live_query(self)
+            try:
+                indices = self.buffer.indices
+                self._plan = optimize(rebase(query._plan, indices))
+                self._matches = array("q", self._plan.execute())
+            except BaseException:
+                self.buffer._remove_live_query(self)
+                raise
+            self._next_index = indices.stop
+            self._delivered = len(self._matches)
+
+    def _tags_match(self, node: TagFilter, position: int) -> bool:
+        tag_dictionary = self.buffer._store.tag_dictionary
+        if tag_dictionary.generation != self._tag_generation:
+            self._tag_matches.clear()
+            self._tag_generation = tag_dictionary.generation
+        tag_set_id = self.buffer._store.tag_set_ids[position]
+        key = (id(node), tag_set_id)
+        matches = self._tag_matches.get(key)
+        if matches is None:
+            matches = self._tag_matches[key] = bool(
+                tag_dictionary.matching_tag_sets(
+                    node.how, node.tags_filter, [tag_set_id]
+                )
+            )
+        return matches
+
+    def _matches_item(self, node: PlanNode, index: int) -> bool:
+        if isinstance(node, Source):
+            return True
+        if isinstance(node, TagFilter):
+            return self._matches_item(node.child, index) and self._tags_match(
+                node, self.buffer._position(index)
+            )
+        if isinstance(node, TimeRange):
+            if not self._matches_item(node.child, index):
+                return False
+            timestamp_ns = self.buffer.timestamp_ns(index)
+            return (node.start_ns is None or timestamp_ns >= node.start_ns) and (
+                node.end_ns is None or timestamp_ns < node.end_ns
+            )
+        if isinstance(node, TextSearch):
+            return self._matches_item(node.child, index) and tokenize(
+                node.text
+            ) <= item_words(self.buffer[index], node.fields)
+        if isinstance(node, ExpressionFilter):
+            return self._matches_item(node.child, index) and node.expression(
+                self.buffer[index]
+            )
+        if isinstance(node, Where):
+            return self._matches_item(node.child, index) and node.truth_fn(
+                self.buffer[index]
+            )
+        if node.op == "union":
+            return self._matches_item(node.left, index) or self._matches_item(
+                node.right, index
+            )
+        return self._matches_item(node.left, index) and self._matches_item(
+            node.right, index
+        )
+
+    def _catch_up(self):
+        """Evaluate the items appended since the last catch-up."""
+        from plomp._core import PlompItemEvictedError
+        from plomp._query import PlompBufferQuery
+
+        with self._lock:
+            indices = self.buffer.indices
+            # Forget matches which a bounded buffer has since evicted.
+            if self._matches and self._matches[0] < indices.start:
+                evicted = bisect_left(self._matches, indices.start)
+                del self._matches[:evicted]
+                self._delivered = max(self._delivered - evicted, 0)
+
+            first_new = len(self._matches)
+            for index in range(max(self._next_index, indices.start), indices.stop):
+                # Advanced item by item, so no item is evaluated twice.
+                self._next_index = index + 1
+                try:
+                    if self._matches_item(self._plan, index):
+                        self._matches.append(index)
+                except PlompItemEvictedError:
+                    pass
+                except Exception:
+                    logger.exception(
+                        "Live query %s failed on item %d, treating it as not matching",
+                        self.op_name,
+                        index,
+                    )
+            self._next_index = max(self._next_index, indices.stop)
+
+            if self._callback is not None and first_new < len(self._matches):
+                try:
+                    self._callback(
+                        PlompBufferQuery(
+                            self.buffer,
+                            matched_indices=PlompIndexSet.from_sorted(
+                                self._matches[first_new:]
+                            ),
+                            op_name=self.op_name,
+                        )
+                    )
+                except Exception:
+                    logger.exception("Callback of live query %s failed", self.op_name)
+
+    @property
+    def matched_indices(self) -> PlompIndexSet:
+        """Every (retained) match so far."""
+        self._catch_up()
+        with self._lock:
+            return PlompIndexSet.from_sorted(self._matches[:])
+
+    def query(self) -> "PlompBufferQuery":
+        """A snapshot of the current matches as a regular query."""
+        from plomp._query import PlompBufferQuery
+
+        return PlompBufferQuery(
+            self.buffer, matched_indices=self.matched_indices, op_name=self.op_name
+        )
+
+    def new_matches(self) -> "PlompBufferQuery":
+        """The matches since the previous call (or since the query went live)."""
+        from plomp._query import PlompBufferQuery
+
+        self._catch_up()
+        with self._lock:
+            new_indices = self._matches[self._delivered :]
+            self._delivered = len(self._matches)
+        return PlompBufferQuery(
+            self.buffer,
+            matched_indices=PlompIndexSet.from_sorted(new_indices),
+            op_name=self.op_name,
+        )
+
+    def __len__(self) -> int:
+        return len(self.matched_indices)
+
+    def close(self):
+        """Stop maintaining the query."""
+        self.buffer._remove_live_query(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
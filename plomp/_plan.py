@@ -0,0 +1,336 @@
+from array import array
+from dataclasses import dataclass, replace
+from itertools import islice
+from typing import TYPE_CHECKING, Callable, Hashable, Iterator, Literal, Sequence
+
+from plomp._buffer_items import PlompBufferItem
+from plomp._expressions import PlompExpression
+from plomp._index_sets import PlompIndexSet
+from plomp._search import SearchField
+from plomp._tags import hashable_tag_value
+from plomp._types import TagsFilter
+
+if TYPE_CHECKING:
+    from plomp._core import PlompBuffer
+
+
+# A `PlompBufferQuery` is a lazy logical plan over the buffer's item indices. Every
+# node produces sorted indices, either all at once (`execute`, preferably as a
+# packed `array('q')`) or one at a time in either direction (`stream`), so a
+# limit can stop a scan early.
+
+
+class PlanNode:
+    __slots__ = ()
+
+    def execute(self) -> Sequence[int]:
+        raise NotImplementedError
+
+    def stream(self, reverse: bool = False) -> Iterator[int]:
+        indices = self.execute()
+        return iter(reversed(indices) if reverse else indices)
+
+
+@dataclass(slots=True, frozen=True)
+class Source(PlanNode):
+    """A fixed set of sorted indices, e.g. the buffer's indices at query time."""
+
+    indices: Sequence[int]
+
+    def execute(self) -> Sequence[int]:
+        return self.indices
+
+
+@dataclass(slots=True, frozen=True)
+class Cached(PlanNode):
+    """The already computed results of `plan`, which is kept for live queries."""
+
+    plan: PlanNode
+    indices: Sequence[int]
+
+    def execute(self) -> Sequence[int]:
+        return self.indices
+
+
+@dataclass(slots=True, frozen=True)
+class TagFilter(PlanNode):
+    """A tag filter answered from the buffer's inverted tag index."""
+
+    child: PlanNode
+    buffer: "PlompBuffer"
+    how: Literal["any"] | Literal["all"] | Literal["none"]
+    tags_filter: TagsFilter
+
+    def execute(self) -> Sequence[int]:
+        return self.buffer._filter_indices(
+            self.child.execute(), self.how, self.tags_filter
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class TimeRange(PlanNode):
+    """`start_ns <= timestamp < end_ns`, answered from the buffer's time index."""
+
+    child: PlanNode
+    buffer: "PlompBuffer"
+    start_ns: int | None
+    end_ns: int | None
+
+    def execute(self) -> Sequence[int]:
+        return self.buffer._time_range_indices(
+            self.child.execute(), self.start_ns, self.end_ns
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class TextSearch(PlanNode):
+    """Items mentioning every word of `text`, from the buffer's search index."""
+
+    child: PlanNode
+    buffer: "PlompBuffer"
+    text: str
+    fields: tuple[SearchField, ...]
+
+    def execute(self) -> Sequence[int]:
+        return self.buffer._search_indices(self.child.execute(), self.text, self.fields)
+
+
+@dataclass(slots=True, frozen=True)
+class ExpressionFilter(PlanNode):
+    """A `plomp.col` expression, evaluated in bulk over the buffer's columns."""
+
+    child: PlanNode
+    buffer: "PlompBuffer"
+    expression: PlompExpression
+
+    def execute(self) -> Sequence[int]:
+        return self.buffer._expression_indices(self.child.execute(), self.expression)
+
+
+@dataclass(slots=True, frozen=True)
+class Where(PlanNode):
+    """An opaque predicate which has to be evaluated item by item. Its results
+    are only cached if it is marked `pure`."""
+
+    child: PlanNode
+    buffer: "PlompBuffer"
+    truth_fn: Callable[[PlompBufferItem], bool]
+    pure: bool = False
+
+    def execute(self) -> Sequence[int]:
+        return array("q", self.stream())
+
+    def stream(self, reverse: bool = False) -> Iterator[int]:
+        buffer, truth_fn = self.buffer, self.truth_fn
+        for index in self.child.stream(reverse):
+            if truth_fn(buffer[index]):
+                yield index
+
+
+@dataclass(slots=True, frozen=True)
+class Slice(PlanNode):
+    """`first`, `last` and `window`: a positional slice of the child's indices."""
+
+    child: PlanNode
+    start: int | None
+    stop: int | None
+
+    def execute(self) -> Sequence[int]:
+        start, stop = self.start, self.stop
+        # Leading slices only need to pull `stop` indices from the front of the
+        # child, and trailing ones `-start` indices from the back.
+        if (start is None or start >= 0) and (stop is None or stop >= 0):
+            return array("q", islice(self.child.stream(), start, stop))
+        if start is not None and start < 0 and stop is None:
+            trailing = array("q", islice(self.child.stream(reverse=True), -start))
+            trailing.reverse()
+            return trailing
+        return self.child.execute()[start:stop]
+
+
+@dataclass(slots=True, frozen=True)
+class TopLatency(PlanNode):
+    """`slowest` and `longest_in_flight`: the child's `k` completed prompts with
+    the highest latency, or `k` pending prompts which started earliest."""
+
+    child: PlanNode
+    buffer: "PlompBuffer"
+    k: int
+    in_flight: bool
+
+    def execute(self) -> Sequence[int]:
+        if self.in_flight:
+            return self.buffer._longest_in_flight_indices(self.child.execute(), self.k)
+        return self.buffer._slowest_indices(self.child.execute(), self.k)
+
+
+@dataclass(slots=True, frozen=True)
+class SetOperation(PlanNode):
+    left: PlanNode
+    right: PlanNode
+    op: Literal["union"] | Literal["intersection"]
+
+    def execute(self) -> Sequence[int]:
+        left = PlompIndexSet.from_sorted(self.left.execute())
+        if self.op == "union":
+            return left.union(self.right.execute())
+        return left.intersection(self.right.execute())
+
+
+def _predicate_cost(predicate: PlanNode) -> int:
+    if isinstance(predicate, Where):
+        return 2
+    if isinstance(predicate, ExpressionFilter):
+        return 1
+    return 0
+
+
+PREDICATES = (TagFilter, TimeRange, TextSearch, ExpressionFilter, Where)
+
+
+def optimize(node: PlanNode) -> PlanNode:
+    """Rewrite a plan so it touches as few items as possible.
+
+    Runs of predicates are reordered so that indexed tag filters, time ranges
+    and text searches, then column expressions, narrow the candidates before
+    any `where` callable runs, since none of them materialise items.
+    Slices of a fixed set of indices are applied straight away; any other
+    `Slice` streams its child and stops early.
+    """
+    if isinstance(node, PREDICATES):
+        predicates = []
+        while isinstance(node, PREDICATES):
+            predicates.append(node)
+            node = node.child
+        predicates.reverse()
+
+        node = optimize(node)
+        for predicate in sorted(predicates, key=_predicate_cost):
+            node = replace(predicate, child=node)
+        return node
+    if isinstance(node, Slice):
+        child = optimize(node.child)
+        if isinstance(child, (Source, Cached)):
+            # Contiguous selections are ranges, so slicing them is O(1).
+            return Source(child.indices[node.start : node.stop])
+        return Slice(child, node.start, node.stop)
+    if isinstance(node, TopLatency):
+        return replace(node, child=optimize(node.child))
+    if isinstance(node, SetOperation):
+        return SetOperation(optimize(node.left), optimize(node.right), node.op)
+    return node
+
+
+def rebase(node: PlanNode, indices: range) -> PlanNode:
+    """Re-root a plan of predicates and set operations on `indices`.
+
+    Such plans decompose over their input, so e.g. the matches among newly
+    appended items can be computed on their own.
+    """
+    if isinstance(node, Cached):
+        return rebase(node.plan, indices)
+    if isinstance(node, Source):
+        if not isinstance(node.indices, range):
+            raise ValueError(
+                "Only queries over a whole buffer can be live, not over a fixed "
+                "list of indices"
+            )
+        return Source(indices)
+    if isinstance(node, PREDICATES):
+        return replace(node, child=rebase(node.child, indices))
+    if isinstance(node, SetOperation):
+        return SetOperation(
+            rebase(node.left, indices), rebase(node.right, indices), node.op
+        )
+    raise ValueError(
+        "first, last, window, slowest and longest_in_flight can't be maintained "
+        "incrementally, so queries using them can't be live"
+    )
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _node_key(node: PlanNode, sources: list[range], limits: list[PlanNode]) -> Hashable:
+    if isinstance(node, Cached):
+        return _node_key(node.plan, sources, limits)
+    if isinstance(node, Source):
+        if not isinstance(node.indices, range) or node.indices.step != 1:
+            raise _Uncacheable
+        sources.append(node.indices)
+        return ("source",)
+    if isinstance(node, TagFilter):
+        tags_filter = tuple(
+            (key, tuple(hashable_tag_value(value) for value in values))
+            for key, values in node.tags_filter.items()
+        )
+        return ("filter", node.how, tags_filter, _node_key(node.child, sources, limits))
+    if isinstance(node, TimeRange):
+        return (
+            "time",
+            node.start_ns,
+            node.end_ns,
+            _node_key(node.child, sources, limits),
+        )
+    if isinstance(node, TextSearch):
+        return (
+            "search",
+            node.text,
+            node.fields,
+            _node_key(node.child, sources, limits),
+        )
+    if isinstance(node, ExpressionFilter):
+        return (
+            "expression",
+            repr(node.expression),
+            _node_key(node.child, sources, limits),
+        )
+    if isinstance(node, Where):
+        # Callables are keyed by identity, which is only sound for pure ones.
+        if not node.pure:
+            raise _Uncacheable
+        return ("where", node.truth_fn, _node_key(node.child, sources, limits))
+    if isinstance(node, Slice):
+        limits.append(node)
+        return ("slice", node.start, node.stop, _node_key(node.child, sources, limits))
+    if isinstance(node, TopLatency):
+        limits.append(node)
+        return (
+            "top_latency",
+            node.k,
+            node.in_flight,
+            _node_key(node.child, sources, limits),
+        )
+    if isinstance(node, SetOperation):
+        return (
+            node.op,
+            _node_key(node.left, sources, limits),
+            _node_key(node.right, sources, limits),
+        )
+    raise _Uncacheable
+
+
+def plan_key(node: PlanNode) -> tuple[Hashable, range | None] | None:
+    """A hashable key identifying what `node` computes, or None if it has none.
+
+    Plans of predicates and set operations over a single range of the buffer
+    are keyed independently of that range, which is returned alongside, so
+    results can be extended as the buffer grows. Other plans include their
+    input ranges in the key and the returned range is None.
+    """
+    if isinstance(node, Source):
+        # Slices of the buffer are optimised to a bare source, which is as quick
+        # to run as to look up.
+        return None
+    sources: list[range] = []
+    limits: list[PlanNode] = []
+    try:
+        key = _node_key(node, sources, limits)
+        hash(key)
+    except (_Uncacheable, TypeError):
+        return None
+
+    if not limits and all(source == sources[0] for source in sources):
+        return key, sources[0]
+    return (key, tuple((source.start, source.stop) for source in sources)), None
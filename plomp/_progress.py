@@ -1,9 +1,15 @@
+import datetime as dt
 import importlib.resources
 import json
 import os
+import re
+import threading
+from plomp._buffer_items import freeze_mapping
 from plomp._core import PlompBuffer
 from plomp._query import PlompBufferQuery
-from typeguard import typechecked
+from plomp._storage import EVENT_CODE, ITEM_TYPES, PROMPT_CODE, QUERY_CODE
+from plomp._typecheck import typechecked
+from plomp._types import TagsType, TagType, TimestampType
 
 
 def _get_template_file(filename):
@@ -12,65 +18,474 @@ def _get_template_file(filename):
         return f.read()
 
 
+_TEMPLATE_DATA_MARKER = "<!-- insert plomp JSON data here -->"
+
+
+def _write_buffer_json(buffer: PlompBuffer, f, *, batch_size: int = 1000):
+    """Write `buffer.to_dict()` as JSON to `f`, serialising items a batch at a
+    time so memory stays bounded however long the buffer is.
+
+    Each batch is serialised under the buffer's lock, so items can be recorded
+    meanwhile; the items present when writing starts are written, skipping any
+    evicted before their batch is reached.
+    """
+    f.write(f'{{"key": {json.dumps(buffer.key)}, "buffer_items": [')
+    store = buffer._store
+    with buffer._lock:
+        index, stop = buffer.indices.start, buffer.indices.stop
+    separator = ""
+    while True:
+        with buffer._lock:
+            index = max(index, buffer.indices.start)
+            batch_stop = min(index + batch_size, stop)
+            if index >= batch_stop:
+                break
+            base_index = buffer._base_index
+            batch = ", ".join(
+                json.dumps(store.item_dict(item_index - base_index))
+                for item_index in range(index, batch_stop)
+            )
+        f.write(separator + batch)
+        separator = ", "
+        index = batch_stop
+    f.write("]}")
+
+
 def write_html(buffer: PlompBuffer, output_uri: str):
-    json_contents = buffer.to_dict()
-    json_str = json.dumps(json_contents)
     template = _get_template_file("index.html")
-    html = template.replace(
-        "<!-- insert plomp JSON data here -->",
-        f"window.__PLOMP_BUFFER_JSON__ = {json_str};",
-    )
+    before, after = template.split(_TEMPLATE_DATA_MARKER, 1)
 
     with open(output_uri, "w", encoding="utf-8") as f:
-        f.write(html)
+        f.write(before)
+        f.write("window.__PLOMP_BUFFER_JSON__ = ")
+        _write_buffer_json(buffer, f)
+        f.write(";")
+        f.write(after)
 
 
 def write_json(buffer: PlompBuffer, output_uri: str):
-    json_contents = buffer.to_dict()
-
     with open(output_uri, "w", encoding="utf-8") as f:
-        json.dump(json_contents, f)
+        _write_buffer_json(buffer, f)
+
+
+class _JsonStream:
+    """Incrementally decodes JSON values from a text file, reading it in chunks
+    and only holding the unconsumed part of the current chunk in memory."""
+
+    _WHITESPACE = " \t\n\r"
+
+    def __init__(self, f, chunk_size: int):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._text = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._text = self._text[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next non-whitespace character, or "" at the end of the file."""
+        while True:
+            while self._pos < len(self._text):
+                if self._text[self._pos] not in self._WHITESPACE:
+                    return self._text[self._pos]
+                self._pos += 1
+            if not self._read():
+                return ""
+
+    def expect(self, *chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                f"Malformed input, expected one of {list(chars)}, got {char!r}"
+            )
+        self._pos += 1
+        return char
+
+    _STRUCTURE = re.compile(r'["\[\]{}]')
+    _STRING_SPECIAL = re.compile(r'["\\]')
+    _SCALAR_END = re.compile(r"[\s,:\]}]")
+
+    def _read_value(self):
+        """Read chunks until the text holds the whole value at the current
+        position, or the file ends.
+
+        Each chunk is scanned once, carrying the nesting depth and whether the
+        scan is inside a string over to the next, and the chunks are joined
+        once at the end, so values spanning many chunks are read in linear
+        time.
+        """
+        chunks = [self._text[self._pos :]]
+        self._text, self._pos = "", 0
+        first = chunks[0][:1]
+        scalar = first not in ('"', "[", "{")
+        in_string = first == '"'
+        escaped = False
+        depth = int(first in ("[", "{"))
+        position = len(first)
+        while True:
+            text = chunks[-1]
+            if escaped:
+                position, escaped = position + 1, False
+            complete = False
+            while position < len(text):
+                if scalar:
+                    complete = self._SCALAR_END.search(text, position) is not None
+                    break
+                if in_string:
+                    match = self._STRING_SPECIAL.search(text, position)
+                    if match is None:
+                        break
+                    position = match.end()
+                    if match.group() == "\\":
+                        # Skip the escaped character, which may be in the
+                        # next chunk.
+                        if position == len(text):
+                            escaped = True
+                        else:
+                            position += 1
+                        continue
+                    in_string = False
+                    if depth == 0:
+                        complete = True
+                        break
+                    continue
+                match = self._STRUCTURE.search(text, position)
+                if match is None:
+                    break
+                position = match.end()
+                char = match.group()
+                if char == '"':
+                    in_string = True
+                elif char in "[{":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        complete = True
+                        break
+            if complete or self._eof:
+                break
+            chunk = self._f.read(self._chunk_size)
+            if not chunk:
+                self._eof = True
+                break
+            chunks.append(chunk)
+            position = 0
+        self._text = "".join(chunks)
+
+    def decode(self):
+        """Decode the next JSON value."""
+        self.peek()
+        try:
+            value, end = self._decoder.raw_decode(self._text, self._pos)
+        except json.JSONDecodeError:
+            # The value continues in the next chunks.
+            self._read_value()
+            value, end = self._decoder.raw_decode(self._text, self._pos)
+        else:
+            # A number at the end of the chunk may continue in the next one.
+            if end == len(self._text) and not self._eof:
+                self._read_value()
+                value, end = self._decoder.raw_decode(self._text, self._pos)
+        self._pos = end
+        return value
+
+
+def _stream_buffer_items(stream: _JsonStream):
+    """Yield the items of a serialised buffer one at a time."""
+    if stream.peek() != "{":
+        value = stream.decode()
+        raise ValueError(f"Malformed input, expected dict, got {type(value)}")
+    stream.expect("{")
+
+    found_items = False
+    if stream.peek() == "}":
+        stream.expect("}")
+    else:
+        while True:
+            key = stream.decode()
+            stream.expect(":")
+            if key == "buffer_items":
+                found_items = True
+                stream.expect("[")
+                if stream.peek() == "]":
+                    stream.expect("]")
+                else:
+                    while True:
+                        yield stream.decode()
+                        if stream.expect(",", "]") == "]":
+                            break
+            else:
+                stream.decode()
+            if stream.expect(",", "}") == "}":
+                break
+
+    if not found_items:
+        raise ValueError("Malformed input, expected 'buffer_items' key in dict")
 
 
 @typechecked
-def read_json(buffer: PlompBuffer, fpath: str) -> None:
+def read_json(buffer: PlompBuffer, fpath: str, *, chunk_size: int = 2**16) -> None:
+    """Append every item in a file written by `write_json` to `buffer`.
+
+    Items are parsed and appended one at a time, reading the file in chunks of
+    `chunk_size` characters, so memory use doesn't grow with the file. Items
+    keep their original timestamps.
+    """
     if not os.path.exists(fpath):
         raise ValueError(f"File {fpath} does not exist")
 
-    with open(fpath) as f:
-        input_json = json.load(f)
+    with open(fpath, encoding="utf-8") as f:
+        for item in _stream_buffer_items(_JsonStream(f, chunk_size)):
+            _append_item_dict(buffer, item)
 
-    if not isinstance(input_json, dict):
-        raise ValueError(f"Malformed input, expected dict, got {type(input_json)}")
 
-    if "buffer_items" not in input_json:
-        raise ValueError("Malformed input, expected 'buffer_items' key in dict")
+def _timestamp_to_json(timestamp: TimestampType) -> str | int:
+    return timestamp if isinstance(timestamp, int) else timestamp.isoformat()
 
-    for item in input_json["buffer_items"]:
-        if item["type"] == "event":
-            buffer.record_event(
-                payload=item["data"]["payload"],
-                tags=item["tags"],
-            )
-        elif item["type"] == "prompt":
-            handle = buffer.record_prompt_start(
-                prompt=item["data"]["prompt"],
-                tags=item["tags"],
+
+def _timestamp_from_json(timestamp: str | int) -> TimestampType:
+    return (
+        timestamp
+        if isinstance(timestamp, int)
+        else dt.datetime.fromisoformat(timestamp)
+    )
+
+
+def _check_field(value, expected_type, name: str):
+    if not isinstance(value, expected_type):
+        raise ValueError(
+            f"Malformed input, {name} should be of type {expected_type}, "
+            f"got {type(value)}"
+        )
+
+
+def _check_item_dict(item):
+    """Check the fields of a serialised buffer item, so that a malformed item
+    raises before anything is appended to the buffer."""
+    _check_field(item, dict, "item")
+    _check_field(item["timestamp"], str | int, "timestamp")
+    _check_field(item["tags"], dict, "tags")
+    for key, value in item["tags"].items():
+        _check_field(key, str, "tag key")
+        _check_field(value, TagType, f"tag {key!r}")
+    data = item["data"]
+    _check_field(data, dict, "data")
+    if item["type"] == "prompt":
+        _check_field(data["prompt"], str, "prompt")
+        if data.get("completion"):
+            _check_field(data["completion"], dict, "completion")
+            _check_field(
+                data["completion"]["completion_timestamp"],
+                str | int,
+                "completion timestamp",
             )
-            if item["data"].get("completion"):
-                handle.complete(
-                    item["data"]["completion"]["response"],
-                )
-        elif item["type"] == "query":
-            buffer.record_query(
-                plomp_query=PlompBufferQuery(
-                    buffer,
-                    matched_indices=item["data"]["matched_indices"],
-                    op_name=item["data"]["op_name"],
-                ),
-                tags=item["tags"],
+            _check_field(data["completion"]["response"], str, "response")
+    elif item["type"] == "event":
+        _check_field(data["payload"], dict, "payload")
+    elif item["type"] == "query":
+        _check_field(data["op_name"], str, "op_name")
+        _check_field(data["matched_indices"], list, "matched_indices")
+        for index in data["matched_indices"]:
+            _check_field(index, int, "matched index")
+    else:
+        raise ValueError(f"Malformed input, unknown buffer item type: {item['type']!r}")
+
+
+def _append_item_dict(buffer: PlompBuffer, item: dict) -> int:
+    """Append a serialised buffer item, keeping its original timestamps."""
+    _check_item_dict(item)
+    timestamp = _timestamp_from_json(item["timestamp"])
+    data = item["data"]
+    if item["type"] == "prompt":
+        completion = data.get("completion")
+        if completion:
+            completion_timestamp = _timestamp_from_json(
+                completion["completion_timestamp"]
             )
+        index = buffer._append(timestamp, item["tags"], PROMPT_CODE, data["prompt"])
+        if completion:
+            buffer._complete(index, completion_timestamp, completion["response"])
+        return index
+    elif item["type"] == "event":
+        return buffer._append(
+            timestamp, item["tags"], EVENT_CODE, freeze_mapping(data["payload"])
+        )
+    else:
+        return buffer._append(
+            timestamp,
+            item["tags"],
+            QUERY_CODE,
+            PlompBufferQuery(
+                buffer,
+                matched_indices=data["matched_indices"],
+                op_name=data["op_name"],
+            ),
+        )
+
+
+class PlompLogSink:
+    """An append-only JSON lines log of everything recorded into a buffer.
+
+    Attach it with `PlompBuffer.attach_sink`. Every record and every later
+    completion becomes one line of the log, so a crash loses at most the entries
+    which were not flushed yet. Entries are serialised and written in batches of
+    `batch_size`, by whichever recorder fills the batch once the buffer's lock is
+    released; pass `fsync=True` to also force each batch to disk.
+
+    `read_log` rebuilds a buffer from the log.
+    """
+
+    def __init__(self, fpath: str, *, batch_size: int = 1000, fsync: bool = False):
+        self.fpath = fpath
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._pending: list[tuple] = []
+        self._lock = threading.Lock()
+        # Held across swapping out and writing a batch, so batches hit the file
+        # in the order they were recorded.
+        self._write_lock = threading.Lock()
+        self._file = open(fpath, "a", encoding="utf-8")
+
+    def _add(self, entry: tuple):
+        # Called with the buffer's lock held, so this only queues the entry.
+        with self._lock:
+            self._pending.append(entry)
+
+    def _flush_if_full(self):
+        """Write out a full batch. The buffer calls this after releasing its
+        lock, so recorders never wait on serialisation or disk writes."""
+        with self._lock:
+            batch_full = len(self._pending) >= self.batch_size
+        if batch_full:
+            self.flush()
+
+    def record(
+        self,
+        index: int,
+        timestamp: TimestampType,
+        tags: TagsType,
+        type_code: int,
+        data,
+    ):
+        # Everything passed in is immutable, so serialising can wait until flush.
+        self._add(("record", index, timestamp, tags, type_code, data))
+
+    def complete(self, index: int, completion_timestamp: TimestampType, response: str):
+        self._add(("complete", index, completion_timestamp, response))
+
+    def write_item(self, index: int, item_dict: dict):
+        self._add(("item", index, item_dict))
+
+    @staticmethod
+    def _log_entry(entry: tuple) -> dict:
+        if entry[0] == "item":
+            _, index, item_dict = entry
+            return {"op": "record", "index": index, "item": item_dict}
+        elif entry[0] == "complete":
+            _, index, completion_timestamp, response = entry
+            return {
+                "op": "complete",
+                "index": index,
+                "completion_timestamp": _timestamp_to_json(completion_timestamp),
+                "response": response,
+            }
+
+        _, index, timestamp, tags, type_code, data = entry
+        if type_code == PROMPT_CODE:
+            data = {"prompt": data, "completion": None}
+        elif type_code == EVENT_CODE:
+            data = {"payload": data}
         else:
-            raise ValueError(
-                f"Malformed input, unknown buffer item type: {item['type']!r}"
+            data = data.to_dict()
+        return {
+            "op": "record",
+            "index": index,
+            "item": {
+                "timestamp": _timestamp_to_json(timestamp),
+                "tags": tags,
+                "type": ITEM_TYPES[type_code].value,
+                "data": data,
+            },
+        }
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            self._file.writelines(
+                json.dumps(self._log_entry(entry)) + "\n" for entry in pending
             )
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> "PlompLogSink":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@typechecked
+def read_log(buffer: PlompBuffer, fpath: str) -> None:
+    """Append every item in the log written by a `PlompLogSink` to `buffer`.
+
+    Items keep their original timestamps. A truncated final line, as left by a
+    crash in the middle of a write, is ignored.
+    """
+    if not os.path.exists(fpath):
+        raise ValueError(f"File {fpath} does not exist")
+
+    # Maps log indices of prompts which haven't completed yet to buffer indices.
+    pending_prompts: dict[int, int] = {}
+    with open(fpath, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                if not line.endswith("\n"):
+                    break
+                raise ValueError(f"Malformed log entry on line {line_number}") from e
+
+            if entry["op"] == "record":
+                index = _append_item_dict(buffer, entry["item"])
+                if entry["item"]["type"] == "prompt" and not entry["item"]["data"].get(
+                    "completion"
+                ):
+                    pending_prompts[entry["index"]] = index
+            elif entry["op"] == "complete":
+                if entry["index"] not in pending_prompts:
+                    raise ValueError(
+                        f"Malformed log entry on line {line_number}, completion "
+                        f"of unknown or already completed prompt {entry['index']}"
+                    )
+                buffer._complete(
+                    pending_prompts.pop(entry["index"]),
+                    _timestamp_from_json(entry["completion_timestamp"]),
+                    entry["response"],
+                )
+            else:
+                raise ValueError(
+                    f"Malformed log entry on line {line_number}: "
+                    f"unknown op {entry['op']!r}"
+                )
@@ -1,23 +1,66 @@
+import datetime as dt
 import io
 from dataclasses import dataclass
-from typing import Callable, Iterable, Literal, TYPE_CHECKING
-from typeguard import typechecked
-from plomp._types import TagsType, TagsFilter, TagType
+from typing import Callable, Iterable, Literal, Sequence, TYPE_CHECKING
+from plomp._expressions import PlompExpression
+from plomp._index_sets import PlompIndexSet
+from plomp._plan import (
+    Cached,
+    ExpressionFilter,
+    PlanNode,
+    SetOperation,
+    Slice,
+    Source,
+    TagFilter,
+    TextSearch,
+    TimeRange,
+    TopLatency,
+    Where,
+    optimize,
+)
+from plomp._search import SEARCH_FIELDS, SearchField, tokenize
+from plomp._typecheck import typechecked
+from plomp._storage import datetime_to_ns
+from plomp._types import TagsType, TagsFilter, TimestampType
 from plomp._buffer_items import (
     PlompBufferItem,
 )
 
 
 if TYPE_CHECKING:
+    from plomp._aggregate import PlompGroupBy
     from plomp._core import PlompBuffer
+    from plomp._live import PlompLiveQuery
+
+
+def _timestamp_ns(timestamp: TimestampType) -> int:
+    if isinstance(timestamp, int):
+        return timestamp
+    return datetime_to_ns(timestamp)
+
+
+def _timestamp_repr(timestamp: TimestampType | None) -> str:
+    if isinstance(timestamp, dt.datetime):
+        return repr(timestamp.isoformat())
+    return repr(timestamp)
 
 
 @typechecked
-@dataclass(slots=True, kw_only=True)
+@dataclass(slots=True, kw_only=True, repr=False, eq=False)
 class PlompBufferQuery:
+    """A lazy query over the items of a buffer.
+
+    Chained operations only build up a plan; it is optimised and run the first
+    time the matched indices are needed, e.g. when the query is iterated or
+    recorded. Predicates see the buffer as it is at that point, e.g. prompts
+    completed since the query was built, and `where` callables read the
+    variables they close over then too.
+    """
+
     buffer: "PlompBuffer"
-    matched_indices: list[int]
     op_name: str
+    _plan: PlanNode
+    _matched_indices: PlompIndexSet | None
 
     def __init__(
         self,
@@ -25,34 +68,81 @@ class PlompBufferQuery:
         *,
         matched_indices: Iterable[int] | None = None,
         op_name: str | None = None,
+        _plan: PlanNode | None = None,
     ):
         self.buffer = buffer
-        self.matched_indices: list[int] = sorted(
-            list(range(len(buffer))) if matched_indices is None else matched_indices
-        )
+        if _plan is None:
+            # The buffer's indices are captured now, so later records aren't
+            # picked up when the plan eventually runs.
+            _plan = Source(
+                buffer.indices
+                if matched_indices is None
+                else PlompIndexSet(matched_indices)
+            )
+        self._plan = _plan
+        self._matched_indices = None
         self.op_name = op_name or "<buffer>"
 
+    @property
+    def matched_indices(self) -> PlompIndexSet:
+        return self._resolved()._matched_indices
+
+    def _resolved(self) -> "PlompBufferQuery":
+        """This query, with its plan run if it hasn't been yet."""
+        if self._matched_indices is None:
+            self._matched_indices = PlompIndexSet.from_sorted(
+                self.buffer._query_cache.execute(optimize(self._plan))
+            )
+        return self
+
+    def _input_plan(self) -> PlanNode:
+        # Build on the results if this query already ran, otherwise on its plan.
+        if self._matched_indices is not None:
+            return Cached(self._plan, self._matched_indices)
+        return self._plan
+
+    def _derive(self, plan: Callable[[PlanNode], PlanNode], op_name: str):
+        return PlompBufferQuery(
+            self.buffer, op_name=op_name, _plan=plan(self._input_plan())
+        )
+
     def __iter__(self):
         for matched_index in self.matched_indices:
             yield self.buffer[matched_index]
 
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, PlompBufferQuery):
+            return NotImplemented
+        return (self.buffer, self.matched_indices, self.op_name) == (
+            other.buffer,
+            other.matched_indices,
+            other.op_name,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(buffer={self.buffer!r}, "
+            f"matched_indices={self.matched_indices.tolist()!r}, "
+            f"op_name={self.op_name!r})"
+        )
+
     @typechecked
     def _where(
         self,
         *,
         truth_fn: Callable[[PlompBufferItem], bool],
         condition_op_name: str,
+        pure: bool = False,
     ) -> "PlompBufferQuery":
         """Filter buffer items based on a truth function."""
-        matched_indices = []
-        for i in self.matched_indices:
-            if truth_fn(self.buffer[i]):
-                matched_indices.append(i)
-
-        return PlompBufferQuery(
-            buffer=self.buffer,
-            matched_indices=matched_indices,
-            op_name=f"{condition_op_name}({self.op_name})",
+        if isinstance(truth_fn, PlompExpression):
+            return self._derive(
+                lambda plan: ExpressionFilter(plan, self.buffer, truth_fn),
+                f"{condition_op_name}({self.op_name})",
+            )
+        return self._derive(
+            lambda plan: Where(plan, self.buffer, truth_fn, pure),
+            f"{condition_op_name}({self.op_name})",
         )
 
     @typechecked
@@ -62,10 +152,30 @@ class PlompBufferQuery:
     @typechecked
     def where(
         self,
+        expression: PlompExpression | None = None,
+        /,
         *,
-        truth_fn: Callable[[PlompBufferItem], bool],
+        truth_fn: Callable[[PlompBufferItem], bool] | None = None,
+        pure: bool = False,
     ) -> "PlompBufferQuery":
-        return self._where(truth_fn=truth_fn, condition_op_name="where[]")
+        """Items satisfying `expression`, built from `plomp.col`, or `truth_fn`.
+
+        Expressions are evaluated in bulk over the buffer's columns. `truth_fn`
+        is called once per item, so prefer an expression where one fits. Like
+        the rest of the query it runs lazily, so bind any loop variables it
+        uses as default arguments.
+
+        Results of `truth_fn` are only cached, and extended as items are
+        appended, if it is marked `pure=True`, i.e. it depends on nothing but
+        the item. Expressions are always cached.
+        """
+        if (expression is None) == (truth_fn is None):
+            raise ValueError("Pass exactly one of an expression or truth_fn")
+        if expression is not None:
+            return self._where(
+                truth_fn=expression, condition_op_name=f"where[{expression!r}]"
+            )
+        return self._where(truth_fn=truth_fn, condition_op_name="where[]", pure=pure)
 
     @typechecked
     def filter(
@@ -74,117 +184,157 @@ class PlompBufferQuery:
         how: Literal["any"] | Literal["all"] | Literal["none"] = "any",
         tags_filter: TagsFilter,
     ) -> "PlompBufferQuery":
-        def _normalize_tag_filter(tags_filter: TagsFilter) -> TagsFilter:
-            return {
-                tag_key: tag_value if isinstance(tag_value, list) else [tag_value]
-                for tag_key, tag_value in tags_filter.items()
-            }
-
-        def _tags_match_filter(
-            filter_tag_key: str,
-            filter_tag_values: list[TagType] | TagType,
-            tags: TagsType,
-        ) -> bool:
-            if filter_tag_key not in tags:
-                return False
-
-            if not isinstance(filter_tag_values, list):
-                filter_tag_values = [filter_tag_values]
-
-            tag_value = tags[filter_tag_key]
-            for filter_value in filter_tag_values:
-                if isinstance(tag_value, dict) and isinstance(filter_value, dict):
-                    if tag_value == filter_value:
-                        return True
-                elif tag_value == filter_value:
-                    return True
-            return False
-
-        tags_filter = _normalize_tag_filter(tags_filter)
-        condition_op_name = f"filter[how={how!r}, tags={tags_filter!r}]"
-
-        if how == "any":
-            return self._where(
-                truth_fn=lambda buffer_item: any(
-                    _tags_match_filter(
-                        filter_tag_key, filter_tag_values, buffer_item.tags
-                    )
-                    for filter_tag_key, filter_tag_values in tags_filter.items()
-                ),
-                condition_op_name=condition_op_name,
-            )
-        elif how == "all":
-            return self._where(
-                truth_fn=lambda buffer_item: all(
-                    _tags_match_filter(
-                        filter_tag_key, filter_tag_values, buffer_item.tags
-                    )
-                    for filter_tag_key, filter_tag_values in tags_filter.items()
-                ),
-                condition_op_name=condition_op_name,
-            )
-        elif how == "none":
-            return self._where(
-                truth_fn=lambda buffer_item: not any(
-                    _tags_match_filter(
-                        filter_tag_key, filter_tag_values, buffer_item.tags
-                    )
-                    for filter_tag_key, filter_tag_values in tags_filter.items()
-                ),
-                condition_op_name=condition_op_name,
-            )
-        else:
+        tags_filter = {
+            tag_key: tag_value if isinstance(tag_value, list) else [tag_value]
+            for tag_key, tag_value in tags_filter.items()
+        }
+        if how not in ("any", "all", "none"):
             raise ValueError(f"Invalid filter method: {how}")
 
+        return self._derive(
+            lambda plan: TagFilter(plan, self.buffer, how, tags_filter),
+            f"filter[how={how!r}, tags={tags_filter!r}]({self.op_name})",
+        )
+
+    @typechecked
+    def between(
+        self, start: TimestampType | None, end: TimestampType | None
+    ) -> "PlompBufferQuery":
+        """Items timestamped at or after `start` and before `end`.
+
+        Either bound may be None, and each may be a datetime or integer
+        nanoseconds since the epoch. Naive datetimes are compared by their wall
+        clock time.
+        """
+        start_ns = None if start is None else _timestamp_ns(start)
+        end_ns = None if end is None else _timestamp_ns(end)
+        return self._derive(
+            lambda plan: TimeRange(plan, self.buffer, start_ns, end_ns),
+            f"between[start={_timestamp_repr(start)}, end={_timestamp_repr(end)}]"
+            f"({self.op_name})",
+        )
+
+    @typechecked
+    def since(self, start: TimestampType) -> "PlompBufferQuery":
+        """Items timestamped at or after `start`, see `between`."""
+        return self._derive(
+            lambda plan: TimeRange(plan, self.buffer, _timestamp_ns(start), None),
+            f"since[start={_timestamp_repr(start)}]({self.op_name})",
+        )
+
+    @typechecked
+    def search(
+        self, text: str, *, fields: Sequence[SearchField] | None = None
+    ) -> "PlompBufferQuery":
+        """Items mentioning every word of `text`, ignoring case.
+
+        `fields` picks where to look: "prompt", "response" (of completed
+        prompts) and/or "payload" (string and number values of event payloads).
+        It defaults to all three. Each word may appear in any of the fields.
+        The buffer builds a search index on the first search and keeps it up to
+        date from then on.
+        """
+        fields = SEARCH_FIELDS if fields is None else tuple(fields)
+        for field in fields:
+            if field not in SEARCH_FIELDS:
+                raise ValueError(f"Invalid search field: {field!r}")
+        if not tokenize(text):
+            raise ValueError("Search text must contain at least one word")
+
+        return self._derive(
+            lambda plan: TextSearch(plan, self.buffer, text, fields),
+            f"search[text={text!r}, fields={list(fields)!r}]({self.op_name})",
+        )
+
     @typechecked
     def first(self, size: int = 1) -> "PlompBufferQuery":
-        return PlompBufferQuery(
-            buffer=self.buffer,
-            matched_indices=self.matched_indices[:size],
-            op_name=f"first[size={size}]({self.op_name})",
+        return self._derive(
+            lambda plan: Slice(plan, None, size),
+            f"first[size={size}]({self.op_name})",
         )
 
     @typechecked
     def last(self, size: int = 1) -> "PlompBufferQuery":
-        return PlompBufferQuery(
-            buffer=self.buffer,
-            matched_indices=self.matched_indices[-size:],
-            op_name=f"last[size={size}]({self.op_name})",
+        return self._derive(
+            lambda plan: Slice(plan, -size, None),
+            f"last[size={size}]({self.op_name})",
         )
 
     @typechecked
     def window(self, start: int, end: int) -> "PlompBufferQuery":
-        return PlompBufferQuery(
-            buffer=self.buffer,
-            matched_indices=self.matched_indices[start:end],
-            op_name=f"window[start={start}, end={end}]({self.op_name})",
+        return self._derive(
+            lambda plan: Slice(plan, start, end),
+            f"window[start={start}, end={end}]({self.op_name})",
+        )
+
+    @typechecked
+    def slowest(self, k: int = 1) -> "PlompBufferQuery":
+        """The `k` completed prompts with the highest latency (in buffer order)."""
+        return self._derive(
+            lambda plan: TopLatency(plan, self.buffer, k, False),
+            f"slowest[k={k}]({self.op_name})",
+        )
+
+    @typechecked
+    def longest_in_flight(self, k: int = 1) -> "PlompBufferQuery":
+        """The `k` prompts which have been awaiting completion the longest (in
+        buffer order)."""
+        return self._derive(
+            lambda plan: TopLatency(plan, self.buffer, k, True),
+            f"longest_in_flight[k={k}]({self.op_name})",
         )
 
+    @typechecked
+    def latency_histogram(self, edges: Sequence[float]) -> list[int]:
+        """Count the latencies in seconds of the completed prompts matched.
+
+        Returns `len(edges) + 1` counts: of latencies below `edges[0]`, in each
+        `[edges[i], edges[i + 1])` and of those at least `edges[-1]`.
+        """
+        return self.buffer._latency_histogram(self.matched_indices, edges)
+
     @typechecked
     def union(self, other: "PlompBufferQuery") -> "PlompBufferQuery":
-        return PlompBufferQuery(
-            buffer=self.buffer,
-            matched_indices=sorted(
-                set(self.matched_indices) | set(other.matched_indices)
-            ),
-            op_name=f"union[other={other.op_name}]({self.op_name})",
+        return self._derive(
+            lambda plan: SetOperation(plan, other._input_plan(), "union"),
+            f"union[other={other.op_name}]({self.op_name})",
         )
 
     @typechecked
     def intersection(self, other: "PlompBufferQuery") -> "PlompBufferQuery":
-        return PlompBufferQuery(
-            buffer=self.buffer,
-            matched_indices=sorted(
-                set(self.matched_indices) & set(other.matched_indices)
-            ),
-            op_name=f"intersection[other={other.op_name}]({self.op_name})",
+        return self._derive(
+            lambda plan: SetOperation(plan, other._input_plan(), "intersection"),
+            f"intersection[other={other.op_name}]({self.op_name})",
         )
 
+    @typechecked
+    def live(
+        self,
+        *,
+        callback: Callable[["PlompBufferQuery"], None] | None = None,
+    ) -> "PlompLiveQuery":
+        """Keep this query's results up to date as items are appended.
+
+        `callback` is called with a query over the new matches after each
+        append which produces any. Only queries built from `where`, `filter`,
+        `union` and `intersection` over a buffer can be live.
+        """
+        from plomp._live import PlompLiveQuery
+
+        return PlompLiveQuery(self, callback)
+
+    def group_by(self, *tag_keys: str) -> "PlompGroupBy":
+        """Group the matched items by the values of the tags `tag_keys`, to
+        compute aggregations from `plomp.agg` over each group in one pass."""
+        from plomp._aggregate import PlompGroupBy
+
+        return PlompGroupBy(self, tag_keys)
+
     def to_dict(self) -> dict:
         return {
             "buffer_key": self.buffer.key,
             "op_name": self.op_name,
-            "matched_indices": self.matched_indices,
+            "matched_indices": self.matched_indices.tolist(),
         }
 
     def __len__(self):
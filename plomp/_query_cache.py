@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Hashable, Sequence
+
+from plomp._index_sets import PlompIndexSet
+from plomp._plan import PlanNode, optimize, plan_key, rebase
+
+if TYPE_CHECKING:
+    from plomp._core import PlompBuffer
+
+
+@dataclass(slots=True)
+class _CacheEntry:
+    version: int
+    indices: range | None
+    result: PlompIndexSet
+    size: int
+
+
+def _result_size(result: PlompIndexSet) -> int:
+    # Ranges are O(1) whatever their length; packed indices take 8 bytes each.
+    return 64 if result.is_range else 64 + 8 * len(result)
+
+
+class PlompQueryCache:
+    """An LRU cache of query results, bounded by the bytes of the results.
+
+    Entries are keyed by the query plan and are valid for the buffer version
+    they were computed at. The version only changes when existing items do
+    (completions and evictions), not on appends: a cached result for a plan of
+    predicates is extended with the matches among newly appended items rather
+    than recomputed.
+    """
+
+    def __init__(self, buffer: "PlompBuffer", max_bytes: int):
+        self._buffer = buffer
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, _CacheEntry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.extensions = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _lookup(self, key: Hashable) -> _CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key: Hashable, entry: _CacheEntry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            if entry.size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    def execute(self, plan: PlanNode) -> Sequence[int]:
+        """Run an (optimised) plan, answering from the cache where possible."""
+        keyed = plan_key(plan) if self.max_bytes else None
+        if keyed is None:
+            return plan.execute()
+
+        key, indices = keyed
+        version = self._buffer._version
+        entry = self._lookup(key)
+        if entry is not None and entry.version == version:
+            if indices is None or entry.indices == indices:
+                self.hits += 1
+                return entry.result
+            if entry.indices.start == indices.start <= entry.indices.stop:
+                # Empty ranges, e.g. range(5, 2), can't be extended.
+                if indices.stop <= entry.indices.stop:
+                    # An older snapshot of the buffer.
+                    self.hits += 1
+                    return entry.result.intersection(indices)
+
+                self.extensions += 1
+                appended = range(entry.indices.stop, indices.stop)
+                result = entry.result.union(optimize(rebase(plan, appended)).execute())
+                self._store(
+                    key, _CacheEntry(version, indices, result, _result_size(result))
+                )
+                return result
+
+        self.misses += 1
+        result = PlompIndexSet.from_sorted(plan.execute())
+        self._store(key, _CacheEntry(version, indices, result, _result_size(result)))
+        return result
@@ -0,0 +1,140 @@
+import re
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Literal, Sequence
+
+from plomp._buffer_items import PlompBufferItem, PlompBufferItemType
+from plomp._index_sets import intersect_sorted, union_sorted
+
+SearchField = Literal["prompt"] | Literal["response"] | Literal["payload"]
+SEARCH_FIELDS: tuple[SearchField, ...] = ("prompt", "response", "payload")
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> set[str]:
+    """The distinct, case-folded words in `text`."""
+    return {word.casefold() for word in _WORD_RE.findall(text)}
+
+
+def text_words(texts: Iterable[str]) -> set[str]:
+    """The distinct, case-folded words in any of `texts`."""
+    words = set()
+    for text in texts:
+        words |= tokenize(text)
+    return words
+
+
+def payload_text(value) -> Iterator[str]:
+    """The strings nested anywhere in an event payload, keys excluded."""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for nested in value.values():
+            yield from payload_text(nested)
+    elif isinstance(value, (list, tuple)):
+        for nested in value:
+            yield from payload_text(nested)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield str(value)
+
+
+def item_words(item: PlompBufferItem, fields: Sequence[SearchField]) -> set[str]:
+    """The words of `item` which `PlompSearchIndex` would index under `fields`."""
+    words = set()
+    if item.type_ == PlompBufferItemType.PROMPT:
+        if "prompt" in fields:
+            words |= tokenize(item.call_trace.prompt)
+        if "response" in fields and item.call_trace.completion is not None:
+            words |= tokenize(item.call_trace.completion.response)
+    elif item.type_ == PlompBufferItemType.EVENT and "payload" in fields:
+        for text in payload_text(item.event.payload):
+            words |= tokenize(text)
+    return words
+
+
+class PlompSearchIndex:
+    """An inverted index from words to the items mentioning them, per field.
+
+    Posting lists are appended to as items are recorded. Responses are indexed
+    when their prompt completes, which can happen out of index order, so those
+    posting lists are re-sorted lazily the next time they are searched.
+    """
+
+    def __init__(self):
+        self._postings: dict[tuple[str, SearchField], array] = {}
+        self._unsorted: set[tuple[str, SearchField]] = set()
+        # Postings below `_first_index` are for evicted items; the posting
+        # lists in `_prune_queue` may still hold some.
+        self._first_index = 0
+        self._prune_queue: list[tuple[str, SearchField]] = []
+
+    def add(self, index: int, field: SearchField, texts: Iterable[str]):
+        self.add_words(index, field, text_words(texts))
+
+    def add_words(self, index: int, field: SearchField, words: Iterable[str]):
+        """Index `words`, e.g. from `text_words`, which can be computed without
+        holding the buffer's lock."""
+        for word in words:
+            key = (word, field)
+            postings = self._postings.get(key)
+            if postings is None:
+                self._postings[key] = array("q", (index,))
+                continue
+            if postings[-1] > index:
+                self._unsorted.add(key)
+            postings.append(index)
+
+    def _sorted_postings(self, key: tuple[str, SearchField]) -> array | None:
+        postings = self._postings.get(key)
+        if postings is not None and key in self._unsorted:
+            postings = self._postings[key] = array("q", sorted(postings))
+            self._unsorted.discard(key)
+        if postings and postings[0] < self._first_index:
+            del postings[: bisect_left(postings, self._first_index)]
+        return postings
+
+    def prune(self, first_index: int):
+        """Drop every posting below `first_index`, i.e. for evicted items.
+
+        Posting lists are only queued here and trimmed by `prune_some`, or when
+        they are next searched, so no single call walks all of them.
+        """
+        self._first_index = first_index
+        # A pass still under way carries on, trimming to the new index.
+        if not self._prune_queue:
+            self._prune_queue = list(self._postings)
+
+    def prune_some(self, budget: int):
+        """Trim up to `budget` of the posting lists queued by `prune`."""
+        queue = self._prune_queue
+        while budget > 0 and queue:
+            key = queue.pop()
+            budget -= 1
+            if not self._sorted_postings(key) and key in self._postings:
+                del self._postings[key]
+
+    def select(self, text: str, fields: Sequence[SearchField]) -> Sequence[int]:
+        """The sorted indices of items where every word of `text` appears in
+        one of `fields`."""
+        per_word = []
+        for word in tokenize(text):
+            per_word.append(
+                union_sorted(
+                    postings
+                    for postings in (
+                        self._sorted_postings((word, field)) for field in fields
+                    )
+                    if postings is not None
+                )
+            )
+        if not per_word:
+            return []
+
+        per_word.sort(key=len)
+        matching = per_word[0]
+        for postings in per_word[1:]:
+            if not matching:
+                break
+            matching = intersect_sorted(matching, postings)
+        return matching
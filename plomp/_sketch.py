@@ -0,0 +1,87 @@
+import math
+from collections import Counter
+
+
+class PlompQuantileSketch:
+    """A mergeable quantile sketch (DDSketch) for non-negative values.
+
+    Values are counted in logarithmically sized buckets, so every quantile is
+    estimated within `relative_accuracy` of the true value using memory
+    proportional to the log of the value range rather than the number of
+    values. Sketches with the same accuracy merge exactly, e.g. to combine
+    latency percentiles computed on several buffers or shards.
+    """
+
+    __slots__ = (
+        "relative_accuracy",
+        "_log_gamma",
+        "_bins",
+        "_zero_count",
+        "count",
+        "min",
+        "max",
+    )
+
+    # Values at or below this are counted as zero.
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self._log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self._bins: Counter[int] = Counter()
+        self._zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        if value <= self.MIN_VALUE:
+            self._zero_count += 1
+        else:
+            self._bins[math.ceil(math.log(value) / self._log_gamma)] += 1
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "PlompQuantileSketch") -> "PlompQuantileSketch":
+        """Add every value counted by `other` to this sketch, and return it."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only sketches with the same accuracy can be merged")
+        self._bins.update(other._bins)
+        self._zero_count += other._zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> float | None:
+        """An estimate of the `q` quantile, or None if the sketch is empty."""
+        if not 0 <= q <= 1:
+            raise ValueError("Quantiles must be between 0 and 1")
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self._zero_count
+        if seen > rank:
+            return max(self.min, 0.0)
+        gamma = math.exp(self._log_gamma)
+        for key in sorted(self._bins):
+            seen += self._bins[key]
+            if seen > rank:
+                # The midpoint of the bucket (gamma^(key-1), gamma^key], which
+                # is within the relative accuracy of every value in it.
+                estimate = 2 * gamma**key / (gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(count={self.count}, "
+            f"relative_accuracy={self.relative_accuracy})"
+        )
@@ -0,0 +1,349 @@
+import datetime as dt
+from array import array
+from collections import Counter
+from typing import Any, Sequence
+
+from plomp._buffer_items import (
+    PlompBufferItem,
+    PlompBufferItemType,
+    PlompCallCompletion,
+    PlompCallTrace,
+    PlompEvent,
+    freeze_mapping,
+)
+from plomp._tags import PlompTagDictionary
+from plomp._types import TagsType, TimestampType
+
+_EPOCH = dt.datetime(1970, 1, 1)
+_EPOCH_UTC = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_INT64_MIN, _INT64_MAX = -(2**63), 2**63 - 1
+
+# Marks a prompt which has not been completed in the completion timestamp column.
+NOT_COMPLETED = _INT64_MIN
+
+ITEM_TYPES = tuple(PlompBufferItemType)
+ITEM_TYPE_CODES = {item_type: code for code, item_type in enumerate(ITEM_TYPES)}
+PROMPT_CODE = ITEM_TYPE_CODES[PlompBufferItemType.PROMPT]
+EVENT_CODE = ITEM_TYPE_CODES[PlompBufferItemType.EVENT]
+QUERY_CODE = ITEM_TYPE_CODES[PlompBufferItemType.QUERY]
+
+
+def _check_ns(ns: int, value: TimestampType) -> int:
+    # The column's minimum is reserved for NOT_COMPLETED.
+    if not _INT64_MIN < ns <= _INT64_MAX:
+        raise ValueError(
+            f"Timestamp {value!r} is out of range: timestamps are stored as 64-bit "
+            "nanoseconds since the epoch, so must be between 1677-09-21 and "
+            "2262-04-11"
+        )
+    return ns
+
+
+def datetime_to_ns(value: dt.datetime) -> int:
+    """Nanoseconds since the epoch, measured on the wall clock for naive datetimes.
+
+    Raises ValueError for datetimes which don't fit in 64 bits, i.e. outside
+    roughly 1677-09-21 to 2262-04-11.
+    """
+    delta = value - (_EPOCH if value.tzinfo is None else _EPOCH_UTC)
+    ns = (
+        delta.days * 86_400 + delta.seconds
+    ) * 1_000_000_000 + delta.microseconds * 1000
+    return _check_ns(ns, value)
+
+
+def ns_to_datetime(ns: int, tzinfo: dt.tzinfo | None) -> dt.datetime:
+    delta = dt.timedelta(microseconds=ns // 1000)
+    if tzinfo is None:
+        return _EPOCH + delta
+    return (_EPOCH_UTC + delta).astimezone(tzinfo)
+
+
+def ns_to_isoformat(ns: int, tzinfo: dt.tzinfo | None) -> str:
+    return ns_to_datetime(ns, tzinfo).isoformat()
+
+
+def _approximate_size(value) -> int:
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(
+            _approximate_size(k) + _approximate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sum(_approximate_size(v) for v in value)
+    return 8
+
+
+# An item to append: `(timestamp, tags, type_code, data, completion)`, where
+# `completion` is a prompt's `(completion_timestamp, response)` if it has one.
+Row = tuple[TimestampType, TagsType, int, Any, tuple[TimestampType, str] | None]
+
+
+def item_row(
+    buffer_item: PlompBufferItem,
+) -> Row:
+    """The row `PlompItemStore.append_many` takes to store `buffer_item`."""
+    type_code = ITEM_TYPE_CODES[buffer_item.type_]
+    completion = None
+    if type_code == PROMPT_CODE:
+        data = buffer_item.call_trace.prompt
+        if buffer_item.call_trace.completion is not None:
+            completion = (
+                buffer_item.call_trace.completion.completion_timestamp,
+                buffer_item.call_trace.completion.response,
+            )
+    elif type_code == EVENT_CODE:
+        data = freeze_mapping(buffer_item.event.payload)
+    else:
+        # Run lazy queries now, so they never run under the buffer's lock.
+        data = buffer_item.query._resolved()
+    return buffer_item.timestamp, buffer_item.tags, type_code, data, completion
+
+
+class PlompItemStore:
+    """Columnar storage for the items of a `PlompBuffer`.
+
+    Timestamps, item types and completion times live in parallel typed arrays,
+    and `PlompBufferItem`s are only materialised when an item is accessed. The
+    store works with positions; mapping item indices to positions, eviction and
+    locking are the owning buffer's responsibility.
+    """
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.timestamp_zones = array("H")
+        self.type_codes = array("B")
+        self.completion_timestamps = array("q")
+        self.completion_zones = array("H")
+        # Completion minus start timestamp in nanoseconds, maintained as prompts
+        # complete (NOT_COMPLETED otherwise).
+        self.latencies = array("q")
+        self.tag_set_ids = array("I")
+        self.tag_dictionary = PlompTagDictionary()
+        # The prompt for PROMPT items, the payload for EVENTs and the query itself
+        # for QUERY items.
+        self.data: list = []
+        self.responses: list[str | None] = []
+        self._tzinfos: list[dt.tzinfo | None] = [None]
+        self._tzinfo_codes: dict[dt.tzinfo | None, int] = {None: 0}
+        self._utc_zone = self._zone_code(dt.timezone.utc)
+
+    def __len__(self) -> int:
+        return len(self.type_codes)
+
+    def _zone_code(self, tzinfo: dt.tzinfo | None) -> int:
+        code = self._tzinfo_codes.get(tzinfo)
+        if code is None:
+            code = self._tzinfo_codes[tzinfo] = len(self._tzinfos)
+            self._tzinfos.append(tzinfo)
+        return code
+
+    def _encode_timestamp(self, timestamp: TimestampType) -> tuple[int, int]:
+        # Integer timestamps are stored as-is and only become (UTC) datetimes
+        # when they are read or serialised.
+        if isinstance(timestamp, int):
+            return _check_ns(timestamp, timestamp), self._utc_zone
+        return datetime_to_ns(timestamp), self._zone_code(timestamp.tzinfo)
+
+    def append(
+        self,
+        timestamp: TimestampType,
+        tags: TagsType,
+        type_code: int,
+        data,
+    ) -> int:
+        """Append an item and return its position."""
+        # Everything which can fail is done before any column is touched.
+        timestamp_ns, zone_code = self._encode_timestamp(timestamp)
+        tag_set_id = self.tag_dictionary.encode(tags)
+        self.tag_dictionary.retain(tag_set_id)
+        self.timestamps.append(timestamp_ns)
+        self.timestamp_zones.append(zone_code)
+        self.type_codes.append(type_code)
+        self.completion_timestamps.append(NOT_COMPLETED)
+        self.completion_zones.append(0)
+        self.latencies.append(NOT_COMPLETED)
+        self.tag_set_ids.append(tag_set_id)
+        self.data.append(data)
+        self.responses.append(None)
+        return len(self.type_codes) - 1
+
+    def append_many(self, rows: Sequence[Row]) -> range:
+        """Append rows and return their positions. A timestamp shared by
+        consecutive rows, and each distinct tags object, is only encoded once.
+
+        Every row is validated and encoded before any is appended, so if one
+        is invalid the store is left unchanged.
+        """
+        timestamps, timestamp_zones, type_codes = array("q"), array("H"), array("B")
+        completion_timestamps, completion_zones = array("q"), array("H")
+        latencies = array("q")
+        responses: list[str | None] = []
+        last_timestamp = None
+        for timestamp, _, type_code, _, completion in rows:
+            if timestamp is not last_timestamp:
+                timestamp_ns, zone_code = self._encode_timestamp(timestamp)
+                last_timestamp = timestamp
+            timestamps.append(timestamp_ns)
+            timestamp_zones.append(zone_code)
+            type_codes.append(type_code)
+            if completion is None:
+                completion_timestamps.append(NOT_COMPLETED)
+                completion_zones.append(0)
+                latencies.append(NOT_COMPLETED)
+                responses.append(None)
+                continue
+            if type_code != PROMPT_CODE:
+                raise ValueError("Item at index is not a prompt request")
+            completion_timestamp, response = completion
+            completion_ns, completion_zone = self._encode_timestamp(
+                completion_timestamp
+            )
+            if completion_ns < timestamp_ns:
+                raise ValueError("Prompt was completed before it started")
+            completion_timestamps.append(completion_ns)
+            completion_zones.append(completion_zone)
+            latencies.append(completion_ns - timestamp_ns)
+            responses.append(response)
+
+        # Keyed by identity, which is stable while `rows` holds the tags.
+        tag_set_ids: dict[int, int] = {}
+        row_tag_set_ids = array("I")
+        for _, tags, _, _, _ in rows:
+            tag_set_id = tag_set_ids.get(id(tags))
+            if tag_set_id is None:
+                tag_set_id = tag_set_ids[id(tags)] = self.tag_dictionary.encode(tags)
+            row_tag_set_ids.append(tag_set_id)
+        for tag_set_id, count in Counter(row_tag_set_ids).items():
+            self.tag_dictionary.retain(tag_set_id, count)
+
+        start = len(self.type_codes)
+        self.timestamps.extend(timestamps)
+        self.timestamp_zones.extend(timestamp_zones)
+        self.type_codes.extend(type_codes)
+        self.completion_timestamps.extend(completion_timestamps)
+        self.completion_zones.extend(completion_zones)
+        self.latencies.extend(latencies)
+        self.tag_set_ids.extend(row_tag_set_ids)
+        self.data.extend(row[3] for row in rows)
+        self.responses.extend(responses)
+        return range(start, len(self.type_codes))
+
+    def complete(
+        self, position: int, completion_timestamp: TimestampType, response: str
+    ):
+        if self.type_codes[position] != PROMPT_CODE:
+            raise ValueError("Item at index is not a prompt request")
+        if self.completion_timestamps[position] != NOT_COMPLETED:
+            raise ValueError("Call has already been completed")
+
+        completion_ns, zone_code = self._encode_timestamp(completion_timestamp)
+        self.completion_timestamps[position] = completion_ns
+        self.completion_zones[position] = zone_code
+        self.latencies[position] = completion_ns - self.timestamps[position]
+        self.responses[position] = response
+
+    def timestamp(self, position: int) -> dt.datetime:
+        return ns_to_datetime(
+            self.timestamps[position], self._tzinfos[self.timestamp_zones[position]]
+        )
+
+    def completion(self, position: int) -> PlompCallCompletion | None:
+        completion_ns = self.completion_timestamps[position]
+        if completion_ns == NOT_COMPLETED:
+            return None
+        return PlompCallCompletion(
+            completion_timestamp=ns_to_datetime(
+                completion_ns, self._tzinfos[self.completion_zones[position]]
+            ),
+            response=self.responses[position],
+        )
+
+    def item(self, position: int) -> PlompBufferItem:
+        """Materialise the item stored at `position`."""
+        type_code = self.type_codes[position]
+        data = self.data[position]
+        if type_code == PROMPT_CODE:
+            data = PlompCallTrace(data, completion=self.completion(position))
+        elif type_code == EVENT_CODE:
+            data = PlompEvent(payload=data)
+
+        return PlompBufferItem(
+            self.timestamp(position),
+            self.tag_dictionary.decode(self.tag_set_ids[position]),
+            ITEM_TYPES[type_code],
+            data,
+        )
+
+    def item_dict(self, position: int) -> dict:
+        """Serialise the item at `position` like `PlompBufferItem.to_dict`, straight
+        from the columns."""
+        type_code = self.type_codes[position]
+        data = self.data[position]
+        if type_code == PROMPT_CODE:
+            completion_ns = self.completion_timestamps[position]
+            data = {
+                "prompt": data,
+                "completion": None
+                if completion_ns == NOT_COMPLETED
+                else {
+                    "completion_timestamp": ns_to_isoformat(
+                        completion_ns, self._tzinfos[self.completion_zones[position]]
+                    ),
+                    "response": self.responses[position],
+                },
+            }
+        elif type_code == EVENT_CODE:
+            data = {"payload": dict(data)}
+        else:
+            data = data.to_dict()
+
+        return {
+            "timestamp": ns_to_isoformat(
+                self.timestamps[position],
+                self._tzinfos[self.timestamp_zones[position]],
+            ),
+            "tags": dict(self.tag_dictionary.decode(self.tag_set_ids[position])),
+            "type": ITEM_TYPES[type_code].value,
+            "data": data,
+        }
+
+    def approximate_size(self, position: int) -> int:
+        """A cheap estimate of the bytes of user data held at `position`."""
+        type_code = self.type_codes[position]
+        # Interned tags are counted for every item holding them, which
+        # overestimates shared tag sets but keeps unique ones from going unseen.
+        size = self.tag_set_ids.itemsize + _approximate_size(
+            self.tag_dictionary.decode(self.tag_set_ids[position])
+        )
+        if type_code == PROMPT_CODE:
+            size += len(self.data[position]) + len(self.responses[position] or "")
+        elif type_code == EVENT_CODE:
+            size += _approximate_size(self.data[position])
+        else:
+            size += 8 * len(self.data[position].matched_indices)
+        return size
+
+    def release(self, position: int):
+        """Drop the object references held at an evicted `position`."""
+        self.data[position] = None
+        self.responses[position] = None
+
+    def compact(self, count: int) -> list[int]:
+        """Remove the first `count` positions from every column, returning the
+        ids of tag sets which no remaining item holds."""
+        freed_tag_set_ids = self.tag_dictionary.release(self.tag_set_ids[:count])
+        for column in (
+            self.timestamps,
+            self.timestamp_zones,
+            self.type_codes,
+            self.completion_timestamps,
+            self.completion_zones,
+            self.latencies,
+            self.tag_set_ids,
+            self.data,
+            self.responses,
+        ):
+            del column[:count]
+        return freed_tag_set_ids
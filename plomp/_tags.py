@@ -0,0 +1,377 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Hashable, Iterable, Literal, Sequence
+
+from plomp._buffer_items import freeze_mapping
+from plomp._index_sets import (
+    clip_sorted,
+    difference_sorted,
+    intersect_sorted,
+    is_contiguous,
+    union_disjoint_sorted,
+    union_sorted,
+)
+from plomp._types import TagsFilter, TagsType, TagType
+
+
+def hashable_tag_value(value: TagType) -> Hashable:
+    """A hashable stand-in for `value` which compares equal whenever values do."""
+    if isinstance(value, dict):
+        return (dict, frozenset((k, hashable_tag_value(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return (list, tuple(hashable_tag_value(v) for v in value))
+    hash(value)
+    return value
+
+
+class PlompTagDictionary:
+    """Interns tag keys and dictionary-encodes tag values into small integer codes.
+
+    Every distinct set of tags is stored once and identified by a tag set id, so
+    a buffer only keeps one integer per item. Tag filters are resolved against
+    the (small) table of tag sets rather than against every item.
+
+    The store counts the items holding each tag set with `retain` and
+    `release`. Tag sets without items are dropped along with any values only
+    they used, and their ids are reused.
+    """
+
+    def __init__(self):
+        self._key_codes: dict[str, int] = {}
+        # Codes are keyed by type as well as value so that e.g. `True` and `1` keep
+        # their own identity when decoded...
+        self._value_codes: dict[tuple[type, Hashable], int] = {}
+        # ...while filters still match every value which is `==` to theirs.
+        self._codes_by_value: dict[Hashable, list[int]] = {}
+        self._next_value_code = 0
+        # Per value code: its key in `_value_codes` and the number of tag sets
+        # using it.
+        self._value_code_keys: dict[int, tuple[type, Hashable]] = {}
+        self._value_code_refs: dict[int, int] = {}
+        self._tag_set_ids: dict[tuple[tuple[int, int], ...], int] = {}
+        # Per tag set: the decoded tags and a `key code -> value code` map. Tags
+        # with unhashable values can't be encoded and have no code map. Freed
+        # ids hold None until they are reused.
+        self._tag_sets: list[TagsType | None] = []
+        self._tag_set_codes: list[dict[int, int] | None] = []
+        self._tag_set_refs: list[int] = []
+        self._free_ids: list[int] = []
+        # Bumped whenever tag set ids are freed, so anything caching per id can
+        # tell when an id may have been reused.
+        self.generation = 0
+
+    def __len__(self) -> int:
+        """The number of distinct tag sets."""
+        return len(self._tag_sets) - len(self._free_ids)
+
+    def ids(self) -> list[int]:
+        """The ids of every tag set in use, in increasing order."""
+        return [
+            tag_set_id
+            for tag_set_id, tags in enumerate(self._tag_sets)
+            if tags is not None
+        ]
+
+    def _value_code(self, value: TagType) -> int:
+        hashable_value = hashable_tag_value(value)
+        code_key = (type(value), hashable_value)
+        code = self._value_codes.get(code_key)
+        if code is None:
+            code = self._value_codes[code_key] = self._next_value_code
+            self._next_value_code += 1
+            self._value_code_keys[code] = code_key
+            self._value_code_refs[code] = 0
+            self._codes_by_value.setdefault(hashable_value, []).append(code)
+        return code
+
+    def _drop_unused_value_code(self, code: int):
+        if self._value_code_refs[code]:
+            return
+        code_key = self._value_code_keys.pop(code)
+        del self._value_code_refs[code], self._value_codes[code_key]
+        codes = self._codes_by_value[code_key[1]]
+        codes.remove(code)
+        if not codes:
+            del self._codes_by_value[code_key[1]]
+
+    def _add_tag_set(self, tags: TagsType, codes: dict[int, int] | None) -> int:
+        tags = freeze_mapping(tags)
+        if self._free_ids:
+            tag_set_id = self._free_ids.pop()
+            self._tag_sets[tag_set_id] = tags
+            self._tag_set_codes[tag_set_id] = codes
+        else:
+            tag_set_id = len(self._tag_sets)
+            self._tag_sets.append(tags)
+            self._tag_set_codes.append(codes)
+            self._tag_set_refs.append(0)
+        for code in (codes or {}).values():
+            self._value_code_refs[code] += 1
+        return tag_set_id
+
+    def encode(self, tags: TagsType) -> int:
+        """Return the tag set id for `tags`, adding it to the dictionary if new."""
+        codes = {}
+        try:
+            for key, value in tags.items():
+                key_code = self._key_codes.get(key)
+                if key_code is None:
+                    key_code = self._key_codes[key] = len(self._key_codes)
+                codes[key_code] = self._value_code(value)
+        except TypeError:
+            for code in codes.values():
+                self._drop_unused_value_code(code)
+            return self._add_tag_set(tags, None)
+
+        tag_set_key = tuple(sorted(codes.items()))
+        tag_set_id = self._tag_set_ids.get(tag_set_key)
+        if tag_set_id is None:
+            tag_set_id = self._tag_set_ids[tag_set_key] = self._add_tag_set(tags, codes)
+        return tag_set_id
+
+    def decode(self, tag_set_id: int) -> TagsType:
+        return self._tag_sets[tag_set_id]
+
+    def retain(self, tag_set_id: int, count: int = 1):
+        """Count `count` more items holding the tag set `tag_set_id`."""
+        self._tag_set_refs[tag_set_id] += count
+
+    def release(self, tag_set_ids: Iterable[int]) -> list[int]:
+        """Count one item less for each of `tag_set_ids`, e.g. of evicted items,
+        freeing the tag sets which no item holds any more. Returns the freed ids."""
+        freed = []
+        for tag_set_id, count in Counter(tag_set_ids).items():
+            self._tag_set_refs[tag_set_id] -= count
+            if self._tag_set_refs[tag_set_id]:
+                continue
+            codes = self._tag_set_codes[tag_set_id]
+            if codes is not None:
+                del self._tag_set_ids[tuple(sorted(codes.items()))]
+                for code in codes.values():
+                    self._value_code_refs[code] -= 1
+                    self._drop_unused_value_code(code)
+            self._tag_sets[tag_set_id] = None
+            self._tag_set_codes[tag_set_id] = None
+            freed.append(tag_set_id)
+        if freed:
+            self._free_ids.extend(freed)
+            self.generation += 1
+        return freed
+
+    def resolve_filter(
+        self, tags_filter: TagsFilter
+    ) -> list[tuple[str, list[TagType], int | None, set[int]]]:
+        """Resolve each filter key to `(key, values, key code, value codes)`.
+
+        The key code is None if no item was ever tagged with the key, and the
+        value codes cover every encoded value equal to one of the filter values.
+        """
+        resolved = []
+        for key, values in tags_filter.items():
+            if not isinstance(values, list):
+                values = [values]
+            value_codes = set()
+            for value in values:
+                try:
+                    value_codes.update(
+                        self._codes_by_value.get(hashable_tag_value(value), ())
+                    )
+                except TypeError:
+                    pass
+            resolved.append((key, values, self._key_codes.get(key), value_codes))
+        return resolved
+
+    def matching_tag_sets(
+        self,
+        how: Literal["any"] | Literal["all"] | Literal["none"],
+        tags_filter: TagsFilter,
+        tag_set_ids: Iterable[int] | None = None,
+    ) -> set[int]:
+        """The ids of every tag set (or of those in `tag_set_ids`) which satisfy
+        `tags_filter`."""
+        resolved = self.resolve_filter(tags_filter)
+
+        def key_matches(tag_set_id: int, key_index: int) -> bool:
+            key, values, key_code, value_codes = resolved[key_index]
+            codes = self._tag_set_codes[tag_set_id]
+            if codes is None:
+                tags = self._tag_sets[tag_set_id]
+                return key in tags and any(tags[key] == value for value in values)
+            return codes.get(key_code, -1) in value_codes
+
+        if how == "any":
+            combine = any
+        elif how == "all":
+            combine = all
+        elif how == "none":
+
+            def combine(matches):
+                return not any(matches)
+
+        else:
+            raise ValueError(f"Invalid filter method: {how}")
+
+        return {
+            tag_set_id
+            for tag_set_id in (self.ids() if tag_set_ids is None else tag_set_ids)
+            if combine(
+                key_matches(tag_set_id, key_index) for key_index in range(len(resolved))
+            )
+        }
+
+
+class PlompTagIndex:
+    """An inverted index from `(tag key, tag value)` codes to posting lists.
+
+    Each posting list holds the sorted indices of the items carrying that tag and
+    is extended as items are appended, so tag filters become unions,
+    intersections and complements of posting lists instead of scans.
+    """
+
+    def __init__(self, tag_dictionary: PlompTagDictionary):
+        self._tag_dictionary = tag_dictionary
+        self._postings: dict[tuple[int, int], array] = {}
+        # The posting lists each tag set's items are added to, or None for tag
+        # sets not seen yet or freed since.
+        self._tag_set_postings: list[list[array] | None] = []
+        # Items whose tags could not be encoded, as `(index, tag set id)`.
+        self._unencoded: list[tuple[int, int]] = []
+        # Postings below `_first_index` are for evicted items; the posting
+        # lists in `_prune_queue` may still hold some.
+        self._first_index = 0
+        self._prune_queue: list[tuple[int, int]] = []
+
+    def _postings_of(self, tag_set_id: int) -> list[array]:
+        if tag_set_id >= len(self._tag_set_postings):
+            self._tag_set_postings.extend(
+                [None] * (tag_set_id + 1 - len(self._tag_set_postings))
+            )
+        postings = self._tag_set_postings[tag_set_id]
+        if postings is None:
+            codes = self._tag_dictionary._tag_set_codes[tag_set_id]
+            postings = self._tag_set_postings[tag_set_id] = [
+                self._postings.setdefault(posting_key, array("q"))
+                for posting_key in (codes or {}).items()
+            ]
+        return postings
+
+    def add(self, index: int, tag_set_id: int):
+        """Index a newly appended item. Indices must be added in increasing order."""
+        if self._tag_dictionary._tag_set_codes[tag_set_id] is None:
+            self._unencoded.append((index, tag_set_id))
+        for postings in self._postings_of(tag_set_id):
+            postings.append(index)
+
+    def add_many(self, indices: range, tag_set_ids: Sequence[int]):
+        """Index a batch of newly appended items, extending posting lists once
+        per run of items sharing a tag set."""
+        run_start = 0
+        for offset in range(1, len(indices) + 1):
+            if offset < len(indices) and tag_set_ids[offset] == tag_set_ids[run_start]:
+                continue
+            tag_set_id = tag_set_ids[run_start]
+            run = range(indices[run_start], indices[offset - 1] + 1)
+            if self._tag_dictionary._tag_set_codes[tag_set_id] is None:
+                self._unencoded.extend((index, tag_set_id) for index in run)
+            for postings in self._postings_of(tag_set_id):
+                postings.extend(run)
+            run_start = offset
+
+    def prune(self, first_index: int, freed_tag_set_ids: Iterable[int] = ()):
+        """Drop every posting below `first_index`, i.e. for evicted items, and
+        forget the tag sets in `freed_tag_set_ids`.
+
+        Posting lists are only queued here and trimmed by `prune_some`, so no
+        single call walks all of them. Until then selections are clipped to
+        the indices asked for, which are never evicted ones.
+        """
+        for tag_set_id in freed_tag_set_ids:
+            if tag_set_id < len(self._tag_set_postings):
+                self._tag_set_postings[tag_set_id] = None
+        self._first_index = first_index
+        # A pass still under way carries on, trimming to the new index.
+        if not self._prune_queue:
+            self._prune_queue = list(self._postings)
+        if self._unencoded:
+            self._unencoded = [
+                entry for entry in self._unencoded if entry[0] >= first_index
+            ]
+
+    def prune_some(self, budget: int):
+        """Trim up to `budget` of the posting lists queued by `prune`."""
+        queue = self._prune_queue
+        while budget > 0 and queue:
+            posting_key = queue.pop()
+            budget -= 1
+            postings = self._postings.get(posting_key)
+            if postings is None:
+                continue
+            del postings[: bisect_left(postings, self._first_index)]
+            if not postings:
+                del self._postings[posting_key]
+
+    def _matching(
+        self,
+        how: Literal["any"] | Literal["all"],
+        tags_filter: TagsFilter,
+    ) -> Sequence[int]:
+        per_key = []
+        for _, _, key_code, value_codes in self._tag_dictionary.resolve_filter(
+            tags_filter
+        ):
+            # An item has a single value per key, so these lists are disjoint.
+            per_key.append(
+                union_disjoint_sorted(
+                    self._postings[(key_code, value_code)]
+                    for value_code in value_codes
+                    if (key_code, value_code) in self._postings
+                )
+            )
+
+        if how == "any":
+            matching = union_sorted(per_key)
+        elif not per_key:
+            matching = []
+        else:
+            per_key.sort(key=len)
+            matching = per_key[0]
+            for postings in per_key[1:]:
+                matching = intersect_sorted(matching, postings)
+
+        if self._unencoded:
+            matching_tag_sets = self._tag_dictionary.matching_tag_sets(
+                how,
+                tags_filter,
+                {tag_set_id for _, tag_set_id in self._unencoded},
+            )
+            unencoded = [
+                index
+                for index, tag_set_id in self._unencoded
+                if tag_set_id in matching_tag_sets
+            ]
+            matching = union_sorted([matching, unencoded])
+
+        return matching
+
+    def select(
+        self,
+        indices: Sequence[int],
+        how: Literal["any"] | Literal["all"] | Literal["none"],
+        tags_filter: TagsFilter,
+    ) -> Sequence[int]:
+        """The subset of sorted `indices` whose tags satisfy `tags_filter`."""
+        if how not in ("any", "all", "none"):
+            raise ValueError(f"Invalid filter method: {how}")
+        if not indices:
+            return []
+        if not tags_filter:
+            # Mirrors `any([])` / `all([])` over the filter keys.
+            return [] if how == "any" else indices
+
+        matching = self._matching("any" if how == "none" else how, tags_filter)
+        if how == "none":
+            return difference_sorted(indices, matching)
+        if is_contiguous(indices):
+            return clip_sorted(matching, indices[0], indices[-1] + 1)
+        return intersect_sorted(indices, matching)
@@ -0,0 +1,117 @@
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from typing import Sequence
+
+from plomp._index_sets import merge_union
+
+
+class PlompTimeIndex:
+    """A sorted index of item timestamps (in nanoseconds) for time range queries.
+
+    Items usually arrive in timestamp order and are appended straight to the
+    sorted columns. Out-of-order arrivals go to a small unsorted tail, which is
+    merged in once it grows past a fraction of the index, so appends stay
+    amortised O(1) and lookups are a binary search plus a scan of the tail.
+    """
+
+    # The tail is merged once it holds more than this many items, or more than
+    # 1/64th of the index if that is larger.
+    MIN_TAIL_MERGE = 256
+
+    def __init__(self):
+        self._timestamps = array("q")
+        self._indices = array("q")
+        # Whether `_indices` is increasing too, i.e. every item in the sorted
+        # columns arrived in order.
+        self._index_ordered = True
+        self._tail: list[tuple[int, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._indices) + len(self._tail)
+
+    def add(self, index: int, timestamp_ns: int):
+        """Index a newly appended item. Indices must be added in increasing order."""
+        if not self._timestamps or timestamp_ns >= self._timestamps[-1]:
+            self._timestamps.append(timestamp_ns)
+            self._indices.append(index)
+            return
+
+        self._tail.append((timestamp_ns, index))
+        if len(self._tail) > max(self.MIN_TAIL_MERGE, len(self._indices) >> 6):
+            self._merge_tail()
+
+    def add_many(self, indices: range, timestamps_ns: Sequence[int]):
+        """Index a batch of newly appended items, in one step if they arrive in
+        timestamp order."""
+        if timestamps_ns and (
+            not self._timestamps or timestamps_ns[0] >= self._timestamps[-1]
+        ):
+            if all(a <= b for a, b in zip(timestamps_ns, timestamps_ns[1:])):
+                self._timestamps.extend(timestamps_ns)
+                self._indices.extend(indices)
+                return
+        for index, timestamp_ns in zip(indices, timestamps_ns):
+            self.add(index, timestamp_ns)
+
+    def _merge_tail(self):
+        self._tail.sort()
+        timestamps, indices = array("q"), array("q")
+        for timestamp_ns, index in merge(
+            zip(self._timestamps, self._indices), self._tail
+        ):
+            timestamps.append(timestamp_ns)
+            indices.append(index)
+        self._timestamps, self._indices = timestamps, indices
+        self._tail = []
+        self._index_ordered = all(
+            indices[i] < indices[i + 1] for i in range(len(indices) - 1)
+        )
+
+    def prune(self, first_index: int):
+        """Drop every item below `first_index`, i.e. evicted items."""
+        if self._index_ordered:
+            keep_from = bisect_left(self._indices, first_index)
+            del self._timestamps[:keep_from]
+            del self._indices[:keep_from]
+        else:
+            kept = [
+                (timestamp_ns, index)
+                for timestamp_ns, index in zip(self._timestamps, self._indices)
+                if index >= first_index
+            ]
+            self._timestamps = array("q", (timestamp_ns for timestamp_ns, _ in kept))
+            self._indices = array("q", (index for _, index in kept))
+        self._tail = [entry for entry in self._tail if entry[1] >= first_index]
+
+    def select(self, start_ns: int | None, end_ns: int | None) -> Sequence[int]:
+        """The sorted indices of items with `start_ns <= timestamp < end_ns`."""
+        low = 0 if start_ns is None else bisect_left(self._timestamps, start_ns)
+        high = (
+            len(self._timestamps)
+            if end_ns is None
+            else bisect_left(self._timestamps, end_ns, low)
+        )
+        indices = self._indices
+        if (
+            self._index_ordered
+            and high > low
+            and indices[high - 1] - indices[low] + 1 == high - low
+        ):
+            # The common case of in-order items without gaps is an O(1) range.
+            selected = range(indices[low], indices[high - 1] + 1)
+        elif self._index_ordered:
+            selected = indices[low:high]
+        else:
+            selected = array("q", sorted(indices[low:high]))
+
+        if self._tail:
+            tail = sorted(
+                index
+                for timestamp_ns, index in self._tail
+                if (start_ns is None or timestamp_ns >= start_ns)
+                and (end_ns is None or timestamp_ns < end_ns)
+            )
+            if tail:
+                return merge_union(selected, tail)
+        return selected
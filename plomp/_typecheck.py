@@ -0,0 +1,25 @@
+"""Runtime type checking for plomp's public API.
+
+Checks are enabled by default. Setting the environment variable
+`PLOMP_TYPECHECK=0` before plomp is imported turns the `typechecked` decorator
+into a no-op, so recording runs through the unchecked fast path.
+"""
+
+import os
+
+from typeguard import typechecked as _typeguard_typechecked
+
+TYPECHECK_ENV_VAR = "PLOMP_TYPECHECK"
+
+TYPECHECK_ENABLED = os.environ.get(TYPECHECK_ENV_VAR, "1").strip().lower() not in {
+    "0",
+    "false",
+    "no",
+    "off",
+}
+
+
+def typechecked(target):
+    if not TYPECHECK_ENABLED:
+        return target
+    return _typeguard_typechecked(target)
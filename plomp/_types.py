@@ -1,3 +1,9 @@
+import datetime as dt
+
 TagType = str | dict | bool | int | float
 TagsType = dict[str, TagType]
 TagsFilter = dict[str, list[TagType] | TagType]
+
+# Either a datetime or integer nanoseconds since the Unix epoch (UTC), as returned
+# by `time.time_ns`.
+TimestampType = dt.datetime | int
@@ -1,8 +1,23 @@
+import asyncio
+import dataclasses
 import datetime as dt
+import inspect
+import json
+import os
+import pickle
+import subprocess
+import sys
+import textwrap
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 
 import pytest
+from typeguard import TypeCheckError
 
 import plomp
+from plomp._index_sets import PlompIndexSet
 from typing import Any
 
 
@@ -327,3 +342,1063 @@ def test_failures_of_wrapping():
         @plomp.wrap_prompt_fn(capture_tag_kwargs={"plomp_extra_tags"})
         def prompt_fn5() -> str:
             raise NotImplementedError()
+
+
+def test_iteration_yields_read_only_items():
+    buffer = mock_buffer("test_iteration_yields_read_only_items")
+
+    tags = {"speaker": "bob"}
+    payload = {"value": 1}
+    plomp.record_prompt("What is 1 + 1", tags=tags, buffer=buffer).complete("2")
+    plomp.record_event(payload, tags=tags, buffer=buffer)
+
+    # Mutating the caller's dicts after recording does not leak into the buffer
+    tags["speaker"] = "alice"
+    payload["value"] = 2
+
+    prompt_item, event_item = list(buffer)
+    assert prompt_item == buffer[0]
+    assert prompt_item.tags is buffer[0].tags
+    assert prompt_item.tags == {"speaker": "bob"}
+    assert event_item.event.payload == {"value": 1}
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        prompt_item.timestamp = dt.datetime(2024, 1, 1)
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        prompt_item.call_trace.prompt = "What is 2 + 2"
+
+    with pytest.raises(TypeError):
+        prompt_item.tags["speaker"] = "alice"
+
+    with pytest.raises(TypeError):
+        event_item.event.payload["value"] = 3
+
+    # Nested dicts and lists are read-only too, in payloads and in tags
+    plomp.record_event(
+        {"nested": {"v": 1}, "values": [1, {"v": 2}]},
+        tags={"config": {"layers": [1, 2]}},
+        buffer=buffer,
+    )
+    nested_item = buffer[2]
+    with pytest.raises(TypeError):
+        nested_item.event.payload["nested"]["v"] = 99
+    with pytest.raises(TypeError):
+        nested_item.event.payload["values"].append(3)
+    with pytest.raises(TypeError):
+        nested_item.event.payload["values"][1]["v"] = 99
+    with pytest.raises(TypeError):
+        nested_item.tags["config"]["layers"][0] = 99
+    assert nested_item.event.payload == {"nested": {"v": 1}, "values": [1, {"v": 2}]}
+    assert nested_item.tags == {"config": {"layers": [1, 2]}}
+    assert len(buffer.filter(tags_filter={"config": {"layers": [1, 2]}})) == 1
+    assert json.loads(json.dumps(nested_item.to_dict()))["data"] == {
+        "payload": {"nested": {"v": 1}, "values": [1, {"v": 2}]}
+    }
+    assert deepcopy(nested_item) == nested_item
+    assert pickle.loads(pickle.dumps(nested_item)) == nested_item
+
+    assert prompt_item.to_dict()["tags"] == {"speaker": "bob"}
+    assert event_item.to_dict()["data"] == {"payload": {"value": 1}}
+
+    assert deepcopy(event_item) == event_item
+    assert pickle.loads(pickle.dumps(event_item)) == event_item
+
+
+def test_buffer_construction_shares_items():
+    buffer = mock_buffer("test_buffer_construction_shares_items")
+
+    plomp.record_prompt("What is 1 + 1", tags={"speaker": "bob"}, buffer=buffer)
+    plomp.record_event({"value": 1}, tags={"speaker": "alice"}, buffer=buffer)
+    plomp.record_prompt("What is 2 + 2", tags={"speaker": "bob"}, buffer=buffer)
+
+    bob_buffer = plomp.PlompBuffer(
+        buffer_items=buffer.filter(tags_filter={"speaker": "bob"}), key="bob"
+    )
+    assert len(bob_buffer) == 2
+    assert bob_buffer[0] == buffer[0]
+    assert bob_buffer[1] == buffer[2]
+    assert bob_buffer[0].tags is buffer[0].tags
+    assert bob_buffer[0].call_trace.prompt is buffer[0].call_trace.prompt
+
+    # Completing a call in the derived buffer does not affect the source buffer
+    plomp.PlompCallHandle(bob_buffer, 0).complete("2")
+    assert bob_buffer[0].call_trace.completion.response == "2"
+    assert buffer[0].call_trace.completion is None
+
+    # Mutable tags or payloads on hand-built items are frozen on the way in
+    event_item = plomp.PlompBufferItem(
+        dt.datetime(2023, 10, 1),
+        {"speaker": "carol"},
+        plomp.PlompBufferItemType.EVENT,
+        plomp.PlompEvent(payload={"value": 2}),
+    )
+    carol_buffer = plomp.PlompBuffer(buffer_items=[event_item])
+    with pytest.raises(TypeError):
+        carol_buffer[0].tags["speaker"] = "dave"
+    with pytest.raises(TypeError):
+        carol_buffer[0].event.payload["value"] = 3
+
+
+@pytest.mark.parametrize("typecheck, expect_error", [("1", True), ("0", False)])
+def test_typecheck_mode_from_environment(typecheck, expect_error):
+    script = textwrap.dedent(
+        """
+        import plomp
+        from typeguard import TypeCheckError
+
+        buffer = plomp.PlompBuffer()
+        try:
+            plomp.record_prompt(123, buffer=buffer)
+        except TypeCheckError:
+            print("checked")
+        else:
+            print("unchecked")
+        """
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        env=dict(os.environ, PLOMP_TYPECHECK=typecheck),
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert result.stdout.strip() == ("checked" if expect_error else "unchecked")
+
+
+def test_concurrent_recording():
+    buffer = plomp.PlompBuffer(key="test_concurrent_recording")
+    n_workers, n_calls = 64, 50
+
+    def worker(worker_id: int):
+        for call_id in range(n_calls):
+            handle = plomp.record_prompt(
+                f"{worker_id}:{call_id}", tags={"worker": worker_id}, buffer=buffer
+            )
+            plomp.record_event({"call_id": call_id}, buffer=buffer)
+            handle.complete(f"{worker_id}:{call_id}")
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(worker, range(n_workers)))
+
+    assert len(buffer) == 2 * n_workers * n_calls
+    prompts = [
+        item for item in buffer if item.type_ == plomp.PlompBufferItemType.PROMPT
+    ]
+    assert len(prompts) == n_workers * n_calls
+    for item in prompts:
+        assert item.call_trace.completion.response == item.call_trace.prompt
+
+
+def test_wrapped_async_traces():
+    buffer = plomp.PlompBuffer(key="test_wrapped_async_traces")
+
+    @plomp.wrap_prompt_fn(buffer=buffer, capture_tag_kwargs={"delay"})
+    async def prompt_fn(prompt: str, *, delay: float) -> str:
+        await asyncio.sleep(delay)
+        return f"answer to {prompt}"
+
+    assert inspect.iscoroutinefunction(prompt_fn)
+
+    async def run_all():
+        return await asyncio.gather(
+            *(prompt_fn(f"question {i}", delay=0.01 * (i % 3)) for i in range(100))
+        )
+
+    results = asyncio.run(run_all())
+
+    assert results == [f"answer to question {i}" for i in range(100)]
+    assert len(buffer) == 100
+    for item in buffer:
+        call_trace = item.call_trace
+        assert call_trace.completion.response == f"answer to {call_trace.prompt}"
+        # Completion is recorded after the await, not when the coroutine is created
+        latency = call_trace.completion.completion_timestamp - item.timestamp
+        assert latency >= dt.timedelta(seconds=item.tags["delay"] / 2)
+
+
+def test_bounded_buffer_evicts_oldest_items():
+    buffer = plomp.PlompBuffer(key="test_bounded_buffer", max_items=3)
+
+    handles = [
+        plomp.record_prompt(f"prompt {i}", tags={"i": i}, buffer=buffer)
+        for i in range(10)
+    ]
+    assert len(buffer) == 3
+    assert buffer.indices == range(7, 10)
+    assert [item.tags["i"] for item in buffer] == [7, 8, 9]
+    assert buffer[9].call_trace.prompt == "prompt 9"
+    assert buffer[-1] == buffer[9]
+
+    # Handles keep pointing at their own item, or fail clearly once evicted
+    handles[8].complete("response 8")
+    assert buffer[8].call_trace.completion.response == "response 8"
+    with pytest.raises(plomp.PlompItemEvictedError):
+        handles[0].complete("response 0")
+    with pytest.raises(plomp.PlompItemEvictedError):
+        buffer[6]
+    with pytest.raises(IndexError):
+        buffer[10]
+
+    query = buffer.filter(tags_filter={"i": [8, 9]})
+    assert query.matched_indices == [8, 9]
+    assert len(buffer.last(2)) == 2
+
+    plomp.record_event({"value": 1}, buffer=buffer)
+    plomp.record_event({"value": 2}, buffer=buffer)
+    assert buffer.indices == range(9, 12)
+    with pytest.raises(plomp.PlompItemEvictedError):
+        list(query)
+
+
+def test_reads_during_concurrent_eviction():
+    buffer = plomp.PlompBuffer(key="test_reads_during_eviction", max_items=16)
+    n_items = 5000
+    done = threading.Event()
+
+    def writer():
+        for i in range(n_items):
+            plomp.record_event({"i": i}, buffer=buffer)
+        done.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    # Every item read resolves to the item at that index, never a neighbour
+    while not done.is_set():
+        for index in buffer.indices:
+            try:
+                assert buffer[index].event.payload["i"] == index
+            except plomp.PlompItemEvictedError:
+                pass
+        start = buffer.indices.start
+        for offset, item in enumerate(buffer):
+            assert item.event.payload["i"] >= start + offset
+    thread.join()
+    assert [item.event.payload["i"] for item in buffer] == list(
+        range(n_items - 16, n_items)
+    )
+
+
+def test_bounded_buffer_by_bytes():
+    buffer = plomp.PlompBuffer(key="test_bounded_buffer_by_bytes", max_bytes=100)
+
+    for i in range(20):
+        plomp.record_event({"text": "x" * 30}, buffer=buffer)
+    assert 1 <= len(buffer) < 20
+    assert buffer.indices.stop == 20
+
+    buffer.set_limits(max_items=1)
+    assert len(buffer) == 1
+    assert buffer[-1] == buffer[19]
+
+
+def test_timestamps_round_trip_through_columns():
+    tz = dt.timezone(dt.timedelta(hours=-5))
+    timestamps = iter(
+        [
+            dt.datetime(2023, 10, 1, 12, 30, 15, 123456, tzinfo=tz),
+            dt.datetime(2023, 10, 1, 12, 30, 16, tzinfo=dt.timezone.utc),
+            dt.datetime(1950, 1, 1, 0, 0, 0, 1),
+        ]
+    )
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: next(timestamps))
+
+    handle = plomp.record_prompt("What is 1 + 1", buffer=buffer)
+    handle.complete("2")
+    plomp.record_event({"value": 1}, buffer=buffer)
+
+    assert buffer[0].timestamp == dt.datetime(
+        2023, 10, 1, 12, 30, 15, 123456, tzinfo=tz
+    )
+    assert buffer[0].timestamp.utcoffset() == dt.timedelta(hours=-5)
+    completion = buffer[0].call_trace.completion
+    assert completion.completion_timestamp == dt.datetime(
+        2023, 10, 1, 12, 30, 16, tzinfo=dt.timezone.utc
+    )
+    assert buffer[1].timestamp == dt.datetime(1950, 1, 1, 0, 0, 0, 1)
+    assert buffer[1].timestamp.tzinfo is None
+
+    # Timestamps outside the 64-bit nanosecond range fail clearly, storing nothing
+    for timestamp in [dt.datetime(1, 1, 1), dt.datetime(2300, 1, 1), 2**63]:
+        buffer.timestamp_fn = lambda: timestamp
+        with pytest.raises(ValueError, match="1677-09-21 and 2262-04-11"):
+            plomp.record_event({"value": 2}, buffer=buffer)
+    assert len(buffer) == 2
+
+
+def test_tags_are_interned():
+    buffer = mock_buffer("test_tags_are_interned")
+
+    for i in range(10):
+        plomp.record_event(
+            {"i": i}, tags={"domain": "weather", "location": "London"}, buffer=buffer
+        )
+    plomp.record_event(
+        {}, tags={"location": "London", "domain": "weather"}, buffer=buffer
+    )
+    plomp.record_event({}, tags={"flag": True, "config": {"depth": 2}}, buffer=buffer)
+    plomp.record_event({}, tags={"flag": 1, "config": {"depth": [1, 2]}}, buffer=buffer)
+
+    # Identical tag sets (regardless of key order) are stored once
+    assert len(buffer._store.tag_dictionary) == 3
+    assert buffer[0].tags is buffer[10].tags
+
+    # Values keep their own type when read back...
+    assert buffer[11].tags["flag"] is True
+    assert buffer[12].tags["flag"] == 1 and buffer[12].tags["flag"] is not True
+
+    # ...but filters match on equality just like before
+    assert len(buffer.filter(tags_filter={"flag": 1})) == 2
+    assert len(buffer.filter(tags_filter={"flag": 1.0})) == 2
+    assert len(buffer.filter(tags_filter={"config": {"depth": 2}})) == 1
+    assert len(buffer.filter(tags_filter={"config": {"depth": [1, 2]}})) == 1
+    assert len(buffer.filter(tags_filter={"missing": "value"})) == 0
+    assert len(buffer.filter(tags_filter={"missing": "value"}, how="none")) == 13
+    assert (
+        len(
+            buffer.filter(
+                tags_filter={"domain": "weather", "location": ["Paris", "London"]},
+                how="all",
+            )
+        )
+        == 11
+    )
+
+
+def test_evicted_words_are_pruned():
+    buffer = plomp.PlompBuffer(max_items=10)
+    assert len(buffer.search("anything")) == 0
+    for i in range(1000):
+        plomp.record_event({"text": f"word{i} common"}, buffer=buffer)
+
+    # Posting lists of evicted items are trimmed a few per record
+    assert len(buffer._search_index._postings) <= 3 * 10
+    assert buffer.search("word995").matched_indices == [995]
+    assert len(buffer.search("word5")) == 0
+    assert buffer.search("common").matched_indices == list(range(990, 1000))
+
+
+def test_evicted_tags_are_released():
+    buffer = plomp.PlompBuffer(key="test_evicted_tags_are_released", max_items=10)
+    with buffer.filter(tags_filter={"model": "b"}).live() as live_query:
+        for i in range(1000):
+            plomp.record_event(
+                {"i": i},
+                tags={"request_id": f"req-{i}", "model": "b" if i % 2 else "a"},
+                buffer=buffer,
+            )
+
+        # Only tag sets and values of retained items are kept
+        tag_dictionary = buffer._store.tag_dictionary
+        assert len(tag_dictionary) <= 2 * 10
+        assert len(tag_dictionary._value_codes) <= 2 * 10 + 2
+        assert len(buffer._tag_index._postings) <= 2 * 10 + 2
+        assert len(tag_dictionary._tag_sets) <= 2 * 10
+
+        # Reused tag set ids still filter correctly, live or not
+        assert buffer.filter(tags_filter={"request_id": "req-995"}).matched_indices == [
+            995
+        ]
+        assert len(buffer.filter(tags_filter={"request_id": "req-5"})) == 0
+        assert live_query.matched_indices == [991, 993, 995, 997, 999]
+        assert buffer.where(plomp.col.tag("model") != "a").matched_indices == [
+            991,
+            993,
+            995,
+            997,
+            999,
+        ]
+
+    # Tags count towards the byte limit
+    buffer = plomp.PlompBuffer(max_bytes=1000)
+    for i in range(100):
+        plomp.record_event({}, tags={"request_id": f"{i:040d}"}, buffer=buffer)
+    assert len(buffer) <= 1000 // 40
+
+
+def test_integer_nanosecond_timestamps():
+    clock = iter([1_700_000_000_123_456_789, 1_700_000_002_623_456_790])
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: next(clock))
+
+    plomp.record_prompt("What is 1 + 1", buffer=buffer).complete("2")
+
+    assert buffer.timestamp_ns(0) == 1_700_000_000_123_456_789
+    latency_ns = buffer.completion_timestamp_ns(0) - buffer.timestamp_ns(0)
+    assert latency_ns == 2_500_000_001
+
+    item = buffer[0]
+    assert item.timestamp == dt.datetime(
+        2023, 11, 14, 22, 13, 20, 123456, tzinfo=dt.timezone.utc
+    )
+    assert buffer.to_dict()["buffer_items"] == [item.to_dict()]
+    assert item.to_dict()["timestamp"] == "2023-11-14T22:13:20.123456+00:00"
+
+    monotonic_buffer = plomp.PlompBuffer(timestamp_fn=plomp.monotonic_ns_clock())
+    for i in range(3):
+        plomp.record_event({"i": i}, buffer=monotonic_buffer)
+    timestamps = [monotonic_buffer.timestamp_ns(i) for i in range(3)]
+    assert timestamps == sorted(timestamps)
+    assert abs(monotonic_buffer[0].timestamp - dt.datetime.now(dt.timezone.utc)) < (
+        dt.timedelta(seconds=60)
+    )
+
+
+def _scan_filter(items, how, tags_filter):
+    def key_matches(item, key, values):
+        values = values if isinstance(values, list) else [values]
+        return key in item.tags and any(item.tags[key] == v for v in values)
+
+    matches = [
+        [key_matches(item, key, values) for key, values in tags_filter.items()]
+        for item in items
+    ]
+    if how == "any":
+        return [i for i, m in enumerate(matches) if any(m)]
+    if how == "all":
+        return [i for i, m in enumerate(matches) if all(m)]
+    return [i for i, m in enumerate(matches) if not any(m)]
+
+
+def test_tag_filters_use_inverted_index():
+    buffer = plomp.PlompBuffer()
+    for i in range(60):
+        tags = {"model": ["gpt4", "claude", "llama"][i % 3], "shard": i % 4}
+        if i % 5 == 0:
+            tags["config"] = {"depth": i % 2}
+        plomp.record_event({"i": i}, tags=tags, buffer=buffer)
+
+    filters = [
+        {"model": "gpt4"},
+        {"model": ["gpt4", "llama"], "shard": 1},
+        {"shard": [0, 2], "config": {"depth": 0}},
+        {"missing": "value"},
+        {},
+    ]
+    items = list(buffer)
+    for tags_filter in filters:
+        for how in ("any", "all", "none"):
+            expected = _scan_filter(items, how, tags_filter)
+            query = buffer.filter(how=how, tags_filter=tags_filter)
+            assert query.matched_indices == expected
+
+            # Filtering a non-contiguous selection only keeps its own indices.
+            odd = buffer.where(truth_fn=lambda item: item.event.payload["i"] % 2)
+            assert odd.filter(how=how, tags_filter=tags_filter).matched_indices == [
+                i for i in expected if i % 2
+            ]
+
+    # Posting lists for evicted items are pruned as the buffer compacts.
+    buffer.set_limits(max_items=10)
+    plomp.record_event({"i": 60}, tags={"model": "gpt4", "shard": 0}, buffer=buffer)
+    assert buffer.filter(tags_filter={"model": "gpt4"}).matched_indices == [
+        51,
+        54,
+        57,
+        60,
+    ]
+
+
+def test_queries_are_lazy_and_optimised():
+    buffer = plomp.PlompBuffer()
+    for i in range(1000):
+        plomp.record_event({"i": i}, tags={"parity": i % 2}, buffer=buffer)
+
+    seen = []
+
+    def is_multiple_of_3(item):
+        seen.append(item.event.payload["i"])
+        return item.event.payload["i"] % 3 == 0
+
+    query = buffer.where(truth_fn=is_multiple_of_3)
+    assert seen == []
+
+    # Limits stop the scan as soon as enough items have matched.
+    assert query.last(2).matched_indices == [996, 999]
+    assert seen == [999, 998, 997, 996]
+
+    # Indexed tag filters run before opaque callables, whatever the order.
+    seen.clear()
+    odd_query = query.filter(tags_filter={"parity": 1})
+    assert odd_query.first(3).matched_indices == [3, 9, 15]
+    assert seen == [1, 3, 5, 7, 9, 11, 13, 15]
+    assert odd_query.op_name == (
+        "filter[how='any', tags={'parity': [1]}](where[](<buffer>))"
+    )
+
+    # Queries snapshot the buffer's indices when they are created.
+    even_query = buffer.filter(tags_filter={"parity": 0})
+    plomp.record_event({"i": 1000}, tags={"parity": 0}, buffer=buffer)
+    assert len(even_query) == 500
+    assert len(buffer.filter(tags_filter={"parity": 0})) == 501
+
+    # Recording a query runs it, so later changes don't alter what was recorded
+    buffer = plomp.PlompBuffer(max_items=3)
+    handle = plomp.record_prompt("pending", buffer=buffer)
+    buffer.where(truth_fn=lambda item: item.call_trace.completion is None).record(
+        tags={}
+    )
+    handle.complete("done")
+    assert buffer.to_dict()["buffer_items"][1]["data"]["matched_indices"] == [0]
+
+    # ...and it stays serialisable once the items it matched are evicted
+    plomp.record_event({"i": 0}, buffer=buffer)
+    plomp.record_event({"i": 1}, buffer=buffer)
+    assert buffer.indices == range(1, 4)
+    assert buffer[1].query.matched_indices == [0]
+    assert buffer.to_dict()["buffer_items"][0]["data"]["matched_indices"] == [0]
+
+
+def test_matched_indices_are_packed_index_sets():
+    buffer = plomp.PlompBuffer()
+    for i in range(20):
+        plomp.record_event({"i": i}, tags={"mod3": i % 3, "mod2": i % 2}, buffer=buffer)
+
+    threes = buffer.filter(tags_filter={"mod3": 0})
+    evens = buffer.filter(tags_filter={"mod2": 0})
+    union = threes.union(evens)
+    intersection = threes.intersection(evens)
+
+    assert isinstance(union.matched_indices, PlompIndexSet)
+    assert union.matched_indices == sorted(
+        set(threes.matched_indices) | set(evens.matched_indices)
+    )
+    assert intersection.matched_indices == [0, 6, 12, 18]
+    assert [0, 6, 12, 18] == intersection.matched_indices
+    assert len(intersection) == 4
+    assert intersection[-1].event.payload == {"i": 18}
+    assert intersection.to_dict()["matched_indices"] == [0, 6, 12, 18]
+    assert 12 in intersection.matched_indices and 13 not in union.matched_indices
+    assert threes.matched_indices.difference(evens.matched_indices) == [3, 9, 15]
+
+    # Disjoint windows are concatenated without merging.
+    assert buffer.first(3).union(buffer.last(2)).matched_indices == [0, 1, 2, 18, 19]
+    assert PlompIndexSet([5, 1, 3, 1]) == [1, 3, 5]
+    assert PlompIndexSet(array("q", [3, 1, 2, 2])) == [1, 2, 3]
+    assert PlompIndexSet(range(5, 0, -2)) == [1, 3, 5]
+    unsorted_query = plomp.PlompBufferQuery(
+        buffer, matched_indices=array("q", [7, 2, 5])
+    )
+    assert unsorted_query.matched_indices == [2, 5, 7]
+    assert [item.event.payload["i"] for item in unsorted_query] == [2, 5, 7]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_large_set_operations(monkeypatch, use_numpy):
+    from plomp import _index_sets
+
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(_index_sets, "np", None)
+
+    buffer = plomp.PlompBuffer()
+    for i in range(3000):
+        plomp.record_event({"i": i}, tags={"mod2": i % 2, "mod3": i % 3}, buffer=buffer)
+
+    evens = buffer.filter(tags_filter={"mod2": 0})
+    threes = buffer.filter(tags_filter={"mod3": 0})
+    rare = buffer.filter(tags_filter={"mod3": 1}).first(14)
+    evens_set, threes_set = set(evens.matched_indices), set(threes.matched_indices)
+
+    assert evens.union(threes).matched_indices == sorted(evens_set | threes_set)
+    assert evens.intersection(threes).matched_indices == sorted(evens_set & threes_set)
+    assert evens.intersection(rare).matched_indices == list(range(4, 41, 6))
+    assert evens.matched_indices.difference(threes.matched_indices) == sorted(
+        evens_set - threes_set
+    )
+    assert buffer.filter(tags_filter={"mod3": [1, 2]}).matched_indices == sorted(
+        set(range(3000)) - threes_set
+    )
+    odd_threes = buffer.filter(how="all", tags_filter={"mod2": 1, "mod3": 0})
+    assert odd_threes.matched_indices == sorted(threes_set - evens_set)
+    neither = buffer.filter(how="none", tags_filter={"mod2": 1, "mod3": 0})
+    assert neither.matched_indices == sorted(evens_set - threes_set)
+
+
+def test_contiguous_selections_stay_ranges():
+    buffer = plomp.PlompBuffer()
+    for i in range(100):
+        plomp.record_event({"i": i}, tags={"parity": i % 2}, buffer=buffer)
+
+    last = buffer.last(20)
+    assert last.matched_indices.is_range
+    assert last.matched_indices == list(range(80, 100))
+
+    window = buffer.window(10, 60).first(30).last(5)
+    assert window.matched_indices.is_range
+    assert window.matched_indices == [35, 36, 37, 38, 39]
+    assert [item.event.payload["i"] for item in window] == [35, 36, 37, 38, 39]
+
+    overlapping = buffer.window(0, 10).union(buffer.window(5, 15))
+    assert overlapping.matched_indices.is_range
+    assert overlapping.matched_indices == list(range(15))
+    assert buffer.window(0, 10).intersection(buffer.window(5, 15)).matched_indices == [
+        5,
+        6,
+        7,
+        8,
+        9,
+    ]
+
+    # Non-contiguous operators materialise the selection.
+    odd = buffer.last(10).filter(tags_filter={"parity": 1})
+    assert not odd.matched_indices.is_range
+    assert odd.matched_indices == [91, 93, 95, 97, 99]
+    assert odd.last(2).matched_indices == [97, 99]
+
+
+def test_live_queries_only_evaluate_new_items():
+    buffer = plomp.PlompBuffer()
+    for i in range(10):
+        plomp.record_event(
+            {"i": i}, tags={"level": "error" if i % 3 else "info"}, buffer=buffer
+        )
+
+    evaluated = []
+
+    def is_even(item):
+        evaluated.append(item.event.payload["i"])
+        return item.event.payload["i"] % 2 == 0
+
+    delivered = []
+    live = (
+        buffer.filter(tags_filter={"level": "error"})
+        .where(truth_fn=is_even)
+        .live(callback=lambda query: delivered.append(query.matched_indices.tolist()))
+    )
+    assert live.matched_indices == [2, 4, 8]
+    assert live.new_matches().matched_indices == []
+
+    evaluated.clear()
+    for i in range(10, 16):
+        plomp.record_event(
+            {"i": i}, tags={"level": "error" if i % 3 else "info"}, buffer=buffer
+        )
+
+    # Only new items with a matching tag reach the predicate, once each.
+    assert evaluated == [10, 11, 13, 14]
+    assert delivered == [[10], [14]]
+    assert live.new_matches().matched_indices == [10, 14]
+    assert live.new_matches().matched_indices == []
+    assert live.matched_indices == [2, 4, 8, 10, 14]
+
+    live.close()
+    plomp.record_event({"i": 16}, tags={"level": "error"}, buffer=buffer)
+    assert delivered == [[10], [14]]
+
+    with pytest.raises(ValueError):
+        buffer.last(5).live()
+
+
+def test_live_query_errors_stay_out_of_recording(caplog):
+    buffer = plomp.PlompBuffer()
+    failing = buffer.where(truth_fn=lambda item: item.event.payload["x"] > 0).live()
+    delivered = []
+
+    def failing_callback(query):
+        delivered.append(query.matched_indices.tolist())
+        raise RuntimeError("callback failed")
+
+    other = buffer.filter(tags_filter={"kind": "x"}).live(callback=failing_callback)
+
+    # Neither predicate nor callback errors reach the recorder, which keeps its
+    # handle, and every live query still sees every item
+    handle = plomp.record_prompt("prompt", tags={"kind": "x"}, buffer=buffer)
+    handle.complete("response")
+    plomp.record_event({"x": 1}, tags={"kind": "x"}, buffer=buffer)
+    plomp.record_event({"x": -1}, buffer=buffer)
+
+    assert failing.matched_indices == [1]
+    assert other.matched_indices == [0, 1]
+    assert delivered == [[0], [1]]
+    assert "failed on item 0" in caplog.text
+    assert "Callback of live query" in caplog.text
+    # Failing items are only evaluated once
+    assert caplog.text.count("failed on item 0") == 1
+
+
+def test_time_range_queries():
+    # Mostly in order, with a few late arrivals.
+    timestamps = [i * 1_000 for i in range(600)]
+    for i in (100, 350, 351, 599):
+        timestamps[i] -= 50_500
+    clock = iter(timestamps)
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: next(clock))
+    for i in range(600):
+        plomp.record_event({"i": i}, tags={"parity": i % 2}, buffer=buffer)
+
+    def expected(start, end):
+        return [
+            i
+            for i, timestamp in enumerate(timestamps)
+            if start <= timestamp and (end is None or timestamp < end)
+        ]
+
+    for start, end in [(0, 10_000), (49_000, 60_000), (300_000, None), (0, None)]:
+        assert buffer.between(start, end).matched_indices == expected(start, end)
+    assert buffer.since(549_000).matched_indices == expected(549_000, None)
+
+    in_order = buffer.between(400_000, 500_000)
+    assert in_order.matched_indices.is_range
+    assert in_order.op_name == "between[start=400000, end=500000](<buffer>)"
+
+    # Time ranges combine with other operators, and accept datetimes.
+    assert buffer.since(590_000).filter(tags_filter={"parity": 1}).matched_indices == [
+        591,
+        593,
+        595,
+        597,
+    ]
+    epoch = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+    assert buffer.between(
+        epoch, epoch + dt.timedelta(microseconds=3)
+    ).matched_indices == [0, 1, 2]
+
+    # Evicted items drop out of the index.
+    buffer.set_limits(max_items=100)
+    assert buffer.between(0, None).matched_indices == list(range(500, 600))
+
+
+def test_full_text_search():
+    buffer = plomp.PlompBuffer()
+    plomp.record_prompt("What is the weather in London?", buffer=buffer).complete(
+        "It is raining in London."
+    )
+    plomp.record_event(
+        {"plomp_display_text": "Fetched weather", "city": {"name": "Paris"}},
+        buffer=buffer,
+    )
+    pending = plomp.record_prompt("Summarise the news", buffer=buffer)
+    plomp.record_event({"temperature": 21}, buffer=buffer)
+
+    assert buffer.search("weather").matched_indices == [0, 1]
+    assert buffer.search("LONDON raining").matched_indices == [0]
+    assert buffer.search("raining", fields=["prompt"]).matched_indices == []
+    assert buffer.search("paris").matched_indices == [1]
+    assert buffer.search("21").matched_indices == [3]
+    assert buffer.search("weather paris").matched_indices == [1]
+    assert buffer.search("snow").matched_indices == []
+
+    # The index is kept up to date once built, including for late responses.
+    pending.complete("Markets rallied; weather was calm.")
+    plomp.record_event({"note": "more weather"}, buffer=buffer)
+    assert buffer.search("weather").matched_indices == [0, 1, 2, 4]
+    assert buffer.search("weather", fields=["response"]).matched_indices == [2]
+    assert buffer.last(2).search("weather").matched_indices == [4]
+
+    with pytest.raises((ValueError, TypeCheckError)):
+        buffer.search("weather", fields=["tags"])
+    with pytest.raises(ValueError):
+        buffer.search("  ")
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_column_expressions(monkeypatch, use_numpy):
+    from plomp import _expressions
+
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(_expressions, "np", None)
+
+    clock = iter(i * 1_000_000_000 for i in range(100))
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: next(clock))
+    slow = plomp.record_prompt("slow", tags={"model": "a"}, buffer=buffer)
+    fast = plomp.record_prompt("fast", tags={"model": "b"}, buffer=buffer)
+    fast.complete("done")
+    plomp.record_event(
+        {"x": 1}, tags={"model": "a", "domain": "weather"}, buffer=buffer
+    )
+    plomp.record_prompt("pending", tags={"model": "a"}, buffer=buffer)
+    slow.complete("done")
+
+    col = plomp.col
+    cases = [
+        (col.type == "prompt", [0, 1, 3]),
+        (col.type == plomp.PlompBufferItemType.EVENT, [2]),
+        (col.tag("model") == "a", [0, 2, 3]),
+        (col.tag("domain") != "weather", [0, 1, 3]),
+        (col.tag("model").isin(["a", "b"]), [0, 1, 2, 3]),
+        (col.latency > 2.0, [0]),
+        (col.latency <= 1.0, [1]),
+        ((col.tag("model") == "a") & (col.type == "prompt"), [0, 3]),
+        ((col.latency < 2) | (col.tag("domain") == "weather"), [1, 2]),
+        (~(col.type == "prompt"), [2]),
+    ]
+    for expression, expected in cases:
+        assert buffer.where(expression).matched_indices == expected
+        # Expressions are also callables, matching the column evaluation.
+        assert [i for i, item in enumerate(buffer) if expression(item)] == expected
+
+    query = buffer.last(3).where(col.type == "prompt")
+    assert query.matched_indices == [1, 3]
+    assert query.op_name == "where[col.type == 'prompt'](last[size=3](<buffer>))"
+    assert buffer.where(truth_fn=col.latency > 2.0).matched_indices == [0]
+
+    with pytest.raises(ValueError):
+        buffer.where()
+    with pytest.raises(TypeError):
+        (col.type == "prompt") and (col.latency > 1)
+
+
+def test_query_results_are_cached_and_extended():
+    buffer = plomp.PlompBuffer()
+    for i in range(10):
+        plomp.record_event({"i": i}, tags={"parity": i % 2}, buffer=buffer)
+
+    calls = []
+
+    def is_small(item):
+        calls.append(item.event.payload["i"])
+        return item.event.payload["i"] < 100
+
+    def odd_small():
+        return buffer.filter(tags_filter={"parity": 1}).where(
+            truth_fn=is_small, pure=True
+        )
+
+    cache = buffer._query_cache
+    assert odd_small().matched_indices == [1, 3, 5, 7, 9]
+    assert odd_small().matched_indices == [1, 3, 5, 7, 9]
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert calls == [1, 3, 5, 7, 9]
+
+    # Appends extend the cached result by evaluating only the new items.
+    stale = odd_small()
+    calls.clear()
+    for i in range(10, 14):
+        plomp.record_event({"i": i}, tags={"parity": i % 2}, buffer=buffer)
+    assert odd_small().matched_indices == [1, 3, 5, 7, 9, 11, 13]
+    assert cache.extensions == 1
+    assert calls == [11, 13]
+    # Queries created before the appends still see their own snapshot.
+    assert stale.matched_indices == [1, 3, 5, 7, 9]
+
+    # Changes to existing items invalidate the cache.
+    plomp.record_prompt("late", tags={"parity": 1}, buffer=buffer).complete("done")
+    misses = cache.misses
+    assert buffer.filter(tags_filter={"parity": 1}).matched_indices[-1] == 14
+    assert cache.misses == misses + 1
+
+    # Results are evicted to stay within the size budget.
+    cache.max_bytes = 200
+    for parity in (0, 1):
+        buffer.filter(tags_filter={"parity": parity}).matched_indices
+    assert cache._bytes <= 200 and len(cache) == 1
+
+    # Callables not marked pure may depend on more than the item, so are rerun.
+    threshold = [3]
+
+    def below_threshold(item):
+        return item.tags["parity"] < threshold[0]
+
+    assert len(buffer.where(truth_fn=below_threshold)) == 15
+    threshold[0] = 1
+    assert len(buffer.where(truth_fn=below_threshold)) == 7
+
+    # Empty windows share a key with non-empty ones but can't be extended.
+    cache.max_bytes = 10_000
+    odd = plomp.col.tag("parity") == 1
+    assert buffer.window(5, 2).matched_indices == []
+    assert buffer.window(5, 8).matched_indices == [5, 6, 7]
+    assert buffer.window(5, 2).where(odd).matched_indices == []
+    assert buffer.window(5, 8).where(odd).matched_indices == [5, 7]
+    assert buffer.window(5, 6).where(odd).matched_indices == [5]
+    assert buffer.window(5, 12).where(odd).matched_indices == [5, 7, 9, 11]
+
+    uncached = plomp.PlompBuffer(query_cache_bytes=0)
+    uncached.filter(tags_filter={"parity": 1}).matched_indices
+    assert len(uncached._query_cache) == 0
+
+
+def test_group_by_aggregations():
+    now = [0]
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: now[0])
+    latencies = {"a": [1, 2, 3, 4, 100], "b": [10, 20]}
+    for model, model_latencies in latencies.items():
+        for latency in model_latencies:
+            handle = plomp.record_prompt("p", tags={"model": model}, buffer=buffer)
+            now[0] += latency * 1_000_000_000
+            handle.complete("r")
+    plomp.record_prompt("pending", tags={"model": "b"}, buffer=buffer)
+    for tokens in (5, 7):
+        plomp.record_event({"tokens": tokens}, tags={"model": "a"}, buffer=buffer)
+    plomp.record_event({"tokens": "many"}, tags={}, buffer=buffer)
+
+    agg = plomp.agg
+    result = buffer.group_by("model").agg(
+        n=agg.count(),
+        prompts=agg.count(plomp.col.type == "prompt"),
+        latency=agg.latency_quantiles([0.5, 1.0]),
+        tokens=agg.sum("tokens"),
+    )
+    assert set(result) == {("a",), ("b",), (None,)}
+    assert result[("a",)]["n"] == 7 and result[("a",)]["prompts"] == 5
+    assert result[("a",)]["tokens"] == 12
+    assert result[("a",)]["latency"][0.5] == pytest.approx(3, rel=0.01)
+    assert result[("a",)]["latency"][1.0] == pytest.approx(100, rel=0.01)
+    assert result[("b",)]["n"] == 3 and result[("b",)]["prompts"] == 3
+    assert result[(None,)] == {
+        "n": 1,
+        "prompts": 0,
+        "latency": {0.5: None, 1.0: None},
+        "tokens": 0,
+    }
+
+    only_b = buffer.filter(tags_filter={"model": "b"}).group_by("model")
+    assert list(only_b.agg(n=agg.count())) == [("b",)]
+
+    nested = plomp.PlompBuffer()
+    for model in ({"name": "a", "size": [1, 2]}, {"name": "a", "size": [1, 2]}, "b"):
+        plomp.record_event({}, tags={"model": model}, buffer=nested)
+    assert nested.group_by("model").agg(n=agg.count()) == {
+        ((dict, frozenset({("name", "a"), ("size", (list, (1, 2)))})),): {"n": 2},
+        ("b",): {"n": 1},
+    }
+
+    sketches = buffer.group_by("model").agg(latency=agg.latency_sketch())
+    merged = sketches[("a",)]["latency"].merge(sketches[("b",)]["latency"])
+    assert len(merged) == 7
+    assert merged.quantile(0.5) == pytest.approx(4, rel=0.01)
+    assert merged.quantile(0) == 1 and merged.quantile(1) == 100
+    with pytest.raises(ValueError):
+        merged.merge(plomp.PlompQuantileSketch(relative_accuracy=0.05))
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_latency_analysis(monkeypatch, use_numpy):
+    from plomp import _latency
+
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(_latency, "np", None)
+
+    now = [0]
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: now[0], max_items=9)
+    plomp.record_prompt("evicted", buffer=buffer)
+    handles = []
+    for latency in [3, 1, 7, 2, 5]:
+        handles.append(
+            plomp.record_prompt("p", tags={"latency": latency}, buffer=buffer)
+        )
+        now[0] += 1_000_000_000
+    for handle, latency in zip(handles, [3, 1, 7, 2, 5]):
+        now[0] = (handle.index - 1) * 1_000_000_000 + latency * 1_000_000_000
+        handle.complete("r")
+    plomp.record_event({}, tags={}, buffer=buffer)
+    pending = [plomp.record_prompt("pending", buffer=buffer) for _ in range(3)]
+    assert buffer.indices == range(1, 10)
+    assert buffer._store.latencies[buffer._position(3)] == 7_000_000_000
+
+    assert buffer.slowest(2).matched_indices == [3, 5]
+    assert buffer.slowest(10).matched_indices == [1, 2, 3, 4, 5]
+    fast = buffer.filter(tags_filter={"latency": [1, 2]})
+    assert fast.slowest().matched_indices == [4]
+    assert buffer.longest_in_flight(2).matched_indices == [7, 8]
+    pending[0].complete("r")
+    assert buffer.longest_in_flight(2).matched_indices == [8, 9]
+    assert len(buffer.slowest(10)) == 6
+
+    assert buffer.latency_histogram([2.0, 5.0]) == [2, 2, 2]
+    assert buffer.first(5).latency_histogram([2.0, 5.0]) == [1, 2, 2]
+    assert buffer.latency_histogram([]) == [6]
+    with pytest.raises(ValueError):
+        buffer.latency_histogram([5.0, 2.0])
+    grouped = (
+        buffer.first(5)
+        .group_by("latency")
+        .agg(histogram=plomp.agg.latency_histogram([2.0]))
+    )
+    assert grouped[(1,)]["histogram"] == [1, 0]
+    assert grouped[(7,)]["histogram"] == [0, 1]
+
+    with pytest.raises(ValueError):
+        buffer.slowest(1).live()
+
+
+def test_record_many_timestamps():
+    now = 2_000_000_000_000_000_000  # In 2033
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: now)
+    start = dt.datetime(2025, 1, 1, tzinfo=dt.timezone.utc)
+    completed = plomp.PlompCallTrace("p").complete(start + dt.timedelta(seconds=5), "r")
+    indices = buffer.record_many([(start, completed), {"x": 1}])
+    assert buffer[indices[0]].timestamp == start
+    assert buffer.timestamp_ns(indices[1]) == now
+    assert buffer.latency_histogram([0, 1]) == [0, 0, 1]
+    assert buffer.slowest().matched_indices == [0]
+
+    # The batch timestamp is after the completion, so the prompt would have
+    # completed before it started.
+    with pytest.raises(ValueError):
+        buffer.record_many([completed])
+    assert len(buffer) == 2
+
+
+def test_bulk_ingest(tmp_path):
+    clock = iter(range(10_000, 1_000_000, 1_000))
+    source = plomp.PlompBuffer(timestamp_fn=lambda: next(clock))
+    plomp.record_prompt("done", tags={"k": 1}, buffer=source).complete("r")
+    plomp.record_prompt("pending", tags={"k": 1}, buffer=source)
+    plomp.record_event({"x": 1}, tags={"k": 2}, buffer=source)
+
+    log_path = str(tmp_path / "trace.jsonl")
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: 5, max_items=6)
+    buffer.attach_sink(plomp.PlompLogSink(log_path))
+    live = buffer.filter(tags_filter={"k": [1]}).live()
+    buffer.filter(tags_filter={"k": [1]}).matched_indices
+
+    assert buffer.extend(source) == range(0, 3)
+    assert [item.to_dict() for item in buffer] == [item.to_dict() for item in source]
+    assert buffer.filter(tags_filter={"k": [1]}).matched_indices == [0, 1]
+    assert buffer.between(11_500, 20_000).matched_indices == [1, 2]
+    assert buffer.longest_in_flight().matched_indices == [1]
+    assert live.matched_indices == [0, 1]
+
+    completed = plomp.PlompCallTrace("p").complete(source[0].timestamp, "response")
+    indices = buffer.record_many(
+        [
+            {"y": 2},
+            plomp.PlompEvent(payload={"y": 3}),
+            completed,
+            plomp.PlompCallTrace("q"),
+        ],
+        tags={"k": 1},
+    )
+    assert indices == range(3, 7)
+    assert buffer.indices == range(1, 7)
+    assert [buffer[i].tags for i in indices] == [{"k": 1}] * 4
+    assert buffer[4].event.payload == {"y": 3}
+    assert buffer[5].call_trace.completion.response == "response"
+    assert buffer.longest_in_flight(5).matched_indices == [1, 6]
+    assert buffer.filter(tags_filter={"k": [1]}).matched_indices == [1, 3, 4, 5, 6]
+    assert live.matched_indices == [1, 3, 4, 5, 6]
+    assert buffer.record_many([]) == range(7, 7)
+
+    with pytest.raises((TypeError, TypeCheckError)):
+        buffer.record_many([{"ok": 1}, "not a record"])
+    with pytest.raises((TypeError, TypeCheckError)):
+        buffer.extend([source[0], {"not": "an item"}])
+    out_of_range = plomp.PlompBufferItem(
+        dt.datetime(1, 1, 1),
+        {"k": 3},
+        plomp.PlompBufferItemType.EVENT,
+        plomp.PlompEvent(payload={}),
+    )
+    store_size = len(buffer._store)
+    with pytest.raises(ValueError):
+        buffer.extend([source[0], out_of_range])
+    assert buffer.indices == range(1, 7)
+    assert len(buffer._store.timestamps) == len(buffer._store.data) == store_size
+    assert buffer.filter(tags_filter={"k": [1]}).matched_indices == [1, 3, 4, 5, 6]
+    assert live.matched_indices == [1, 3, 4, 5, 6]
+    assert buffer.between(11_500, 20_000).matched_indices == [1, 2]
+
+    buffer._sink.close()
+    restored = plomp.PlompBuffer()
+    plomp.read_log(restored, log_path)
+    expected = plomp.PlompBuffer(buffer_items=[*source, *buffer.window(2, 6)])
+    assert [item.to_dict() for item in restored] == [
+        item.to_dict() for item in expected
+    ]
@@ -1,7 +1,8 @@
 import os
 import random
 import tempfile
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime, timedelta, timezone
 import pytest
 
 import plomp
@@ -239,3 +240,399 @@ def test_write_json(temp_html_file):
 
         assert new_buffer[0].tags == buffer[0].tags
         assert new_buffer[1].type_ == buffer[1].type_
+
+
+def test_writers_stream_the_same_json_as_to_dict(tmp_path):
+    buffer = plomp.PlompBuffer(key="streamed", max_items=2500)
+    for i in range(3000):
+        if i % 3 == 0:
+            handle = plomp.record_prompt(f"prompt {i}", tags={"i": i}, buffer=buffer)
+            if i % 2:
+                handle.complete("response \u2603")
+        else:
+            plomp.record_event({"value": i}, tags={"i": i}, buffer=buffer)
+    buffer.last(5).record(tags={"kind": "query"})
+    expected = json.dumps(buffer.to_dict())
+
+    json_path = tmp_path / "trace.json"
+    plomp.write_json(buffer, str(json_path))
+    assert json_path.read_text(encoding="utf-8") == expected
+
+    html_path = tmp_path / "trace.html"
+    plomp.write_html(buffer, str(html_path))
+    html = html_path.read_text(encoding="utf-8")
+    assert f"window.__PLOMP_BUFFER_JSON__ = {expected};" in html
+    assert "<!-- insert plomp JSON data here -->" not in html
+
+    plomp.write_json(plomp.PlompBuffer(), str(json_path))
+    assert json.loads(json_path.read_text()) == {"key": None, "buffer_items": []}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 2**16])
+def test_read_json_streams_and_keeps_timestamps(tmp_path, chunk_size):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    clock = iter(start + timedelta(seconds=i) for i in range(100))
+    buffer = plomp.PlompBuffer(key="original", timestamp_fn=lambda: next(clock))
+    handle = plomp.record_prompt("caf\u00e9 \U0001f600", tags={"n": 1.5}, buffer=buffer)
+    plomp.record_event({"nested": {"values": [1, 22, 333]}}, tags={}, buffer=buffer)
+    handle.complete("done")
+    plomp.record_event({"text": 'say "}]" \\ [{'}, tags={"q": '"\\'}, buffer=buffer)
+    plomp.record_prompt("pending", tags={"n": 2}, buffer=buffer)
+    buffer.first(2).record(tags={"kind": "query"})
+
+    path = tmp_path / "trace.json"
+    plomp.write_json(buffer, str(path))
+    loaded = plomp.PlompBuffer(key="original")
+    plomp.read_json(loaded, str(path), chunk_size=chunk_size)
+    assert loaded.to_dict()["buffer_items"] == buffer.to_dict()["buffer_items"]
+    assert loaded[0].timestamp == start
+    assert loaded[0].call_trace.completion.completion_timestamp == start + timedelta(
+        seconds=2
+    )
+
+    path.write_text('{"buffer_items": [], "key": 12345}')
+    plomp.read_json(loaded, str(path), chunk_size=chunk_size)
+    assert len(loaded) == 5
+
+    event = {"timestamp": 0, "tags": {}, "type": "event", "data": {"payload": {}}}
+    target = plomp.PlompBuffer()
+    for malformed in [
+        "[1, 2]",
+        '{"key": "k"}',
+        '{"buffer_items": [{}',
+        json.dumps({"buffer_items": [{**event, "tags": None}]}),
+        json.dumps({"buffer_items": [{**event, "tags": {"k": None}}]}),
+        json.dumps({"buffer_items": [{**event, "data": {"payload": [1]}}]}),
+        json.dumps(
+            {
+                "buffer_items": [
+                    {**event, "type": "prompt", "data": {"prompt": 1}},
+                ]
+            }
+        ),
+    ]:
+        path.write_text(malformed)
+        with pytest.raises((ValueError, KeyError)):
+            plomp.read_json(target, str(path), chunk_size=chunk_size)
+    # Malformed items are rejected before anything is appended.
+    assert len(target) == 0
+    plomp.record_event({"value": 1}, buffer=target)
+    assert target[0].event.payload == {"value": 1}
+
+
+def test_log_sink_round_trip(tmp_path):
+    log_path = str(tmp_path / "trace.jsonl")
+    clock = iter(range(1_000, 100_000, 1_000))
+    buffer = plomp.PlompBuffer(timestamp_fn=lambda: next(clock), max_items=2)
+
+    plomp.record_event({"value": "before sink"}, tags={"phase": 0}, buffer=buffer)
+    sink = plomp.PlompLogSink(log_path, batch_size=2)
+    buffer.attach_sink(sink)
+
+    first_handle = plomp.record_prompt("first", tags={"phase": 1}, buffer=buffer)
+    plomp.record_event({"value": 1}, tags={"phase": 1}, buffer=buffer)
+    plomp.record_event({"value": 2}, tags={"phase": 1}, buffer=buffer)
+    # Already evicted from memory, but the completion still reaches the log
+    first_handle.complete("first response")
+    with pytest.raises(plomp.PlompItemEvictedError):
+        first_handle.complete("completed twice")
+    plomp.record_prompt("second", buffer=buffer).complete("second response")
+    buffer.last(1).record(tags={})
+    sink.close()
+
+    restored = plomp.PlompBuffer()
+    plomp.read_log(restored, log_path)
+
+    assert len(restored) == 6
+    assert restored[0].event.payload == {"value": "before sink"}
+    assert restored[1].call_trace.prompt == "first"
+    assert restored[1].call_trace.completion.response == "first response"
+    assert restored[1].timestamp == datetime.fromtimestamp(2e-6, timezone.utc)
+    assert restored.timestamp_ns(1) == 2_000
+    assert restored.completion_timestamp_ns(1) == 5_000
+    assert restored[4].call_trace.completion.response == "second response"
+    assert restored[5].type_ == plomp.PlompBufferItemType.QUERY
+    assert restored[5].query.matched_indices == [4]
+
+
+def test_log_sink_skips_prompts_evicted_before_it_was_attached(tmp_path):
+    log_path = tmp_path / "trace.jsonl"
+    buffer = plomp.PlompBuffer(max_items=2)
+    handle = plomp.record_prompt("evicted", buffer=buffer)
+    plomp.record_event({"value": 1}, buffer=buffer)
+    plomp.record_event({"value": 2}, buffer=buffer)
+    with plomp.PlompLogSink(str(log_path)) as sink:
+        buffer.attach_sink(sink)
+        # The sink never recorded the prompt, so can't log its completion
+        with pytest.raises(plomp.PlompItemEvictedError):
+            handle.complete("response")
+
+    restored = plomp.PlompBuffer()
+    plomp.read_log(restored, str(log_path))
+    assert [item.event.payload["value"] for item in restored] == [1, 2]
+
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "complete", "index": 0, "completion_timestamp": 0, ')
+        f.write('"response": "r"}\n')
+    with pytest.raises(ValueError):
+        plomp.read_log(plomp.PlompBuffer(), str(log_path))
+
+
+def test_log_sink_writes_outside_the_buffer_lock(tmp_path):
+    buffer = plomp.PlompBuffer(max_items=2)
+    plomp.record_event({"value": 0}, buffer=buffer)
+    locked_during_flush = []
+
+    class Sink(plomp.PlompLogSink):
+        def flush(self):
+            locked_during_flush.append(buffer._lock.locked())
+            super().flush()
+
+    with Sink(str(tmp_path / "trace.jsonl"), batch_size=1) as sink:
+        buffer.attach_sink(sink)
+        handle = plomp.record_prompt("first", buffer=buffer)
+        plomp.record_many([{"value": 1}, {"value": 2}], buffer=buffer)
+        handle.complete("evicted by now")
+        plomp.record_prompt("second", buffer=buffer).complete("response")
+
+    assert len(locked_during_flush) >= 6
+    assert not any(locked_during_flush)
+
+
+@pytest.mark.parametrize(
+    "build_query",
+    [
+        lambda buffer: buffer.search("hello"),
+        lambda buffer: buffer.longest_in_flight(1),
+    ],
+)
+def test_recording_index_backed_queries_with_a_sink(tmp_path, build_query):
+    log_path = str(tmp_path / "trace.jsonl")
+    buffer = plomp.PlompBuffer()
+
+    def record():
+        plomp.record_prompt("hello world", buffer=buffer)
+        # Queries on hand-built items are run before they are appended, so
+        # attaching the sink doesn't run them under the buffer's lock
+        query_item = plomp.PlompBufferItem(
+            datetime(2024, 1, 1),
+            {},
+            plomp.PlompBufferItemType.QUERY,
+            build_query(buffer),
+        )
+        buffer.extend([query_item])
+        with plomp.PlompLogSink(log_path, batch_size=1) as sink:
+            buffer.attach_sink(sink)
+            build_query(buffer).record(tags={})
+
+    # Run on a thread, so a deadlock fails the test rather than hanging it
+    thread = threading.Thread(target=record, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+    restored = plomp.PlompBuffer()
+    plomp.read_log(restored, log_path)
+    assert restored[1].query.matched_indices == [0]
+    assert restored[2].query.matched_indices == [0]
+
+
+def test_read_log_ignores_truncated_last_line(tmp_path):
+    log_path = str(tmp_path / "trace.jsonl")
+    buffer = plomp.PlompBuffer()
+    with plomp.PlompLogSink(log_path) as sink:
+        buffer.attach_sink(sink)
+        plomp.record_event({"value": 1}, buffer=buffer)
+        plomp.record_event({"value": 2}, buffer=buffer)
+
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "record", "index": 2, "it')
+
+    restored = plomp.PlompBuffer()
+    plomp.read_log(restored, log_path)
+    assert [item.event.payload["value"] for item in restored] == [1, 2]
+
+
+def test_binary_round_trip_and_random_access(tmp_path):
+    from zoneinfo import ZoneInfo
+
+    paris = ZoneInfo("Europe/Paris")
+    timestamps = iter(
+        [
+            1_700_000_000_123_456_789,
+            datetime(2025, 1, 1, 12, 0, 0, 1),
+            datetime(2025, 1, 1, 12, 0, 1, tzinfo=paris),
+            datetime(2025, 1, 1, 12, 0, 2, tzinfo=timezone(timedelta(hours=-5))),
+            1_700_000_001_000_000_001,
+        ]
+        + list(range(1_800_000_000_000_000_000, 1_800_000_000_000_001_000))
+    )
+    buffer = plomp.PlompBuffer(key="binary", timestamp_fn=lambda: next(timestamps))
+    handle = plomp.record_prompt(
+        "café", tags={"s": "x", "b": True, "i": 2**70, "f": 1.5}, buffer=buffer
+    )
+    plomp.record_event(
+        {"nested": [1, {"a": None}]}, tags={"d": {"k": 1}}, buffer=buffer
+    )
+    plomp.record_prompt("pending", tags={"i": 1}, buffer=buffer)
+    plomp.record_event({}, tags={}, buffer=buffer)
+    handle.complete("")
+    buffer.first(2).record(tags={"kind": "query"})
+    for i in range(500):
+        plomp.record_event({"i": i}, tags={"parity": i % 2}, buffer=buffer)
+
+    path = str(tmp_path / "trace.plomp")
+    plomp.write_binary(buffer, path, block_size=64)
+    loaded = plomp.PlompBuffer(key="binary")
+    plomp.read_binary(loaded, path)
+
+    assert loaded.to_dict() == buffer.to_dict()
+    for name in ("timestamps", "timestamp_zones", "completion_timestamps", "latencies"):
+        assert getattr(loaded._store, name) == getattr(buffer._store, name)
+    assert [loaded._store._tzinfos[z] for z in loaded._store.timestamp_zones] == [
+        buffer._store._tzinfos[z] for z in buffer._store.timestamp_zones
+    ]
+    assert loaded.filter(tags_filter={"parity": 1}).matched_indices == (
+        buffer.filter(tags_filter={"parity": 1}).matched_indices
+    )
+
+    with plomp.PlompBinaryReader(path) as reader:
+        assert len(reader) == 505 and reader.key == "binary"
+        assert reader[2].call_trace == buffer[2].call_trace
+        assert reader[-1].event.payload == {"i": 499}
+        assert reader[4].query.matched_indices == [0, 1]
+        assert [item.timestamp for item in reader] == [
+            item.timestamp for item in buffer
+        ]
+        assert [block.count for block in reader.blocks] == [64] * 7 + [57]
+        first = reader.blocks[0]
+        assert first.type_counts == {"prompt": 2, "event": 61, "query": 1}
+        assert first.min_timestamp_ns == buffer.timestamp_ns(0)
+        with pytest.raises(IndexError):
+            reader[505]
+
+    with open(path, "r+b") as f:
+        f.write(b"NOTPLOMP")
+    with pytest.raises(ValueError):
+        plomp.read_binary(plomp.PlompBuffer(), path)
+
+
+def test_binary_rebases_queries_of_evicted_buffers(tmp_path):
+    buffer = plomp.PlompBuffer(max_items=4)
+    for i in range(2):
+        plomp.record_event({"i": i}, buffer=buffer)
+    buffer.first(2).record(tags={})
+    for i in range(3, 5):
+        plomp.record_event({"i": i}, buffer=buffer)
+    buffer.last(2).record(tags={})
+    assert buffer.indices == range(2, 6)
+
+    path = str(tmp_path / "trace.plomp")
+    plomp.write_binary(buffer, path)
+    loaded = plomp.PlompBuffer()
+    plomp.record_event({"i": "existing"}, buffer=loaded)
+    plomp.read_binary(loaded, path)
+
+    assert loaded[1].query.matched_indices == []
+    assert loaded[4].query.matched_indices == [2, 3]
+    assert [item.event.payload["i"] for item in loaded[4].query] == [3, 4]
+    with plomp.PlompBinaryReader(path) as reader:
+        assert reader[3].query.matched_indices == [1, 2]
+
+
+def test_write_json_while_recording(tmp_path):
+    path = tmp_path / "trace.json"
+    buffer = plomp.PlompBuffer(max_items=2000)
+    done = threading.Event()
+
+    def writer():
+        for i in range(100_000):
+            plomp.record_event({"i": i}, tags={"i": i % 7}, buffer=buffer)
+            if done.is_set():
+                break
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(20):
+            plomp.write_json(buffer, str(path))
+            values = [
+                item["data"]["payload"]["i"]
+                for item in json.loads(path.read_text())["buffer_items"]
+            ]
+            # Items evicted while writing are skipped, the rest are in order
+            assert values == sorted(set(values))
+    finally:
+        done.set()
+        thread.join()
+
+
+def test_write_binary_while_recording(tmp_path):
+    path = str(tmp_path / "trace.plomp")
+    buffer = plomp.PlompBuffer(max_items=2000)
+    done = threading.Event()
+
+    def writer():
+        # Each query is recorded with its own index, after the two events it
+        # matches, whose payloads hold their indices.
+        for index in range(0, 300_000, 3):
+            for i in (index, index + 1):
+                plomp.record_event({"i": i}, tags={"kind": "event"}, buffer=buffer)
+            events = buffer.filter(tags_filter={"kind": "event"})
+            events.last(2).record(tags={"at": index + 2})
+            if done.is_set():
+                break
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(10):
+            plomp.write_binary(buffer, path, block_size=64)
+            loaded = plomp.PlompBuffer()
+            plomp.read_binary(loaded, path)
+            events = {
+                item.event.payload["i"]
+                for item in loaded
+                if item.type_ == plomp.PlompBufferItemType.EVENT
+            }
+            for item in loaded:
+                if item.type_ == plomp.PlompBufferItemType.QUERY:
+                    at = item.tags["at"]
+                    expected = [i for i in (at - 2, at - 1) if i in events]
+                    matched = [match.event.payload["i"] for match in item.query]
+                    assert matched == expected
+    finally:
+        done.set()
+        thread.join()
+
+
+def test_binary_rebases_queries_across_evictions_while_writing(tmp_path, monkeypatch):
+    from plomp import _binary
+
+    path = str(tmp_path / "trace.plomp")
+    buffer = plomp.PlompBuffer(max_items=6)
+    for i in range(4):
+        plomp.record_event({"i": i}, buffer=buffer)
+    buffer.where(plomp.col.type == "event").record(tags={})
+    plomp.record_event({"i": 5}, buffer=buffer)
+
+    block_struct = _binary._BLOCK
+
+    class EvictAfterFirstBlock:
+        # Records (and so evicts) items once the first block has been written.
+        def pack(self, *fields):
+            if fields[0] == _binary._HEADER.size:
+                for i in range(6, 10):
+                    plomp.record_event({"i": i}, buffer=buffer)
+            return block_struct.pack(*fields)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(_binary, "_BLOCK", EvictAfterFirstBlock())
+        plomp.write_binary(buffer, path, block_size=2)
+
+    loaded = plomp.PlompBuffer()
+    plomp.read_binary(loaded, path)
+    assert [item.type_.value for item in loaded] == ["event", "event", "query", "event"]
+    assert [item.event.payload["i"] for item in loaded[2].query] == [0, 1]
+    with plomp.PlompBinaryReader(path) as reader:
+        assert [block.first_index for block in reader.blocks] == [0, 4]